@@ -0,0 +1,143 @@
+"""
+Benchmark the writing of cutout images.
+
+Compares the original pyplot rendering (figure, imshow, title and savefig
+with bbox_inches="tight") with the direct PIL writer in
+scantde.utils.cutouts, on synthetic PS1 (PNG) and Legacy Survey (JPEG)
+cutouts, without any network access.
+
+Set SCANTDE_DATA_DIR to a scratch directory, as importing scantde creates
+its output directories there.
+
+Usage: python benchmarks/bench_cutouts.py [--n-sources 300]
+"""
+import argparse
+import io
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import matplotlib
+matplotlib.use("Agg")
+import matplotlib.pyplot as plt
+import numpy as np
+from PIL import Image
+
+from scantde.utils.cutouts import CUTOUT_TITLES, save_cutout
+
+N_SOURCES = 300
+
+
+def make_cutouts(n_sources: int, seed: int = 42) -> list[tuple[str, bytes]]:
+    """
+    Make encoded synthetic cutouts, as returned by the cutout services
+
+    :param n_sources: Number of sources
+    :param seed: Random seed
+    :return: List of (cutout type, encoded image)
+    """
+    rng = np.random.default_rng(seed)
+    cutouts = []
+    for i in range(n_sources):
+        for cutout_type, size, fmt in [("ps1", 240, "PNG"), ("legacy_survey", 256, "JPEG")]:
+            y, x = np.mgrid[:size, :size] - size / 2
+            galaxy = 200. * np.exp(-(x ** 2 + y ** 2) / (2. * rng.uniform(5., 30.) ** 2))
+            data = galaxy[..., None] + rng.normal(30., 10., (size, size, 3))
+            img = Image.fromarray(np.clip(data, 0, 255).astype(np.uint8))
+            buf = io.BytesIO()
+            img.save(buf, format=fmt)
+            cutouts.append((cutout_type, buf.getvalue()))
+    return cutouts
+
+
+def save_cutout_pyplot(img: Image.Image, cutout_type: str, cutout_path: Path):
+    """
+    Original implementation, rendering through pyplot
+
+    :param img: Image
+    :param cutout_type: Type of cutout image
+    :param cutout_path: Output path
+    :return: None
+    """
+    plt.figure(figsize=(2.1, 2.1), dpi=120)
+    plt.imshow(np.asarray(img))
+    plt.title(CUTOUT_TITLES[cutout_type], fontsize=12)
+    plt.axis('off')
+    plt.tight_layout()
+    plt.savefig(cutout_path, bbox_inches="tight")
+    plt.close()
+
+
+def time_writer(
+    writer, cutouts: list[tuple[str, bytes]], out_dir: Path, suffix: str,
+) -> dict:
+    """
+    Time a cutout writer, and measure its peak memory and output size
+
+    :param writer: Function of (image, cutout type, output path)
+    :param cutouts: Encoded cutouts
+    :param out_dir: Output directory
+    :param suffix: Suffix of the output files
+    :return: Dictionary of timings
+    """
+    out_dir.mkdir(parents=True, exist_ok=True)
+    paths = [out_dir / f"{i}{suffix}" for i in range(len(cutouts))]
+
+    # Warm up, e.g. font loading
+    writer(Image.open(io.BytesIO(cutouts[0][1])), cutouts[0][0], paths[0])
+
+    t0 = time.perf_counter()
+    for (cutout_type, data), path in zip(cutouts, paths):
+        writer(Image.open(io.BytesIO(data)), cutout_type, path)
+    duration = time.perf_counter() - t0
+
+    tracemalloc.start()
+    for (cutout_type, data), path in zip(cutouts[:20], paths[:20]):
+        writer(Image.open(io.BytesIO(data)), cutout_type, path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "time": duration,
+        "per_image": 1000. * duration / len(cutouts),
+        "peak_mb": peak / 1e6,
+        "size_kb": sum(x.stat().st_size for x in paths) / len(paths) / 1e3,
+    }
+
+
+def run(n_sources: int):
+    cutouts = make_cutouts(n_sources)
+
+    def save_cutout_pil(img, cutout_type, path):
+        save_cutout(img, path, label=CUTOUT_TITLES[cutout_type])
+
+    writers = {
+        "pyplot": (save_cutout_pyplot, ".png"),
+        "PIL png": (save_cutout_pil, ".png"),
+        "PIL webp": (save_cutout_pil, ".webp"),
+    }
+
+    print(f"{len(cutouts)} cutouts for {n_sources} sources")
+    print(
+        f"{'writer':>10} {'time [s]':>9} {'ms/image':>9} {'speedup':>8} "
+        f"{'peak [MB]':>10} {'size [kB]':>10}"
+    )
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        t_ref = None
+        for name, (writer, suffix) in writers.items():
+            out_dir = Path(tmp_dir) / name.replace(" ", "_")
+            res = time_writer(writer, cutouts, out_dir, suffix=suffix)
+            t_ref = t_ref or res["time"]
+            print(
+                f"{name:>10} {res['time']:9.2f} {res['per_image']:9.2f} "
+                f"{t_ref / res['time']:7.1f}x {res['peak_mb']:10.2f} {res['size_kb']:10.1f}"
+            )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--n-sources", type=int, default=N_SOURCES)
+    args = parser.parse_args()
+    run(n_sources=args.n_sources)
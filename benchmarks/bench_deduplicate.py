@@ -0,0 +1,94 @@
+"""
+Benchmark the de-duplication stage of apply_algorithmic_cuts.
+
+Compares the original per-name loop with the columnar implementation in
+scantde.selections.utils.deduplicate, for nights of 1k to 200k alerts.
+
+Usage: python benchmarks/bench_deduplicate.py [--max-loop N]
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from scantde.selections.utils.deduplicate import deduplicate_sources
+
+SIZES = [1_000, 5_000, 20_000, 50_000, 100_000, 200_000]
+ALERTS_PER_SOURCE = 3
+
+
+def make_alerts(n_alerts: int, seed: int = 42) -> pd.DataFrame:
+    """
+    Make a synthetic table of alerts, with several alerts per source
+
+    :param n_alerts: Number of alerts
+    :param seed: Random seed
+    :return: DataFrame of alerts
+    """
+    rng = np.random.default_rng(seed)
+    n_sources = max(1, n_alerts // ALERTS_PER_SOURCE)
+    names = np.array([f"ZTF25{i:07d}" for i in range(n_sources)])
+    df = pd.DataFrame({
+        "ztf_name": names[rng.integers(0, n_sources, n_alerts)],
+        "jd": 2460800.5 + rng.random(n_alerts),
+        "ra": rng.uniform(0., 360., n_alerts),
+        "dec": rng.uniform(-30., 90., n_alerts),
+        "magpsf": rng.normal(19., 1., n_alerts),
+        "fid": rng.integers(1, 3, n_alerts),
+        "is_tde": rng.random(n_alerts) < 0.001,
+    })
+    df["name"] = df["ztf_name"]
+    return df
+
+
+def deduplicate_loop(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Original implementation, one boolean mask per unique name
+
+    :param df: DataFrame of alerts
+    :return: DataFrame with one row per source
+    """
+    new = []
+    for name in set(df["ztf_name"]):
+        mask = df["ztf_name"] == name
+        df_cut = df[mask].sort_values(by="jd")
+        new.append(df_cut.iloc[0])
+    return pd.DataFrame(new)
+
+
+def _normalise(df: pd.DataFrame) -> pd.DataFrame:
+    return df.sort_values(by="ztf_name").reset_index(drop=True)
+
+
+def run(max_loop: int):
+    print(f"{'n_alerts':>10} {'n_sources':>10} {'loop [s]':>10} {'columnar [s]':>13} {'speedup':>8}")
+    for n_alerts in SIZES:
+        df = make_alerts(n_alerts)
+
+        t0 = time.perf_counter()
+        new = deduplicate_sources(df)
+        t_new = time.perf_counter() - t0
+
+        if n_alerts <= max_loop:
+            t0 = time.perf_counter()
+            old = deduplicate_loop(df)
+            t_old = time.perf_counter() - t0
+            pd.testing.assert_frame_equal(
+                _normalise(old).astype(new.dtypes), _normalise(new)
+            )
+            old_str, speedup = f"{t_old:10.3f}", f"{t_old / t_new:7.0f}x"
+        else:
+            old_str, speedup = f"{'-':>10}", f"{'-':>8}"
+
+        print(f"{n_alerts:>10} {len(new):>10} {old_str} {t_new:13.4f} {speedup}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--max-loop", type=int, default=20_000,
+        help="Largest night to run with the original (quadratic) loop",
+    )
+    args = parser.parse_args()
+    run(max_loop=args.max_loop)
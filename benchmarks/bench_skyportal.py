@@ -0,0 +1,140 @@
+"""
+Benchmark downloads of source info from SkyPortal, against a local stand-in.
+
+The stand-in serves GET /api/sources/<name> with a fixed latency, and
+returns 429 responses whenever requests arrive faster than its rate limit.
+Compares one request at a time, as in the original download loop, with the
+threaded, rate-limited download in scantde.utils.skyportal.download, and
+checks both write the same cache file.
+
+Set SCANTDE_DATA_DIR to a scratch directory, as the benchmark writes the
+SkyPortal cache files there.
+
+Usage: python benchmarks/bench_skyportal.py [--n-sources 100] [--latency 0.25]
+"""
+import argparse
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+from scantde.utils.skyportal.client import SkyportalClient
+from scantde.utils.skyportal.download import download_from_skyportal, get_skyportal_path
+
+N_SOURCES = 100
+LATENCY = 0.25  # Response time of the stand-in [s]
+SERVER_MAX_RPS = 30  # Requests per second above which the stand-in returns 429
+CLASSES = ["Tidal Disruption Event", "Ia", "AGN"]
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    """
+    Stand-in for the SkyPortal sources endpoint
+    """
+    lock = threading.Lock()
+    window = 0
+    n_window = 0
+    n_rate_limited = 0
+
+    def do_GET(self):
+        name = self.path.rstrip("/").split("/")[-1]
+
+        # Count requests in windows of one second
+        with self.lock:
+            window = int(time.monotonic())
+            if window != StubHandler.window:
+                StubHandler.window, StubHandler.n_window = window, 0
+            StubHandler.n_window += 1
+            limited = StubHandler.n_window > SERVER_MAX_RPS
+            StubHandler.n_rate_limited += int(limited)
+
+        if limited:
+            self.send_response(429)
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        time.sleep(LATENCY)
+        idx = int(name[-4:])
+        data = {
+            "redshift": 0.01 * (idx % 10) if idx % 3 else None,
+            "tns_name": f"2025{idx:04d}" if idx % 2 else None,
+            "classifications": [{"classification": CLASSES[idx % len(CLASSES)]}] * (idx % 2),
+        }
+        body = json.dumps({"status": "success", "data": data}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def time_download(names: list[str], datestr: str, base_url: str, **kwargs) -> float:
+    """
+    Time a download of sources into an empty cache file
+
+    :param names: Source names
+    :param datestr: Night of the cache file
+    :param base_url: URL of the stand-in API
+    :param kwargs: Arguments of download_from_skyportal
+    :return: Duration [s]
+    """
+    get_skyportal_path(datestr).unlink(missing_ok=True)
+    client = SkyportalClient(
+        base_url=base_url,
+        max_requests_per_second=kwargs.get("max_requests_per_second"),
+        pool_size=kwargs.get("n_threads", 1),
+    )
+    t0 = time.perf_counter()
+    download_from_skyportal(names, datestr=datestr, client=client, **kwargs)
+    return time.perf_counter() - t0
+
+
+def run(n_sources: int):
+    os.environ.setdefault("SKYPORTAL_TOKEN", "benchmark")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}/api/"
+
+    names = [f"ZTF25aaa{i:04d}" for i in range(n_sources)]
+
+    try:
+        t_old = time_download(
+            names, "20990101", base_url, n_threads=1, max_requests_per_second=None,
+        )
+        old = pd.read_json(get_skyportal_path("20990101"), orient="records", lines=True)
+
+        print(f"{'threads':>8} {'max rps':>8} {'time [s]':>9} {'speedup':>8} {'429s':>6}")
+        print(f"{1:>8} {'-':>8} {t_old:9.2f} {1:7.1f}x {StubHandler.n_rate_limited:>6}")
+
+        for n_threads, max_rps in [(8, 10.), (16, 25.), (16, 60.)]:
+            StubHandler.n_rate_limited = 0
+            t_new = time_download(
+                names, "20990102", base_url,
+                n_threads=n_threads, max_requests_per_second=max_rps,
+            )
+            new = pd.read_json(get_skyportal_path("20990102"), orient="records", lines=True)
+            pd.testing.assert_frame_equal(old, new)
+            print(
+                f"{n_threads:>8} {max_rps:>8.0f} {t_new:9.2f} {t_old / t_new:7.1f}x "
+                f"{StubHandler.n_rate_limited:>6}"
+            )
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--n-sources", type=int, default=N_SOURCES)
+    parser.add_argument("--latency", type=float, default=LATENCY)
+    args = parser.parse_args()
+    LATENCY = args.latency
+    run(n_sources=args.n_sources)
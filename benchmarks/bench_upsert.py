@@ -0,0 +1,136 @@
+"""
+Benchmark exports of sources to the NuclearSource database.
+
+Compares the original row-by-row session path with the bulk
+INSERT ... ON CONFLICT DO UPDATE path in scantde.database.export, for an
+initial insert followed by an update from a later and an earlier night.
+
+Set SCANTDE_DATA_DIR to a scratch directory, as the benchmark writes to
+the databases there.
+
+Usage: python benchmarks/bench_upsert.py [--sizes 100 1000 10000]
+"""
+import argparse
+import datetime
+import time
+
+import numpy as np
+import pandas as pd
+from sqlmodel import Session, select
+
+from scantde.database.create import check_tables_exist, dispose_engines, get_engine
+from scantde.database.export import update_source_table
+from scantde.database.models import NuclearSource
+from scantde.paths import get_db_path
+
+SIZES = [100, 1_000, 10_000]
+
+
+def make_sources(n_sources: int, datestr: str, seed: int = 42) -> pd.DataFrame:
+    """
+    Make a synthetic table of sources, as passed to update_source_table
+
+    :param n_sources: Number of sources
+    :param datestr: Night of the sources
+    :param seed: Random seed
+    :return: DataFrame of sources
+    """
+    rng = np.random.default_rng(seed)
+    names = [f"ZTF25{i:07d}" for i in range(n_sources)]
+    tdescore = rng.random(n_sources)
+    tdescore[rng.random(n_sources) < 0.2] = np.nan
+    return pd.DataFrame({
+        "name": names,
+        "ztf_name": names,
+        "latest_datestr": datestr,
+        "latest_ra": rng.uniform(0., 360., n_sources),
+        "latest_dec": rng.uniform(-30., 90., n_sources),
+        "latest_mag": rng.normal(19., 1., n_sources),
+        "latest_filter": rng.choice(["g", "r"], n_sources),
+        "first_detected": datetime.datetime(2025, 1, 1),
+        "distpsnr1": rng.random(n_sources),
+        "sgscore1": rng.random(n_sources),
+        "is_tde": rng.random(n_sources) < 0.01,
+        "age": rng.uniform(0., 100., n_sources),
+        "fail_step": rng.choice(["CatWISE cuts", "Has lightcurve data"], n_sources),
+        "tdescore": tdescore,
+        "magpsf": rng.normal(19., 1., n_sources),
+    })
+
+
+def update_source_table_rows(df: pd.DataFrame, selection: str):
+    """
+    Original implementation, one session lookup and commit per row
+
+    :param df: DataFrame of sources
+    :param selection: Selection name
+    :return: None
+    """
+    check_tables_exist(selection=selection)
+    engine = get_engine(selection)
+
+    with Session(engine) as session:
+        for idx, row in df.iterrows():
+            source = session.get(NuclearSource, row["name"])
+            if source is None:
+                source = NuclearSource(**row.to_dict())
+                session.add(source)
+                session.commit()
+            elif int(row["latest_datestr"]) >= int(source.latest_datestr):
+                for key, value in row.to_dict().items():
+                    if key in source.__dict__.keys():
+                        setattr(source, key, value)
+                session.commit()
+
+
+def dump_table(selection: str) -> pd.DataFrame:
+    """
+    Read the NuclearSource table, without the time of insertion
+
+    :param selection: Selection name
+    :return: DataFrame sorted by name
+    """
+    with Session(get_engine(selection)) as session:
+        rows = session.exec(select(NuclearSource)).all()
+    df = pd.DataFrame([x.model_dump() for x in rows])
+    return df.drop(columns=["last_updated"]).sort_values("name").reset_index(drop=True)
+
+
+def time_exports(func, n_sources: int, selection: str) -> float:
+    """
+    Time an insert of new sources, then updates from a later and an earlier
+    night, starting from an empty database
+
+    :param func: Export function
+    :param n_sources: Number of sources
+    :param selection: Selection name
+    :return: Duration [s]
+    """
+    dispose_engines()
+    db_path = get_db_path(selection)
+    for path in [db_path, *db_path.parent.glob(f"{db_path.name}-*")]:
+        path.unlink(missing_ok=True)
+
+    t0 = time.perf_counter()
+    func(make_sources(n_sources, "20250101", seed=1), selection=selection)
+    func(make_sources(n_sources, "20250102", seed=2), selection=selection)
+    func(make_sources(n_sources, "20241231", seed=3), selection=selection)
+    return time.perf_counter() - t0
+
+
+def run(sizes: list[int]):
+    print(f"{'n_sources':>10} {'row-by-row [s]':>15} {'bulk [s]':>10} {'speedup':>8}")
+    for n_sources in sizes:
+        t_old = time_exports(update_source_table_rows, n_sources, "bench_rows")
+        t_new = time_exports(update_source_table, n_sources, "bench_bulk")
+
+        pd.testing.assert_frame_equal(dump_table("bench_rows"), dump_table("bench_bulk"))
+
+        print(f"{n_sources:>10} {t_old:15.3f} {t_new:10.3f} {t_old / t_new:7.0f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    args = parser.parse_args()
+    run(sizes=args.sizes)
@@ -7,83 +7,12 @@ import logging
 from datetime import datetime, timedelta
 
 from scantde.utils import get_current_datestr
-
-from scantde.candidates import get_ztf_candidates, ztf_alerts_path
-from scantde.utils import get_known_tdes
-from scantde.selections.tdescore.apply import apply_tdescore
-from scantde.selections.nohostinfo.apply import apply_tdescore_nohostinfo
-from scantde.selections.offnuclear.apply import apply_tdescore_offnuclear
-from scantde.paths import base_html_dir
+from scantde.night import run_night
+from scantde.backfill import run_backfill, DEFAULT_NIGHT_WORKERS
 
 logger = logging.getLogger(__name__)
 
 
-def run_night(datestr: str | None, skip_lightcurve: bool = False, debug: bool = False):
-    """
-    Run the TDEScore integration for a single date
-    """
-    if datestr is None:
-        datestr = get_current_datestr()
-
-    if (not debug) & (not skip_lightcurve):
-        # Remove the nightly file to force a re-download
-        ztf_cache = ztf_alerts_path(datestr)
-        if ztf_cache.is_file():
-            logger.info(f"Re-downloading initial candidates for {datestr}")
-            ztf_cache.unlink(missing_ok=True)
-        else:
-            logger.info(f"Downloading initial candidates for {datestr}")
-
-    df = get_ztf_candidates(datestr)
-
-    df["tdescore_lc"] = skip_lightcurve
-
-    all_known_tdes = get_known_tdes()
-    logger.info(f"Have {len(all_known_tdes)} known TDEs")
-
-    df["latest_datestr"] = datestr
-    df["source_name"] = df["name"]
-    df.set_index("source_name", inplace=True)
-    df["is_tde"] = df["name"].isin(all_known_tdes)
-
-    df["age_estimate"] = None
-
-    df["tdescore"] = None
-    df["tdescore_best"] = None
-    df["tdescore_high_noise"] = False
-    df["tdescore_lc_score"] = None
-
-    df = df.sort_values(by=["is_tde", "name"], ascending=[False, False])
-    df.reset_index(drop=True, inplace=True)
-
-    if debug:
-        df = df[:2000]
-
-    nightly_output_dir = base_html_dir / datestr
-    nightly_output_dir.mkdir(parents=True, exist_ok=True)
-
-    logger.info(f"Running TDEScore integration for {datestr}")
-
-    # Apply tdescore (classic)
-    proc_df = apply_tdescore(df.copy(), base_output_dir=nightly_output_dir)
-
-    # Do not repeat lightcurve analysis for already processed sources
-    if len(proc_df) > 0:
-        mask = df["ztf_name"].isin(proc_df["ztf_name"])
-        df.loc[mask, "tdescore_lc"] = True
-
-    # Apply tdescore (no host info)
-    proc_df = apply_tdescore_nohostinfo(df.copy(), base_output_dir=nightly_output_dir)
-
-    # Do not repeat lightcurve analysis for already processed sources
-    if len(proc_df) > 0:
-        mask = df["ztf_name"].isin(proc_df["ztf_name"])
-        df.loc[mask, "tdescore_lc"] = True
-
-    # Apply tdescore (offnuclear)
-    apply_tdescore_offnuclear(df.copy(), base_output_dir=nightly_output_dir)
-
-
 def run():
     """
     Run the TDEScore integration for a given date
@@ -104,6 +33,10 @@ def run():
     argparser.add_argument(
         "--debug", help="Run in debug mode", default=False, action="store_true"
     )
+    argparser.add_argument(
+        "-w", "--workers", type=int, default=1, dest="workers",
+        help="Number of processes to run the selections in concurrently"
+    )
     args = argparser.parse_args()
 
     datestr = args.night
@@ -111,7 +44,8 @@ def run():
     run_night(
         datestr=datestr,
         skip_lightcurve=args.skip,
-        debug=args.debug
+        debug=args.debug,
+        n_workers=args.workers,
     )
 
 
@@ -130,6 +64,23 @@ def run_batch():
         type=int, help="Number of nights to ", required=False,
         dest="lookback_nights", default=7
     )
+    argparser.add_argument(
+        "-w", "--workers", type=int, default=4, dest="workers",
+        help="Number of processes used to prefetch data for several nights"
+    )
+    argparser.add_argument(
+        "--selection-workers", type=int, default=1, dest="selection_workers",
+        help="Number of processes to run the selections of each night in"
+    )
+    argparser.add_argument(
+        "--night-workers", type=int, default=DEFAULT_NIGHT_WORKERS, dest="night_workers",
+        help="Maximum number of nights to run at once. Nights sharing sources "
+             "still run in order, and 1 runs every night one after another"
+    )
+    argparser.add_argument(
+        "--restart", default=False, action="store_true",
+        help="Ignore any checkpoint from a previous backfill of these nights"
+    )
     args = argparser.parse_args()
 
     datestr = args.night
@@ -145,8 +96,10 @@ def run_batch():
 
     logger.info(f"Running TDEScore integration for nights: {nights}")
 
-    for datestr in nights:
-        logger.info(f"Running TDEScore integration for {datestr}")
-        run_night(
-            datestr=datestr,
-        )
+    run_backfill(
+        nights,
+        n_workers=args.workers,
+        selection_workers=args.selection_workers,
+        restart=args.restart,
+        night_workers=args.night_workers,
+    )
@@ -0,0 +1,493 @@
+"""
+Module for backfilling the TDEScore integration over many nights.
+
+The work which does not depend on the night being processed is prefetched
+for all nights at once: the candidate queries in a bounded process pool, and
+the catalogue crossmatches in a single process, with each source only
+downloaded once even if it appears on several nights.
+
+The nights are then processed in a bounded process pool, each night in its
+own process. tdescore keeps a single alert history and set of fit outputs
+per source, truncated at the night being processed, so a night only starts
+once every earlier night sharing any of its sources has finished. Writes to
+the data files which tdescore shares between sources (e.g. the catalogue
+caches) are serialised with a lock shared by all processes (see
+scantde.utils.locks).
+
+Progress is checkpointed per night and selection, so an interrupted backfill
+resumes where it stopped.
+"""
+
+import logging
+import logging.handlers
+import multiprocessing
+import queue
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+from pydantic import BaseModel, Field
+
+from scantde.candidates import get_ztf_candidates, ztf_alerts_path
+from scantde.night import run_night
+from scantde.paths import get_backfill_checkpoint_path
+from scantde.selections.run import SELECTIONS, _init_worker
+from scantde.selections.utils.crossmatch import (
+    download_crossmatch_all,
+    download_crossmatch_fast,
+)
+from scantde.selections.utils.shared import select_pool_candidates
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_INTERVAL = 5.  # Time between checkpoints of running nights [s]
+
+# Nights sharing sources still run one after another, whatever the number of
+# workers, so this only bounds how many independent nights run at once
+DEFAULT_NIGHT_WORKERS = 4
+
+# Queue of the selections completed in a night worker, read by the main process
+_progress_queue = None
+
+
+class NightProgress(BaseModel):
+    """
+    A pydantic model for the backfill progress of a single night
+    """
+    datestr: str = Field(min_length=8, max_length=8, description="Night (YYYYMMDD)")
+    prefetched: bool = Field(
+        default=False, description="Whether the candidates have been prefetched"
+    )
+    prefetch_time: float = Field(
+        default=0., ge=0., description="Time spent prefetching candidates [s]"
+    )
+    sources: list[str] | None = Field(
+        default=None,
+        description="Prefetched candidate sources of the night, or None if unknown"
+    )
+    run_time: float = Field(
+        default=0., ge=0., description="Time spent running the night [s]"
+    )
+    selections: dict[str, float] = Field(
+        default_factory=dict,
+        description="Duration of each completed selection [s]"
+    )
+    error: str | None = Field(
+        default=None, description="Error raised by the last attempt, if any"
+    )
+
+    def get_pending(self) -> list[str]:
+        """
+        Get the selections which have not yet been completed
+
+        :return: List of selection names
+        """
+        return [x for x in SELECTIONS if x not in self.selections]
+
+
+class BackfillCheckpoint(BaseModel):
+    """
+    A pydantic model for the progress of a backfill
+    """
+    nights: dict[str, NightProgress] = Field(default_factory=dict)
+
+    @classmethod
+    def load(cls, path: Path, nights: list[str]) -> "BackfillCheckpoint":
+        """
+        Load a checkpoint from file, adding any nights which are missing
+
+        :param path: Path of the checkpoint file
+        :param nights: Nights to backfill
+        :return: Checkpoint
+        """
+        if path.exists():
+            checkpoint = cls.model_validate_json(path.read_text())
+            logger.info(f"Resuming backfill from {path}")
+        else:
+            checkpoint = cls()
+
+        for datestr in nights:
+            checkpoint.nights.setdefault(datestr, NightProgress(datestr=datestr))
+
+        return checkpoint
+
+    def get_dependencies(self, nights: list[str]) -> dict[str, set[str]]:
+        """
+        Get the earlier nights which share sources with each night, and so
+        must finish before it starts. Nights with unknown sources depend on
+        all earlier nights.
+
+        :param nights: Nights to run, in chronological order
+        :return: Earlier nights, for each night
+        """
+        dependencies = {}
+        for i, datestr in enumerate(nights):
+            sources = self.nights[datestr].sources
+            dependencies[datestr] = set()
+            for earlier in nights[:i]:
+                earlier_sources = self.nights[earlier].sources
+                if (
+                    (sources is None)
+                    or (earlier_sources is None)
+                    or (not set(sources).isdisjoint(earlier_sources))
+                ):
+                    dependencies[datestr].add(earlier)
+        return dependencies
+
+    def save(self, path: Path):
+        """
+        Save the checkpoint to file, replacing it atomically
+
+        :param path: Path of the checkpoint file
+        :return: None
+        """
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(self.model_dump_json(indent=2))
+        tmp_path.replace(path)
+
+    def get_summary(self) -> pd.DataFrame:
+        """
+        Get a summary of the durations of each night
+
+        :return: DataFrame with one row per night
+        """
+        rows = []
+        for datestr, night in sorted(self.nights.items()):
+            rows.append({
+                "datestr": datestr,
+                "complete": len(night.get_pending()) == 0,
+                "prefetch_time": night.prefetch_time,
+                "run_time": night.run_time,
+                **{f"{k}_time": night.selections.get(k) for k in SELECTIONS},
+                "error": night.error,
+            })
+        return pd.DataFrame(rows)
+
+
+def prefetch_night(datestr: str, refresh: bool = True) -> tuple[str, pd.DataFrame, float]:
+    """
+    Download the initial candidates for a night, and select those which can
+    pass the algorithmic cuts of any selection
+
+    :param datestr: Night to prefetch
+    :param refresh: Whether to re-download the initial candidates
+    :return: Night, table of candidates and duration [s]
+    """
+    t_start = time.perf_counter()
+
+    if refresh:
+        ztf_alerts_path(datestr).unlink(missing_ok=True)
+
+    df = get_ztf_candidates(datestr)
+
+    if len(df) > 0:
+        # Only used to sort sources, known TDEs are assigned in run_night
+        df["is_tde"] = False
+        df = select_pool_candidates(df)
+
+    return datestr, df, time.perf_counter() - t_start
+
+
+def prefetch_crossmatch(df: pd.DataFrame) -> int:
+    """
+    Download the catalogue crossmatch data for a table of sources
+
+    :param df: Table of sources
+    :return: Number of sources
+    """
+    download_crossmatch_fast(df.copy())
+    download_crossmatch_all(df.copy())
+    return len(df)
+
+
+def prefetch_nights(
+    checkpoint: BackfillCheckpoint,
+    checkpoint_path: Path,
+    nights: list[str],
+    n_workers: int,
+):
+    """
+    Prefetch the candidates and crossmatch data for several nights at once
+
+    :param checkpoint: Backfill checkpoint
+    :param checkpoint_path: Path of the checkpoint file
+    :param nights: Nights to prefetch
+    :param n_workers: Maximum number of processes
+    :return: None
+    """
+    if len(nights) == 0:
+        return
+
+    logger.info(f"Prefetching candidates for {len(nights)} nights")
+
+    tables = []
+
+    with ProcessPoolExecutor(max_workers=min(n_workers, len(nights))) as executor:
+        futures = [executor.submit(prefetch_night, x) for x in nights]
+        for datestr, future in zip(nights, futures):
+            try:
+                _, df, duration = future.result()
+            except Exception as e:
+                logger.error(f"Failed to prefetch candidates for {datestr}: {e}")
+                continue
+
+            night = checkpoint.nights[datestr]
+            night.prefetched = True
+            night.prefetch_time = duration
+            night.sources = sorted(df["ztf_name"]) if len(df) > 0 else []
+            checkpoint.save(checkpoint_path)
+            tables.append(df)
+
+    tables = [x for x in tables if len(x) > 0]
+    if len(tables) == 0:
+        return
+
+    # Each source is only downloaded once, even if it appears on several nights
+    df = pd.concat(tables).drop_duplicates(subset="ztf_name").reset_index(drop=True)
+
+    # The catalogue caches of tdescore are shared between sources, so they
+    # are downloaded in a single process rather than in concurrent chunks
+    logger.info(f"Prefetching crossmatch data for {len(df)} unique sources")
+
+    try:
+        prefetch_crossmatch(df)
+    except Exception as e:
+        logger.error(f"Failed to prefetch crossmatch data: {e}")
+
+
+def _init_night_worker(
+    log_queue: multiprocessing.Queue,
+    level: int,
+    progress_queue: multiprocessing.Queue,
+    lock,
+):
+    """
+    Set up a process running nights: forward its log records and completed
+    selections to the main process, and share the tdescore write lock
+
+    :param log_queue: Queue of log records, read by the main process
+    :param level: Logging level of the root logger
+    :param progress_queue: Queue of completed selections, read by the main process
+    :param lock: Lock for writes to shared tdescore data
+    :return: None
+    """
+    global _progress_queue
+    _init_worker(log_queue, level, lock)
+    _progress_queue = progress_queue
+
+
+def run_backfill_night(
+    datestr: str,
+    selections: list[str],
+    refresh_candidates: bool,
+    selection_workers: int = 1,
+    on_complete: Callable[[str, float], None] | None = None,
+) -> tuple[dict[str, float], float, str | None]:
+    """
+    Run a single night of a backfill, possibly in a worker process
+
+    :param datestr: Night to run
+    :param selections: Names of the selections to run
+    :param refresh_candidates: Whether to re-download the initial candidates
+    :param selection_workers: Number of processes to run the selections in
+    :param on_complete: Function called with the name and duration of each
+        selection, or None to send them to the main process
+    :return: Duration of each completed selection [s], total duration [s],
+        and the error raised, if any
+    """
+    durations = {}
+
+    def record(selection: str, duration: float):
+        durations[selection] = duration
+        if on_complete is not None:
+            on_complete(selection, duration)
+        elif _progress_queue is not None:
+            _progress_queue.put((datestr, selection, duration))
+
+    logger.info(f"Running TDEScore integration for {datestr}, selections {selections}")
+
+    t_start = time.perf_counter()
+    error = None
+    try:
+        run_night(
+            datestr=datestr,
+            n_workers=selection_workers,
+            selections=selections,
+            refresh_candidates=refresh_candidates,
+            on_complete=record,
+        )
+    except Exception as e:
+        logger.exception(f"Backfill failed for {datestr}")
+        error = str(e)
+
+    return durations, time.perf_counter() - t_start, error
+
+
+def run_nights(
+    checkpoint: BackfillCheckpoint,
+    checkpoint_path: Path,
+    nights: list[str],
+    n_workers: int = 1,
+    selection_workers: int = 1,
+):
+    """
+    Run several nights, concurrently where they do not share any sources
+
+    :param checkpoint: Backfill checkpoint
+    :param checkpoint_path: Path of the checkpoint file
+    :param nights: Nights to run, in chronological order
+    :param n_workers: Maximum number of nights to run at once
+    :param selection_workers: Number of processes to run the selections of
+        each night in
+    :return: None
+    """
+
+    def record(datestr: str, result: tuple[dict[str, float], float, str | None]):
+        durations, run_time, error = result
+        night = checkpoint.nights[datestr]
+        night.selections.update(durations)
+        night.run_time += run_time
+        night.error = error
+        checkpoint.save(checkpoint_path)
+
+    n_workers = min(n_workers, len(nights))
+
+    if n_workers < 2:
+        for datestr in nights:
+            night = checkpoint.nights[datestr]
+
+            def on_complete(selection: str, duration: float):
+                night.selections[selection] = duration
+                checkpoint.save(checkpoint_path)
+
+            record(datestr, run_backfill_night(
+                datestr, selections=night.get_pending(),
+                refresh_candidates=not night.prefetched,
+                selection_workers=selection_workers, on_complete=on_complete,
+            ))
+        return
+
+    dependencies = checkpoint.get_dependencies(nights)
+    logger.info(f"Running {len(nights)} nights with {n_workers} workers")
+
+    log_queue = multiprocessing.Queue()
+    progress_queue = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(
+        log_queue, *logging.getLogger().handlers, respect_handler_level=True
+    )
+    listener.start()
+
+    def save_progress():
+        updated = False
+        while True:
+            try:
+                datestr, selection, duration = progress_queue.get_nowait()
+            except queue.Empty:
+                break
+            checkpoint.nights[datestr].selections[selection] = duration
+            updated = True
+        if updated:
+            checkpoint.save(checkpoint_path)
+
+    waiting = list(nights)
+    running = {}
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=_init_night_worker,
+            initargs=(
+                log_queue, logging.getLogger().level, progress_queue,
+                multiprocessing.Lock(),
+            ),
+        ) as executor:
+            while (len(waiting) > 0) or (len(running) > 0):
+                unfinished = set(waiting) | set(running.values())
+                for datestr in list(waiting):
+                    if len(running) >= n_workers:
+                        break
+                    if len(dependencies[datestr] & unfinished) > 0:
+                        continue
+                    night = checkpoint.nights[datestr]
+                    future = executor.submit(
+                        run_backfill_night, datestr,
+                        selections=night.get_pending(),
+                        refresh_candidates=not night.prefetched,
+                        selection_workers=selection_workers,
+                    )
+                    running[future] = datestr
+                    waiting.remove(datestr)
+
+                done, _ = wait(
+                    running, timeout=PROGRESS_INTERVAL, return_when=FIRST_COMPLETED
+                )
+                save_progress()
+
+                for future in done:
+                    datestr = running.pop(future)
+                    try:
+                        record(datestr, future.result())
+                    except Exception as e:
+                        logger.error(f"Backfill worker failed for {datestr}: {e}")
+                        record(datestr, ({}, 0., str(e)))
+    finally:
+        listener.stop()
+
+
+def run_backfill(
+    nights: list[str],
+    n_workers: int = 4,
+    selection_workers: int = 1,
+    checkpoint_path: Path | None = None,
+    restart: bool = False,
+    night_workers: int = DEFAULT_NIGHT_WORKERS,
+) -> pd.DataFrame:
+    """
+    Run the TDEScore integration for many nights, resuming from a checkpoint
+
+    :param nights: Nights to backfill (YYYYMMDD)
+    :param n_workers: Maximum number of processes used for prefetching
+    :param selection_workers: Number of processes to run the selections in
+    :param checkpoint_path: Path of the checkpoint file, or None for the default
+    :param restart: Whether to ignore any existing checkpoint
+    :param night_workers: Maximum number of nights to run at once. Nights
+        sharing sources are run in order regardless, and 1 runs every night
+        one after another
+    :return: Summary of the durations of each night
+    """
+    nights = sorted(set(nights))
+
+    if checkpoint_path is None:
+        checkpoint_path = get_backfill_checkpoint_path(nights)
+
+    if restart:
+        checkpoint_path.unlink(missing_ok=True)
+
+    checkpoint = BackfillCheckpoint.load(checkpoint_path, nights)
+
+    pending = [x for x in nights if len(checkpoint.nights[x].get_pending()) > 0]
+    logger.info(
+        f"Backfilling {len(pending)} of {len(nights)} nights, "
+        f"checkpointing to {checkpoint_path}"
+    )
+
+    prefetch_nights(
+        checkpoint, checkpoint_path,
+        nights=[x for x in pending if not checkpoint.nights[x].prefetched],
+        n_workers=n_workers,
+    )
+
+    run_nights(
+        checkpoint, checkpoint_path, nights=pending,
+        n_workers=night_workers, selection_workers=selection_workers,
+    )
+
+    summary = checkpoint.get_summary()
+    summary_path = checkpoint_path.with_name(f"{checkpoint_path.stem}_summary.json")
+    summary.to_json(summary_path, orient="records", indent=2)
+
+    logger.info(f"Backfill summary (saved to {summary_path}):\n{summary}")
+
+    return summary
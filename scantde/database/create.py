@@ -1,16 +1,62 @@
 from sqlmodel import SQLModel, create_engine
 from scantde.paths import get_db_path
+from scantde.database.models import NuclearSource
+from scantde.database.healpix import radec_to_healpix
 import logging
+import os
 import sqlalchemy as sa
 
 logger = logging.getLogger(__name__)
 
-def get_engine(selection: str):
+# Applied to every new SQLite connection
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",  # Readers do not block the writer, and vice versa
+    "synchronous": "NORMAL",  # Safe with WAL, without an fsync per commit
+    "mmap_size": 256 * 1024 * 1024,  # Memory-mapped I/O [bytes]
+    "busy_timeout": 30000,  # Wait for locks rather than failing [ms]
+}
+
+# Engines and schema checks are cached once per process and selection
+_engines: dict[str, sa.Engine] = {}
+_checked_selections: set[str] = set()
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Configure a new SQLite connection
+    """
+    cursor = dbapi_connection.cursor()
+    for key, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {key}={value}")
+    cursor.close()
+
+
+def get_engine(selection: str) -> sa.Engine:
     """
     Get the SQLAlchemy engine for the database
     """
-    sqlite_url = f"sqlite:///{get_db_path(selection)}"
-    return create_engine(sqlite_url, echo=False)
+    engine = _engines.get(selection)
+    if engine is None:
+        sqlite_url = f"sqlite:///{get_db_path(selection)}"
+        engine = create_engine(sqlite_url, echo=False)
+        sa.event.listen(engine, "connect", set_sqlite_pragmas)
+        _engines[selection] = engine
+    return engine
+
+
+def dispose_engines():
+    """
+    Drop all cached engines, e.g. in a forked process, which must not reuse
+    the connections of its parent
+    """
+    for engine in _engines.values():
+        engine.dispose(close=False)
+    _engines.clear()
+    _checked_selections.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=dispose_engines)
 
 
 def create_db_and_tables(selection: str):
@@ -23,13 +69,96 @@ def create_db_and_tables(selection: str):
 
 def check_tables_exist(selection: str):
     """
-    Check if the tables exist, if not create them
+    Check if the tables exist, if not create them.
+    The check only runs once per process and selection.
 
     :param selection: str, the selection type (e.g., 'tdescore')
     """
+    if selection in _checked_selections:
+        return
+
     engine = get_engine(selection)
     insp = sa.inspect(engine)
     tables = insp.get_table_names()
     if len(tables) == 0:
         logger.info("No DB tables found, creating them now!")
-        create_db_and_tables(selection=selection)
\ No newline at end of file
+        create_db_and_tables(selection=selection)
+    else:
+        added = add_missing_columns(engine, insp)
+        if "healpix" in added.get(NuclearSource.__tablename__, []):
+            fill_healpix(engine)
+        create_missing_indexes(engine, sa.inspect(engine))
+
+    _checked_selections.add(selection)
+
+
+def add_missing_columns(engine: sa.Engine, insp: sa.Inspector) -> dict[str, list[str]]:
+    """
+    Add any columns of the models which are missing from existing tables.
+    New columns are nullable, with no default.
+
+    :param engine: SQLAlchemy engine
+    :param insp: Inspector for the engine
+    :return: Names of the added columns, for each table
+    """
+    tables = insp.get_table_names()
+    added = {}
+    with engine.begin() as conn:
+        for table in SQLModel.metadata.sorted_tables:
+            if table.name not in tables:
+                continue
+            existing = {x["name"] for x in insp.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    logger.info(f"Adding missing column {table.name}.{column.name}")
+                    col_type = column.type.compile(dialect=engine.dialect)
+                    conn.exec_driver_sql(
+                        f"ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}"
+                    )
+                    added.setdefault(table.name, []).append(column.name)
+    return added
+
+
+def fill_healpix(engine: sa.Engine):
+    """
+    Fill the HEALPix pixel of sources which have a position but no pixel
+
+    :param engine: SQLAlchemy engine
+    """
+    table = NuclearSource.__table__
+    with engine.begin() as conn:
+        rows = conn.execute(
+            sa.select(table.c.name, table.c.latest_ra, table.c.latest_dec).where(
+                table.c.healpix.is_(None),
+                table.c.latest_ra.is_not(None),
+                table.c.latest_dec.is_not(None),
+            )
+        ).all()
+        if len(rows) == 0:
+            return
+        logger.info(f"Filling HEALPix pixels of {len(rows)} sources")
+        names, ras, decs = zip(*rows)
+        pixels = radec_to_healpix(ras, decs)
+        conn.execute(
+            table.update().where(table.c.name == sa.bindparam("b_name")),
+            [{"b_name": x, "healpix": int(y)} for x, y in zip(names, pixels)],
+        )
+
+
+def create_missing_indexes(engine: sa.Engine, insp: sa.Inspector):
+    """
+    Create any indexes of the models which are missing from existing tables,
+    e.g. for databases created before the indexes were added
+
+    :param engine: SQLAlchemy engine
+    :param insp: Inspector for the engine
+    """
+    tables = insp.get_table_names()
+    for table in SQLModel.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {x["name"] for x in insp.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                logger.info(f"Creating missing index {index.name}")
+                index.create(engine)
@@ -1,7 +1,9 @@
 import pandas as pd
 from scantde.database.models import NuclearSource
-from sqlmodel import Session
+import sqlalchemy as sa
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from scantde.database.create import get_engine, check_tables_exist
+from scantde.database.healpix import radec_to_healpix
 from erfa.core import ErfaError
 
 from astropy.time import Time
@@ -11,44 +13,74 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+def get_upsert_records(df: pd.DataFrame) -> tuple[list[dict], list[str]]:
+    """
+    Convert a DataFrame to records for the NuclearSource table
+
+    Only columns of the table are kept, missing values are converted to None,
+    and fields missing from the DataFrame are given their default values.
+
+    :param df: pd.DataFrame
+    :return: List of records, and the columns taken from the DataFrame
+    """
+    table = NuclearSource.__table__
+    columns = [x.name for x in table.columns if x.name in df.columns]
+
+    sub = df[columns].astype(object)
+    sub = sub.where(pd.notna(sub), None)
+    records = sub.to_dict(orient="records")
+
+    for name, field in NuclearSource.model_fields.items():
+        if name in columns:
+            continue
+        if field.default_factory is not None:
+            for record in records:
+                record[name] = field.default_factory()
+        elif field.default is not None:
+            for record in records:
+                record[name] = field.default
+
+    return records, columns
+
+
 def update_source_table(df: pd.DataFrame, selection: str, update_existing: bool = True):
     """
-    Update the source table with new sources
+    Update the source table with new sources, in a single transaction
+
+    New sources are inserted, and existing sources are only overwritten if
+    the new row is for the same or a later night ('latest_datestr').
 
     :param df: pd.DataFrame
     :param selection: str, the selection type (e.g., 'tdescore')
     :param update_existing: bool
     """
+    if len(df) == 0:
+        return
+
     check_tables_exist(selection=selection)
     engine = get_engine(selection)
 
-    with Session(engine) as session:
-        for idx, row in df.iterrows():
-
-            source = session.get(NuclearSource, row["name"])
-
-            if source is None:
-                # This means the source does not exist
-                source = NuclearSource(
-                    **row.to_dict()
-                )
-                session.add(source)
-                session.commit()
-            elif update_existing:
-                new_datestr = int(row["latest_datestr"])
-                db_datestr =  int(source.latest_datestr)
-                if new_datestr >= db_datestr:
-                    for key, value in row.to_dict().items():
-                        if key in source.__dict__.keys():
-                            setattr(source, key, value)
-                    session.commit()
-                else:
-                    logger.debug(
-                        f"Skipping update for {row['name']}, because it is for "
-                        f"an older night {new_datestr} "
-                        f"than the existing entry {db_datestr}")
-            else:
-                logger.debug(f"Source {row['name']} already exists")
+    records, columns = get_upsert_records(df)
+
+    table = NuclearSource.__table__
+    stmt = sqlite_insert(table)
+
+    if update_existing:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.name],
+            set_={x: stmt.excluded[x] for x in columns if x != "name"},
+            where=(
+                sa.cast(table.c.latest_datestr, sa.Integer)
+                <= sa.cast(stmt.excluded.latest_datestr, sa.Integer)
+            ),
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=[table.c.name])
+
+    with engine.begin() as conn:
+        conn.execute(stmt, records)
+
+    logger.debug(f"Upserted {len(records)} sources to the {selection} database")
 
 
 # def update_night_table(df: pd.DataFrame, datestr: str, n_initial: int = 0):
@@ -95,6 +127,7 @@ def export_to_db(df: pd.DataFrame, selection: str, update_existing: bool = True)
         df["name"] = df["ztf_name"]
         df["latest_ra"] = df["ra"]
         df["latest_dec"] = df["dec"]
+        df["healpix"] = radec_to_healpix(df["ra"], df["dec"])
         df["latest_mag"] = df["magpsf"]
         df["latest_filter"] = df["fid"].map({1: "g", 2: "r", 3: "i"})
 
@@ -0,0 +1,86 @@
+"""
+HEALPix indexing of source positions, used for cone searches of the database.
+
+Each source is assigned a NESTED pixel at HEALPIX_NSIDE. In the NESTED
+scheme, the pixel p at a coarser nside = HEALPIX_NSIDE / 2**k contains
+exactly the fine pixels [p * 4**k, (p + 1) * 4**k), so a cone of any size
+can be covered by a few contiguous ranges of the indexed column.
+"""
+import numpy as np
+from astropy import units as u
+from astropy_healpix import HEALPix
+
+HEALPIX_ORDER = 12
+HEALPIX_NSIDE = 2 ** HEALPIX_ORDER  # ~0.86 arcmin pixels
+
+MAX_RANGES = 64  # Maximum number of coarse pixels covering a cone
+
+
+def radec_to_healpix(ra: np.ndarray, dec: np.ndarray) -> np.ndarray:
+    """
+    Get the NESTED HEALPix pixel of each position
+
+    :param ra: Right ascension [deg]
+    :param dec: Declination [deg]
+    :return: Array of pixel indices
+    """
+    hp = HEALPix(nside=HEALPIX_NSIDE, order="nested")
+    return hp.lonlat_to_healpix(
+        np.asarray(ra, dtype=float) * u.deg, np.asarray(dec, dtype=float) * u.deg
+    ).astype(np.int64)
+
+
+def get_cone_ranges(ra: float, dec: float, radius: float) -> list[tuple[int, int]]:
+    """
+    Get ranges of fine pixels which together cover a cone.
+    The ranges may include pixels outside the cone, so matches must still
+    be filtered by their separation.
+
+    :param ra: Right ascension of the centre [deg]
+    :param dec: Declination of the centre [deg]
+    :param radius: Radius of the cone [deg]
+    :return: List of (start, stop) ranges, with stop exclusive
+    """
+    # Use the finest order at which a few pixels still cover the cone
+    pixels = None
+    for order in range(HEALPIX_ORDER + 1):
+        hp = HEALPix(nside=2 ** order, order="nested")
+        new = hp.cone_search_lonlat(ra * u.deg, dec * u.deg, radius * u.deg)
+        if (pixels is not None) and (len(new) > MAX_RANGES):
+            order -= 1
+            break
+        pixels = new
+
+    shift = 4 ** (HEALPIX_ORDER - order)
+    pixels = np.sort(np.asarray(pixels, dtype=np.int64))
+
+    # Merge neighbouring pixels into contiguous ranges
+    ranges = []
+    for pixel in pixels:
+        start, stop = int(pixel) * shift, (int(pixel) + 1) * shift
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], stop)
+        else:
+            ranges.append((start, stop))
+    return ranges
+
+
+def angular_separation(
+    ra1: np.ndarray, dec1: np.ndarray, ra2: float, dec2: float
+) -> np.ndarray:
+    """
+    Get the angular separation between positions, with the haversine formula
+
+    :param ra1: Right ascension of the positions [deg]
+    :param dec1: Declination of the positions [deg]
+    :param ra2: Right ascension of the reference position [deg]
+    :param dec2: Declination of the reference position [deg]
+    :return: Array of separations [deg]
+    """
+    ra1, dec1 = np.radians(ra1), np.radians(dec1)
+    ra2, dec2 = np.radians(ra2), np.radians(dec2)
+    a = (
+        np.sin((dec1 - dec2) / 2.) ** 2
+        + np.cos(dec1) * np.cos(dec2) * np.sin((ra1 - ra2) / 2.) ** 2
+    )
+    return np.degrees(2. * np.arcsin(np.sqrt(np.clip(a, 0., 1.))))
@@ -1,3 +1,4 @@
+from sqlalchemy import Index
 from sqlmodel import Field, SQLModel
 from typing import Optional
 import datetime
@@ -9,22 +10,27 @@ default_time_field = Field(
 
 
 class NuclearSource(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_nuclearsource_position", "latest_dec", "latest_ra"),
+    )
+
     name: str = Field(primary_key=True)
     first_detected: datetime.datetime = default_time_field
     last_updated: datetime.datetime = default_time_field
-    latest_datestr: str = Field(default=None, min_length=8, max_length=8)
+    latest_datestr: str = Field(default=None, index=True, min_length=8, max_length=8)
     latest_ra: float = Field(default=None)
     latest_dec: float = Field(default=None)
+    healpix: Optional[int] = Field(default=None, index=True)
     latest_mag: float = Field(default=None)
     latest_filter: str = Field(default=None, max_length=1)
     distpsnr1: float = Field(default=None)
     sgscore1: float = Field(default=None)
-    is_tde: bool = Field(default=False)
-    is_junk: bool = Field(default=False)
+    is_tde: bool = Field(default=False, index=True)
+    is_junk: bool = Field(default=False, index=True)
     is_dwarf: bool = Field(default=False)
     age: Optional[float] = Field(default=None)
-    fail_step: Optional[str] = Field(default=None)
-    tdescore: Optional[float] = Field(default=None)
+    fail_step: Optional[str] = Field(default=None, index=True)
+    tdescore: Optional[float] = Field(default=None, index=True)
     tdescore_best: Optional[str] = Field(default=None)
     tdescore_hostfast: Optional[float] = Field(default=None)
     tdescore_host: Optional[float] = Field(default=None)
@@ -0,0 +1,119 @@
+"""
+Module for filtered, paginated queries of the NuclearSource table
+"""
+from pydantic import BaseModel, Field
+from sqlmodel import Session, select, func
+import pandas as pd
+
+from scantde.database import NuclearSource
+from scantde.database.create import get_engine, check_tables_exist
+
+SORT_COLUMNS = ["tdescore", "latest_datestr", "name"]
+
+
+class SourceQuery(BaseModel):
+    """
+    A pydantic model for the filters of a source query
+    """
+    start_datestr: str | None = Field(
+        default=None, min_length=8, max_length=8,
+        description="Earliest night (YYYYMMDD), inclusive"
+    )
+    end_datestr: str | None = Field(
+        default=None, min_length=8, max_length=8,
+        description="Latest night (YYYYMMDD), inclusive"
+    )
+    min_score: float | None = Field(default=None, description="Minimum tdescore")
+    include_junk: bool = Field(default=True, description="Include junk sources")
+    is_tde: bool | None = Field(
+        default=None, description="Only known TDEs (True) or non-TDEs (False)"
+    )
+    fail_step: str | None = Field(
+        default=None, description="Only sources rejected at this stage"
+    )
+    passed: bool | None = Field(
+        default=None,
+        description="Only sources which passed (True) or failed (False) all cuts"
+    )
+    sort_by: str = Field(default="tdescore", description="Column to sort by")
+    descending: bool = Field(default=True, description="Sort in descending order")
+    page: int = Field(default=1, ge=1, description="Page number, starting at 1")
+    page_size: int = Field(default=100, ge=1, le=1000, description="Sources per page")
+
+
+def apply_filters(stmt, query: SourceQuery):
+    """
+    Apply the filters of a query to a select statement
+
+    :param stmt: Select statement
+    :param query: SourceQuery
+    :return: Filtered select statement
+    """
+    if query.start_datestr is not None:
+        stmt = stmt.where(NuclearSource.latest_datestr >= query.start_datestr)
+    if query.end_datestr is not None:
+        stmt = stmt.where(NuclearSource.latest_datestr <= query.end_datestr)
+    if query.min_score is not None:
+        stmt = stmt.where(NuclearSource.tdescore >= query.min_score)
+    if not query.include_junk:
+        stmt = stmt.where(NuclearSource.is_junk == False)  # noqa: E712
+    if query.is_tde is not None:
+        stmt = stmt.where(NuclearSource.is_tde == query.is_tde)
+    if query.fail_step is not None:
+        stmt = stmt.where(NuclearSource.fail_step == query.fail_step)
+    if query.passed is not None:
+        if query.passed:
+            stmt = stmt.where(NuclearSource.fail_step.is_(None))
+        else:
+            stmt = stmt.where(NuclearSource.fail_step.is_not(None))
+    return stmt
+
+
+def query_sources(query: SourceQuery, selection: str) -> tuple[pd.DataFrame, int]:
+    """
+    Query one page of sources matching a set of filters
+
+    :param query: SourceQuery
+    :param selection: str selection type (e.g., 'tdescore')
+    :return: DataFrame of sources on the page, and the total number of matches
+    """
+    if query.sort_by not in SORT_COLUMNS:
+        raise ValueError(f"Cannot sort by '{query.sort_by}', must be one of {SORT_COLUMNS}")
+
+    check_tables_exist(selection=selection)
+    engine = get_engine(selection=selection)
+
+    sort_col = getattr(NuclearSource, query.sort_by)
+    sort_col = sort_col.desc() if query.descending else sort_col.asc()
+
+    stmt = apply_filters(select(NuclearSource), query)
+    stmt = stmt.order_by(sort_col, NuclearSource.name)
+    stmt = stmt.offset((query.page - 1) * query.page_size).limit(query.page_size)
+
+    count_stmt = apply_filters(select(func.count()).select_from(NuclearSource), query)
+
+    with Session(engine) as session:
+        res = session.exec(stmt).all()
+        n_total = session.exec(count_stmt).one()
+
+    df = pd.DataFrame(
+        [x.model_dump() for x in res],
+        columns=list(NuclearSource.model_fields),
+    )
+    return df, n_total
+
+
+def get_fail_steps(selection: str) -> list[str]:
+    """
+    Get the distinct stages at which sources have been rejected
+
+    :param selection: str selection type (e.g., 'tdescore')
+    :return: List of stage names
+    """
+    check_tables_exist(selection=selection)
+    engine = get_engine(selection=selection)
+    stmt = select(NuclearSource.fail_step).where(
+        NuclearSource.fail_step.is_not(None)
+    ).distinct()
+    with Session(engine) as session:
+        return sorted(session.exec(stmt).all())
@@ -1,8 +1,9 @@
-from sqlmodel import Session, select
+from sqlmodel import Session, select, or_
 from scantde.database import NuclearSource
-from scantde.database.create import get_engine
+from scantde.database.create import get_engine, check_tables_exist
+from scantde.database.healpix import get_cone_ranges, angular_separation
 import pandas as pd
-from scantde.io import load_results
+from scantde.io import load_result_row
 
 
 def query_by_name(name: str, selection: str) -> pd.Series:
@@ -32,8 +33,44 @@ def load_by_name(name: str, selection: str) -> pd.Series:
     """
     match = query_by_name(name, selection)
     latest = match.get("latest_datestr", None)
-    df = load_results(latest, selection=selection)
+    return load_result_row(latest, selection=selection, name=name)
 
-    match = df[df["name"] == name]
-    return match.iloc[0] if not match.empty else None
 
+
+def search_by_position(
+    ra: float,
+    dec: float,
+    radius: float,
+    selection: str,
+) -> pd.DataFrame:
+    """
+    Find all sources within a radius of a position, using the HEALPix index
+
+    :param ra: float Right ascension of the centre [deg]
+    :param dec: float Declination of the centre [deg]
+    :param radius: float Search radius [deg]
+    :param selection: str selection type (e.g., 'tdescore')
+    :return: DataFrame of matches with a 'separation' column [deg],
+        sorted by separation
+    """
+    check_tables_exist(selection=selection)
+    engine = get_engine(selection=selection)
+
+    ranges = get_cone_ranges(ra, dec, radius)
+    stmt = select(NuclearSource).where(or_(*[
+        NuclearSource.healpix.between(start, stop - 1) for start, stop in ranges
+    ]))
+
+    with Session(engine) as session:
+        res = session.exec(stmt).all()
+
+    df = pd.DataFrame(
+        [x.model_dump() for x in res],
+        columns=list(NuclearSource.model_fields),
+    )
+    df["separation"] = angular_separation(
+        df["latest_ra"].to_numpy(dtype=float), df["latest_dec"].to_numpy(dtype=float),
+        ra, dec,
+    )
+    df = df[df["separation"] <= radius]
+    return df.sort_values(by="separation").reset_index(drop=True)
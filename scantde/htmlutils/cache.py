@@ -0,0 +1,200 @@
+"""
+Process-level LRU cache of the parsed nightly results, processing logs and
+image manifests, so repeated page loads in the server do not re-read them
+from disk.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+from pydantic import BaseModel, Field
+
+from scantde.htmlutils.manifest import ImageManifest, load_image_manifest
+from scantde.io import results_cache_filename, LEGACY_CACHE_SUFFIX
+from scantde.log import load_processing_log
+from scantde.log.model import ProcStage
+from scantde.paths import get_log_path, get_image_manifest_path
+
+logger = logging.getLogger(__name__)
+
+NIGHTLY_CACHE_SIZE = 64  # Maximum number of cached entries
+
+
+class CacheStats(BaseModel):
+    """
+    A pydantic model for the statistics of one kind of cache entry
+    """
+    hits: int = Field(default=0, ge=0, description="Number of cache hits")
+    misses: int = Field(default=0, ge=0, description="Number of loads from disk")
+    stale: int = Field(
+        default=0, ge=0, description="Number of reloads of modified files"
+    )
+    evictions: int = Field(
+        default=0, ge=0, description="Number of entries evicted to bound the size"
+    )
+    load_time: float = Field(
+        default=0., ge=0., description="Total time spent loading from disk [s]"
+    )
+    hit_time: float = Field(
+        default=0., ge=0., description="Total time spent serving cache hits [s]"
+    )
+
+
+def get_mtime(paths: list[Path]) -> tuple[Path, int]:
+    """
+    Get the first of several candidate files which exists,
+    and its modification time
+
+    :param paths: Candidate paths, in order of preference
+    :return: Path and modification time [ns]
+    """
+    for path in paths:
+        try:
+            return path, path.stat().st_mtime_ns
+        except FileNotFoundError:
+            continue
+    raise FileNotFoundError(f"None of {[str(x) for x in paths]} exist")
+
+
+class NightlyCache:
+    """
+    Size-bounded LRU cache of nightly results, processing logs and
+    image manifests.
+
+    Entries are keyed by kind, night and selection, and reloaded if the
+    modification time of the underlying file changes. Copies of results and
+    logs are returned, so callers are free to modify them.
+    """
+
+    def __init__(self, max_entries: int = NIGHTLY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._cache: OrderedDict[tuple, tuple[Path, int, object]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats: dict[str, CacheStats] = {}
+
+    def _get(self, key: tuple, paths: list[Path], loader: Callable[[], object]) -> object:
+        """
+        Get an entry from the cache, loading it if it is missing or
+        the file has been modified since it was loaded
+
+        :param key: Cache key, starting with the kind of entry
+        :param paths: Candidate paths of the file, in order of preference
+        :param loader: Function to load the entry
+        :return: Cached object
+        """
+        t_start = time.perf_counter()
+        path, mtime = get_mtime(paths)
+
+        with self._lock:
+            stats = self.stats.setdefault(key[0], CacheStats())
+            cached = self._cache.get(key)
+            if (cached is not None) and (cached[:2] == (path, mtime)):
+                self._cache.move_to_end(key)
+                stats.hits += 1
+                stats.hit_time += time.perf_counter() - t_start
+                return cached[2]
+
+        if cached is not None:
+            logger.info(f"{path} has been modified, reloading")
+
+        obj = loader()
+
+        with self._lock:
+            self._cache[key] = (path, mtime, obj)
+            self._cache.move_to_end(key)
+            if cached is not None:
+                stats.stale += 1
+            stats.misses += 1
+            while len(self._cache) > self.max_entries:
+                evicted, _ = self._cache.popitem(last=False)
+                self.stats.setdefault(evicted[0], CacheStats()).evictions += 1
+            stats.load_time += time.perf_counter() - t_start
+
+        return obj
+
+    def get_results(
+        self, datestr: str, selection: str, loader: Callable[[], pd.DataFrame]
+    ) -> pd.DataFrame:
+        """
+        Get the parsed results of a night
+
+        :param datestr: Date string in 'YYYYMMDD' format
+        :param selection: Selection type (e.g., 'tdescore')
+        :param loader: Function to load and parse the results
+        :return: DataFrame of results
+        """
+        paths = [
+            results_cache_filename(datestr, selection),
+            results_cache_filename(datestr, selection, LEGACY_CACHE_SUFFIX),
+        ]
+        df = self._get(("results", datestr, selection), paths, loader)
+        return df.copy()
+
+    def get_processing_log(self, datestr: str, selection: str) -> list[ProcStage]:
+        """
+        Get the processing log of a night
+
+        :param datestr: Date string in 'YYYYMMDD' format
+        :param selection: Selection type (e.g., 'tdescore')
+        :return: List of processing stages
+        """
+        proc_log = self._get(
+            ("log", datestr, selection),
+            [get_log_path(datestr, selection)],
+            lambda: load_processing_log(datestr, selection=selection),
+        )
+        return list(proc_log)
+
+    def get_image_manifest(self, datestr: str) -> ImageManifest | None:
+        """
+        Get the image manifest of a night, which is not copied as it is
+        only read
+
+        :param datestr: Date string in 'YYYYMMDD' format
+        :return: ImageManifest, or None for nights without a manifest
+        """
+        try:
+            return self._get(
+                ("manifest", datestr),
+                [get_image_manifest_path(datestr)],
+                lambda: load_image_manifest(datestr),
+            )
+        except FileNotFoundError:
+            return None
+
+    def clear(self):
+        """
+        Clear all cached entries and statistics
+
+        :return: None
+        """
+        with self._lock:
+            self._cache.clear()
+            self.stats.clear()
+
+    def get_stats(self) -> dict:
+        """
+        Get the cache statistics, with the hit rate of each kind of entry
+
+        :return: Dictionary of statistics
+        """
+        with self._lock:
+            kinds = {}
+            for kind, stats in self.stats.items():
+                n_requests = stats.hits + stats.misses
+                kinds[kind] = {
+                    **stats.model_dump(),
+                    "hit_rate": stats.hits / n_requests if n_requests > 0 else None,
+                }
+            return {
+                "n_entries": len(self._cache),
+                "max_entries": self.max_entries,
+                "kinds": kinds,
+            }
+
+
+nightly_cache = NightlyCache()
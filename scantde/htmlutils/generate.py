@@ -3,11 +3,16 @@ from scantde.paths import sym_dir
 
 from scantde.database.search import load_by_name, query_by_name
 from scantde.io import load_results
-from scantde.log import load_processing_log, merge_processing_logs, update_source_list, update_processing_log
+from scantde.log import ProcStage, merge_processing_logs, update_source_list, update_processing_log
+from scantde.htmlutils.cache import nightly_cache
 from scantde.errors import NoSourcesError
 
-from scantde.htmlutils.make_html import make_html_single, make_daily_html_table
+from scantde.htmlutils.make_html import make_html_single, iter_html_table
+from scantde.htmlutils.header import base_html_header
+from scantde.htmlutils.single import CLASSIFIERS
+from scantde.selections.utils.extinction import ext_keys
 import numpy as np
+from typing import Iterator
 
 import logging
 
@@ -15,6 +20,14 @@ logger = logging.getLogger(__name__)
 
 FALLBACK_COLUMNS = ["name", "tdescore", "tdescore_best", "is_junk", "magpsf", "is_tde"]
 
+# Columns of the nightly results used to filter and render the date pages
+PAGE_COLUMNS = FALLBACK_COLUMNS + [
+    "ra", "dec", "age", "is_dwarf", "thermal_window", "thermal_score",
+    "thermal_log_temp_ll", "thermal_log_temp_ul", "tdescore_lc_score",
+    "skyportal_class", "skyportal_tns_name", "dist_mpc", "best_redshift",
+    "host_r", "host_Mr", "ztf_name",
+] + [f"tdescore_{x}" for x in CLASSIFIERS] + ext_keys
+
 
 def generate_html_by_name(name: str, selection: str) -> str:
     """
@@ -54,33 +67,47 @@ def generate_html_by_name(name: str, selection: str) -> str:
     return html
 
 
-def load_df(datestr: str, selection: str) -> pd.DataFrame:
+def read_df(datestr: str, selection: str) -> pd.DataFrame:
     """
-    Load a DataFrame for a given date string
+    Read a DataFrame for a given date string from disk, with only the columns
+    needed for the date pages
 
     :param datestr: str date string in 'YYYYMMDD' format
     :param selection: str selection type (e.g., 'tdescore')
     :return: DataFrame of results
     """
-    df = load_results(datestr, selection=selection)
+    df = load_results(datestr, selection=selection, columns=PAGE_COLUMNS)
     df = df.copy()
     df["datestr"] = datestr
     df["thermal_window"] = df["thermal_window"].replace({np.nan: None})
     return df
 
 
-def generate_html_by_date(
+def load_df(datestr: str, selection: str) -> pd.DataFrame:
+    """
+    Load a DataFrame for a given date string, from the in-memory cache
+    if the results file has not changed
+
+    :param datestr: str date string in 'YYYYMMDD' format
+    :param selection: str selection type (e.g., 'tdescore')
+    :return: DataFrame of results
+    """
+    return nightly_cache.get_results(
+        datestr, selection, lambda: read_df(datestr, selection=selection)
+    )
+
+
+def select_sources_by_date(
     datestr: str,
     selection: str,
     lookback_days: int = 1,
     min_score: float = 0.01,
     hide_junk: bool = False,
     hide_classified: bool = False,
-    include_cutout: bool = False,
     mode: str = "all"
-) -> str:
+) -> tuple[pd.DataFrame, list[ProcStage]]:
     """
-    Generate HTML for a source by name
+    Select the sources shown on a date page, sorted by score
 
     :param datestr: str date string in 'YYYYMMDD' format
     :param selection: str selection type (e.g., 'tdescore')
@@ -88,9 +115,8 @@ def generate_html_by_date(
     :param lookback_days: int number of days to look back
     :param hide_junk: bool whether to hide old infants
     :param hide_classified: bool whether to hide classified candidates
-    :param include_cutout: bool whether to include cutout images
     :param mode: str mode of operation
-    :return: HTML string
+    :return: DataFrame of sources, and the processing log
     """
     try:
         df = load_df(datestr, selection=selection)
@@ -99,7 +125,7 @@ def generate_html_by_date(
         df = pd.DataFrame(columns=FALLBACK_COLUMNS)
 
     try:
-        proc_log = load_processing_log(datestr, selection=selection)
+        proc_log = nightly_cache.get_processing_log(datestr, selection=selection)
     except FileNotFoundError:
         logger.warning(f"No processing log found for {datestr}")
         proc_log = []
@@ -122,7 +148,7 @@ def generate_html_by_date(
                 if len(old_df) > 0:
                     df = pd.concat([df, old_df], ignore_index=True)
 
-                new_proc_log = load_processing_log(date, selection=selection)
+                new_proc_log = nightly_cache.get_processing_log(date, selection=selection)
                 proc_log = merge_processing_logs([proc_log, new_proc_log])
             except FileNotFoundError:
                 print(f"File not found for date: {date}")
@@ -197,17 +223,84 @@ def generate_html_by_date(
     df.sort_values(by=["tdescore"], ascending=False, inplace=True)
     df.reset_index(drop=True, inplace=True)
 
-    output_dir = sym_dir / "tdescore" / datestr
+    return df, proc_log
+
+
+def iter_html_by_date(
+    datestr: str,
+    selection: str,
+    lookback_days: int = 1,
+    min_score: float = 0.01,
+    hide_junk: bool = False,
+    hide_classified: bool = False,
+    include_cutout: bool = False,
+    mode: str = "all",
+    offset: int = 0,
+    page_size: int | None = None,
+) -> tuple[pd.DataFrame, Iterator[str]]:
+    """
+    Select the sources for a date page, and get an iterator which renders
+    the HTML of one page of them, after the header
 
-    prefix = "static"
+    :param datestr: str date string in 'YYYYMMDD' format
+    :param selection: str selection type (e.g., 'tdescore')
+    :param min_score: float minimum score to filter candidates
+    :param lookback_days: int number of days to look back
+    :param hide_junk: bool whether to hide old infants
+    :param hide_classified: bool whether to hide classified candidates
+    :param include_cutout: bool whether to include cutout images
+    :param mode: str mode of operation
+    :param offset: int position of the first source on the page
+    :param page_size: int number of sources on the page, or None for all
+    :return: DataFrame of all selected sources, and iterator of HTML chunks
+    """
+    df, proc_log = select_sources_by_date(
+        datestr, selection=selection, lookback_days=lookback_days,
+        min_score=min_score, hide_junk=hide_junk,
+        hide_classified=hide_classified, mode=mode,
+    )
 
-    html = make_daily_html_table(
-        source_table=df,
-        output_dir=output_dir,
+    stop = None if page_size is None else offset + page_size
+    chunks = iter_html_table(
+        source_table=df.iloc[offset:stop],
         base_output_dir=sym_dir.parent,
         selection=selection,
         proc_log=proc_log,
-        prefix=prefix,
+        prefix="static",
         include_cutout=include_cutout,
+        offset=offset,
+        n_total=len(df),
+    )
+    return df, chunks
+
+
+def generate_html_by_date(
+    datestr: str,
+    selection: str,
+    lookback_days: int = 1,
+    min_score: float = 0.01,
+    hide_junk: bool = False,
+    hide_classified: bool = False,
+    include_cutout: bool = False,
+    mode: str = "all"
+) -> str:
+    """
+    Generate HTML for all sources on a given date
+
+    :param datestr: str date string in 'YYYYMMDD' format
+    :param selection: str selection type (e.g., 'tdescore')
+    :param min_score: float minimum score to filter candidates
+    :param lookback_days: int number of days to look back
+    :param hide_junk: bool whether to hide old infants
+    :param hide_classified: bool whether to hide classified candidates
+    :param include_cutout: bool whether to include cutout images
+    :param mode: str mode of operation
+    :return: HTML string
+    """
+    df, chunks = iter_html_by_date(
+        datestr, selection=selection, lookback_days=lookback_days,
+        min_score=min_score, hide_junk=hide_junk,
+        hide_classified=hide_classified, include_cutout=include_cutout,
+        mode=mode,
     )
-    return html
\ No newline at end of file
+    return base_html_header(df) + "".join(chunks)
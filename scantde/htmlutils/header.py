@@ -1,6 +1,26 @@
 import pandas as pd
 
 
+def get_source_line(
+    sources: pd.DataFrame,
+) -> str:
+    """
+    Function to generate the summary line of a table of sources
+
+    :param sources: pd.DataFrame Table of sources
+    :return: str HTML
+    """
+    if len(sources) == 0:
+        return ""
+
+    return (
+        f"Search Results: "
+        f"{len(sources)} Transients Passed, "
+        f"including {sources['is_tde'].sum()} known TDEs. <br>"
+        '<hr style="height:2px;border-width:0;color:gray;background-color:gray">'
+    )
+
+
 def base_html_header(
     sources: pd.DataFrame,
 ) -> str:
@@ -10,17 +30,18 @@ def base_html_header(
     :param sources: pd.DataFrame Table of sources
     :return: str HTML
     """
+    return make_html_header(get_source_line(sources))
 
-    if len(sources) == 0:
-        source_line = ""
-    else:
-        source_line = (
-            f"Search Results: "
-            f"{len(sources)} Transients Passed, "
-            f"including {sources['is_tde'].sum()} known TDEs. <br>"
-            '<hr style="height:2px;border-width:0;color:gray;background-color:gray">'
-        )
 
+def make_html_header(
+    source_line: str,
+) -> str:
+    """
+    Function to generate the base HTML header, with a given summary line
+
+    :param source_line: str Summary line of the sources
+    :return: str HTML
+    """
     html = (
             """
             <!doctype html>
@@ -110,6 +131,7 @@ def base_html_header(
           Search by Date: <input type="date" name="date" value="{{ today }}">
           Lookback Days: <input type="number" name="lookback_days" min="1" value="{{ lookback_days or 1 }}" style="width:60px;">
           Min Score: <input type="number" name="min_score" min="0.0" max="1.0" step="0.01" value="{{ min_score | default(0.01, false) }}" style="width:60px;">
+          Page Size: <input type="number" name="page_size" min="1" value="{{ page_size or '' }}" placeholder="all" style="width:60px;">
     
           <label class="switch">
             Hide junk: <input type="checkbox" name="hide_junk" {% if hide_junk is not defined or hide_junk %}checked{% endif %}>
@@ -170,3 +192,8 @@ def base_html_header(
     """
     )
     return html
+
+
+# Header of the date pages, compiled once by the server, with the summary line
+# passed as a template variable
+HEADER_TEMPLATE = make_html_header("{{ source_line | safe }}")
@@ -2,12 +2,11 @@ from pathlib import Path
 
 import pandas as pd
 from astropy.time import Time
-from tqdm import tqdm
 
-from scantde.htmlutils.header import base_html_header
 from tdescore.lightcurve.window import THERMAL_WINDOWS
-from typing import Optional
+from typing import Iterator, Optional
 from scantde.htmlutils.single import make_html_single
+from scantde.htmlutils.cache import nightly_cache
 from scantde.log import ProcStage
 
 
@@ -66,94 +65,61 @@ def format_processing_log(log: list[ProcStage]) -> str:
     return html
 
 
-def make_html_table(
+def iter_html_table(
     source_table: pd.DataFrame,
-    html_header: str,
     base_output_dir: Path,
     selection: str,
     prefix: str = "",
     proc_log: Optional[list[ProcStage]] = None,
     classifiers: list[str] | None = None,
     include_cutout: bool = False,
-) -> str:
+    offset: int = 0,
+    n_total: int | None = None,
+) -> Iterator[str]:
     """
-    Function to generate HTML for a table of sources
+    Function to generate HTML for a table of sources, one source at a time
 
     :param source_table: pd.DataFrame Table of sources
-    :param html_header: str HTML header
-    :param prefix: str Prefix for paths
     :param base_output_dir: Path Base output directory
     :param selection: str Selection type (e.g., 'tdescore')
+    :param prefix: str Prefix for paths
     :param proc_log: list[ProcStage] Processing log
     :param classifiers: list[str] Classifiers to use
     :param include_cutout: bool Whether to include cutout images
-    :return: str HTML
+    :param offset: int Position of the first source in the full table
+    :param n_total: int Number of sources in the full table
+    :return: Iterator of HTML chunks
     """
-
-    proc_log_str = format_processing_log(proc_log) if proc_log is not None else ""
-
-    html = html_header
-    html += "<table>"
-
-    for i, row in tqdm(source_table.iterrows(), total=len(source_table)):
-        count_line = f"({i+1}/{len(source_table)})"
-        html += make_html_single(
+    if n_total is None:
+        n_total = len(source_table)
+
+    # Check which images exist once per night, rather than once per image
+    manifests = {}
+    if "datestr" in source_table.columns:
+        manifests = {
+            x: nightly_cache.get_image_manifest(str(x))
+            for x in source_table["datestr"].unique()
+        }
+
+    yield "<table>"
+
+    for i, (_, row) in enumerate(source_table.iterrows()):
+        count_line = f"({offset + i + 1}/{n_total})"
+        yield make_html_single(
             row, base_output_dir=base_output_dir,
             prefix=prefix,
             selection=selection,
             count_line=count_line,
             classifiers=classifiers,
             include_cutout=include_cutout,
+            manifest=manifests.get(row.get("datestr")),
         )
 
-    html += f"""
+    proc_log_str = format_processing_log(proc_log) if proc_log is not None else ""
+
+    yield f"""
     </table>
     <br>
     {proc_log_str}
     """
 
-    return html
-
-
-def make_daily_html_table(
-    source_table: pd.DataFrame,
-    output_dir: Path,
-    base_output_dir: Path,
-    selection: str,
-    prefix: str = "",
-    proc_log: Optional[list[ProcStage]] = None,
-    classifiers: list[str] | None = None,
-    include_cutout: bool = False,
-) -> str:
-    """
-    Function to generate HTML for a table of sources
-
-    :param source_table: pd.DataFrame Table of sources
-    :param output_dir: Path Output directory
-    :param prefix: str Prefix for paths
-    :param base_output_dir: Path Base output directory
-    :param selection: str Selection type (e.g., 'tdescore')
-    :param proc_log: list[dict] Processing log
-    :param classifiers: list[str] Classifiers to use
-    :return: str HTML
-    """
-    datestr = output_dir.name
-
-    base_html_header(
-        source_table,
-    )
-
-    # html_header = make_html_daily_header(datestr, source_table, output_path)
-    html_header = base_html_header(
-        source_table,
-    )
-
-    html = make_html_table(
-        source_table, html_header, prefix=prefix,
-        base_output_dir=base_output_dir, selection=selection,
-        proc_log=proc_log, classifiers=classifiers,
-        include_cutout=include_cutout,
-    )
-
-    return html
-
@@ -0,0 +1,87 @@
+"""
+Manifest of the images made for each night, so the HTML pages can check
+which images exist without a filesystem stat per image
+"""
+import logging
+import os
+from pathlib import Path
+
+from pydantic import BaseModel, Field
+
+from scantde.paths import base_html_dir, get_image_manifest_path, SHAP_VALUES_NAME
+
+logger = logging.getLogger(__name__)
+
+IMAGE_SUFFIX = ".png"
+
+
+class ImageManifest(BaseModel):
+    """
+    A pydantic model for the images in the output directory of a night
+    """
+    datestr: str = Field(description="Night (YYYYMMDD)")
+    images: dict[str, set[str]] = Field(
+        default_factory=dict,
+        description="File names of the images in each directory, "
+                    "relative to the output directory of the night",
+    )
+
+    def has_image(self, image_path: str) -> bool:
+        """
+        Check whether an image exists
+
+        :param image_path: Path of the image, relative to the output
+            directory of the night (e.g. 'lightcurves/ZTF18abcdefg.png')
+        :return: Whether the image exists
+        """
+        image_dir, _, file_name = image_path.rpartition("/")
+        return file_name in self.images.get(image_dir, ())
+
+
+def build_image_manifest(datestr: str) -> ImageManifest:
+    """
+    List the images in the output directory of a night
+
+    :param datestr: Date string in the format 'YYYYMMDD'
+    :return: ImageManifest
+    """
+    night_dir = base_html_dir / datestr
+    images = {}
+    for dir_path, _, file_names in os.walk(night_dir):
+        # SHAP values files are listed too, as plots can be rendered from them
+        names = {
+            x for x in file_names
+            if x.endswith(IMAGE_SUFFIX) or (x == SHAP_VALUES_NAME)
+        }
+        if len(names) > 0:
+            images[Path(dir_path).relative_to(night_dir).as_posix()] = names
+    return ImageManifest(datestr=datestr, images=images)
+
+
+def save_image_manifest(manifest: ImageManifest) -> Path:
+    """
+    Save an image manifest next to the images
+
+    :param manifest: ImageManifest
+    :return: Path of the manifest
+    """
+    path = get_image_manifest_path(manifest.datestr)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    tmp_path.write_text(manifest.model_dump_json())
+    tmp_path.replace(path)
+    n_images = sum(len(x) for x in manifest.images.values())
+    logger.info(f"Saved manifest of {n_images} images to {path}")
+    return path
+
+
+def load_image_manifest(datestr: str) -> ImageManifest:
+    """
+    Load the image manifest of a night
+
+    :param datestr: Date string in the format 'YYYYMMDD'
+    :return: ImageManifest
+    """
+    return ImageManifest.model_validate_json(
+        get_image_manifest_path(datestr).read_text()
+    )
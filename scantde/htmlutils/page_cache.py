@@ -0,0 +1,424 @@
+"""
+Cache of rendered date pages, in memory and on disk.
+
+A page depends only on its query parameters and on the files it is built
+from, so each page is keyed by its normalized parameters plus a fingerprint
+of those files. The same key is used as the HTTP ETag. The pages on disk are
+bounded per night, and the least recently used are deleted first.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from typing import Iterator, Mapping
+from urllib.parse import urlencode
+
+import pandas as pd
+from pydantic import BaseModel, Field, field_validator, model_validator
+
+from scantde.htmlutils.header import get_source_line
+from scantde.io import results_cache_filename, LEGACY_CACHE_SUFFIX
+from scantde.paths import (
+    base_html_dir, get_log_path, get_page_cache_dir, get_image_manifest_path
+)
+
+logger = logging.getLogger(__name__)
+
+PAGE_CACHE_SIZE = 32  # Maximum number of pages kept in memory
+DISK_CACHE_SIZE = 64  # Maximum number of pages kept on disk for each night
+
+# The rendering code itself, so cached pages are invalidated by code changes
+HTML_CODE_DIR = Path(__file__).parent
+
+
+class PageParams(BaseModel):
+    """
+    A pydantic model for the normalized parameters of a date page
+    """
+    datestr: str = Field(min_length=8, max_length=8, description="Night (YYYYMMDD)")
+    selection: str = Field(default="tdescore", description="Selection type")
+    lookback_days: int = Field(default=1, ge=1, description="Number of nights to show")
+    min_score: float = Field(default=0.01, description="Minimum tdescore")
+    hide_junk: bool = Field(default=False, description="Hide junk sources")
+    hide_classified: bool = Field(default=False, description="Hide classified sources")
+    mode: str = Field(default="all", description="Subset of sources to show")
+    include_cutout: bool = Field(default=False, description="Include cutout images")
+    offset: int = Field(default=0, ge=0, description="Position of the first source shown")
+    page_size: int | None = Field(
+        default=None, ge=1, description="Number of sources shown, or None for all"
+    )
+
+    @field_validator("datestr", mode="before")
+    @classmethod
+    def strip_dashes(cls, value: str) -> str:
+        return str(value).replace("-", "")
+
+    @field_validator("datestr")
+    @classmethod
+    def check_date(cls, value: str) -> str:
+        try:
+            if not value.isdigit():
+                raise ValueError
+            datetime.strptime(value, "%Y%m%d")
+        except ValueError:
+            raise ValueError(f"Date {value} is not a valid date (YYYYMMDD)") from None
+        return value
+
+    @field_validator("min_score")
+    @classmethod
+    def round_score(cls, value: float) -> float:
+        return round(value, 6)
+
+    @field_validator("mode")
+    @classmethod
+    def lower_mode(cls, value: str) -> str:
+        return value.strip().lower()
+
+    @model_validator(mode="after")
+    def check_nights(self) -> "PageParams":
+        # The earliest night shown must be a valid date too
+        try:
+            pd.to_datetime(self.datestr) - pd.Timedelta(days=self.lookback_days - 1)
+        except (ValueError, OverflowError):
+            raise ValueError(
+                f"Cannot look back {self.lookback_days} nights from {self.datestr}"
+            ) from None
+        return self
+
+    @classmethod
+    def from_args(cls, args: Mapping[str, str]) -> "PageParams":
+        """
+        Get the parameters of a page from the query arguments of its URL
+
+        :param args: Query arguments
+        :return: PageParams
+        """
+        return cls(
+            datestr=args.get('date', datetime.today().date().isoformat()),
+            selection=args.get('selection', 'tdescore'),
+            lookback_days=int(args.get('lookback_days', "1").strip()),
+            min_score=float(str(args.get('min_score', 0.01)).strip()),
+            hide_junk=bool(args.get('hide_junk')),
+            hide_classified=bool(args.get('hide_classified', False)),
+            mode=args.get('mode', 'all'),
+            include_cutout=bool(args.get('show_cutout', False)),
+            offset=int(args.get('offset', "0").strip() or 0),
+            page_size=int(args['page_size']) if args.get('page_size', "").strip() else None,
+        )
+
+    def to_args(self) -> dict[str, str]:
+        """
+        Get the query arguments of the URL of the page
+
+        :return: Query arguments
+        """
+        args = {
+            'date': f"{self.datestr[:4]}-{self.datestr[4:6]}-{self.datestr[6:]}",
+            'selection': self.selection,
+            'lookback_days': str(self.lookback_days),
+            'min_score': str(self.min_score),
+            'mode': self.mode,
+        }
+        for key, value in [
+            ('hide_junk', self.hide_junk),
+            ('hide_classified', self.hide_classified),
+            ('show_cutout', self.include_cutout),
+        ]:
+            if value:
+                args[key] = 'on'
+        if self.page_size is not None:
+            args['offset'] = str(self.offset)
+            args['page_size'] = str(self.page_size)
+        return args
+
+    def get_nights(self) -> list[str]:
+        """
+        Get the nights shown on the page, latest first
+
+        :return: List of date strings
+        """
+        return [
+            (pd.to_datetime(self.datestr) - pd.Timedelta(days=i)).strftime('%Y%m%d')
+            for i in range(self.lookback_days)
+        ]
+
+    def get_key(self) -> str:
+        """
+        Get a short hash of the parameters
+
+        :return: Hex digest
+        """
+        return hashlib.sha256(self.model_dump_json().encode()).hexdigest()[:16]
+
+
+def get_input_paths(params: PageParams) -> list[Path]:
+    """
+    Get the files and directories a page is built from. For nights without
+    an image manifest, the image directories are included instead, as their
+    modification time changes when images are added.
+
+    :param params: Page parameters
+    :return: List of paths
+    """
+    paths = sorted(HTML_CODE_DIR.glob("*.py"))
+    for night in params.get_nights():
+        paths += [
+            results_cache_filename(night, params.selection),
+            results_cache_filename(night, params.selection, LEGACY_CACHE_SUFFIX),
+            get_log_path(night, params.selection),
+        ]
+        manifest_path = get_image_manifest_path(night)
+        if manifest_path.exists():
+            paths.append(manifest_path)
+        else:
+            night_dir = base_html_dir / night
+            paths += [night_dir / "lightcurves", night_dir / "gp" / "None"]
+            paths += sorted(night_dir.joinpath(params.selection, "shap").glob("*"))
+    return paths
+
+
+def get_etag(params: PageParams) -> str:
+    """
+    Get the ETag of a page, from its parameters and the modification times
+    of its inputs
+
+    :param params: Page parameters
+    :return: ETag
+    """
+    mtimes = []
+    for path in get_input_paths(params):
+        try:
+            mtimes.append([str(path), path.stat().st_mtime_ns])
+        except FileNotFoundError:
+            mtimes.append([str(path), None])
+    fingerprint = hashlib.sha256(json.dumps(mtimes).encode()).hexdigest()[:16]
+    return f"{params.get_key()}-{fingerprint}"
+
+
+def make_page_nav(params: PageParams, n_total: int) -> str:
+    """
+    Get the HTML links to the neighbouring pages of a paginated date page
+
+    :param params: Page parameters
+    :param n_total: Number of sources on all pages
+    :return: HTML string
+    """
+    if params.page_size is None:
+        return ""
+
+    stop = min(params.offset + params.page_size, n_total)
+    html = f"Showing sources {min(params.offset + 1, stop)}-{stop} of {n_total} &nbsp;&nbsp;"
+
+    if params.offset > 0:
+        prev_params = params.model_copy(
+            update={"offset": max(params.offset - params.page_size, 0)}
+        )
+        html += f'<a href="search_by_date?{urlencode(prev_params.to_args())}">Previous</a> &nbsp;'
+    if stop < n_total:
+        next_params = params.model_copy(update={"offset": stop})
+        html += f'<a href="search_by_date?{urlencode(next_params.to_args())}">Next</a>'
+
+    return f"<div>{html}</div>"
+
+
+def prune_page_cache(cache_dir: Path, max_entries: int = DISK_CACHE_SIZE) -> int:
+    """
+    Delete the least recently used pages of a night beyond a maximum number
+
+    :param cache_dir: Page cache directory of the night
+    :param max_entries: Maximum number of pages to keep
+    :return: Number of pages deleted
+    """
+    pages = []
+    for page_path in cache_dir.glob("*.json"):
+        try:
+            pages.append((page_path.stat().st_mtime, page_path))
+        except FileNotFoundError:
+            continue
+
+    n_deleted = 0
+    for _, page_path in sorted(pages, reverse=True)[max_entries:]:
+        page_path.unlink(missing_ok=True)
+        n_deleted += 1
+
+    if n_deleted > 0:
+        logger.debug(f"Deleted {n_deleted} old pages from {cache_dir}")
+    return n_deleted
+
+
+class CachedPage(BaseModel):
+    """
+    A pydantic model for a rendered date page, after the header
+    """
+    source_line: str = Field(description="Summary line of the selected sources")
+    body: str = Field(description="HTML of the table of sources")
+
+
+class PageCacheStats(BaseModel):
+    """
+    A pydantic model for the statistics of the page cache
+    """
+    memory_hits: int = Field(default=0, ge=0, description="Pages served from memory")
+    disk_hits: int = Field(default=0, ge=0, description="Pages served from disk")
+    misses: int = Field(default=0, ge=0, description="Pages rendered")
+    not_modified: int = Field(
+        default=0, ge=0, description="Revalidations answered without a page"
+    )
+    render_time: float = Field(
+        default=0., ge=0., description="Total time spent rendering pages [s]"
+    )
+
+
+class PageCache:
+    """
+    Size-bounded LRU cache of rendered date pages in memory, backed by
+    files in the page cache directory of each night.
+
+    Only the part of the page after the header is cached, as the header is
+    a template filled in with the query parameters by the server.
+    """
+
+    def __init__(self, max_entries: int = PAGE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._cache: OrderedDict[str, CachedPage] = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = PageCacheStats()
+
+    def _add(self, etag: str, page: CachedPage):
+        """
+        Add a page to the memory cache, evicting the least recently used
+
+        :param etag: ETag of the page
+        :param page: Rendered page
+        :return: None
+        """
+        with self._lock:
+            self._cache[etag] = page
+            self._cache.move_to_end(etag)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def get_page(
+        self, params: PageParams, etag: str | None = None
+    ) -> tuple[str, Iterator[str]]:
+        """
+        Get a page, from memory, disk, or by rendering it.
+
+        The sources are selected straight away, but a new page is only
+        rendered as the returned iterator is consumed, and is cached once
+        it has been consumed completely.
+
+        :param params: Page parameters
+        :param etag: ETag of the page, if already computed
+        :return: Summary line of the sources, and iterator of HTML chunks
+        """
+        if etag is None:
+            etag = get_etag(params)
+
+        with self._lock:
+            page = self._cache.get(etag)
+            if page is not None:
+                self._cache.move_to_end(etag)
+                self.stats.memory_hits += 1
+                return page.source_line, iter([page.body])
+
+        cache_dir = get_page_cache_dir(params.datestr)
+        path = cache_dir / f"{etag}.json"
+        if path.exists():
+            page = CachedPage.model_validate_json(path.read_text())
+            # Mark the page as recently used, so it is pruned last
+            os.utime(path)
+            self.stats.disk_hits += 1
+            self._add(etag, page)
+            return page.source_line, iter([page.body])
+
+        from scantde.htmlutils.generate import iter_html_by_date
+
+        t_start = time.perf_counter()
+        df, chunks = iter_html_by_date(
+            params.datestr,
+            selection=params.selection,
+            lookback_days=params.lookback_days,
+            min_score=params.min_score,
+            hide_junk=params.hide_junk,
+            hide_classified=params.hide_classified,
+            include_cutout=params.include_cutout,
+            mode=params.mode,
+            offset=params.offset,
+            page_size=params.page_size,
+        )
+        nav = make_page_nav(params, len(df))
+        source_line = get_source_line(df)
+
+        def render() -> Iterator[str]:
+            parts = []
+            for chunk in [nav, *chunks, nav]:
+                parts.append(chunk)
+                yield chunk
+
+            page = CachedPage(source_line=source_line, body="".join(parts))
+            self.stats.misses += 1
+            self.stats.render_time += time.perf_counter() - t_start
+
+            # Replace any outdated versions of the same page
+            for old_path in cache_dir.glob(f"{params.get_key()}-*.json"):
+                old_path.unlink(missing_ok=True)
+
+            # Only created once there is a page to save, not for every request
+            cache_dir.mkdir(parents=True, exist_ok=True)
+
+            # Unique per process and thread, as several server workers can
+            # render the same page at once
+            tmp_path = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp_path.write_text(page.model_dump_json())
+            tmp_path.replace(path)
+            prune_page_cache(cache_dir)
+
+            self._add(etag, page)
+
+        return source_line, render()
+
+    def warm_page(self, params: PageParams) -> str:
+        """
+        Render a page ahead of time, so the first request is served from disk
+
+        :param params: Page parameters
+        :return: ETag of the page
+        """
+        etag = get_etag(params)
+        _, chunks = self.get_page(params, etag=etag)
+        for _ in chunks:
+            pass
+        logger.info(f"Pre-rendered page for {params.model_dump()}")
+        return etag
+
+    def clear(self):
+        """
+        Clear all pages in memory, and the statistics
+
+        :return: None
+        """
+        with self._lock:
+            self._cache.clear()
+            self.stats = PageCacheStats()
+
+    def get_stats(self) -> dict:
+        """
+        Get the cache statistics
+
+        :return: Dictionary of statistics
+        """
+        with self._lock:
+            return {
+                "n_entries": len(self._cache),
+                "max_entries": self.max_entries,
+                **self.stats.model_dump(),
+            }
+
+
+page_cache = PageCache()
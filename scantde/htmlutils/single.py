@@ -7,6 +7,8 @@ from tdescore.lightcurve.window import THERMAL_WINDOWS
 from scantde.htmlutils.cutout import generate_cutout_html
 from scantde.htmlutils.extinction import get_extinction_html
 from scantde.htmlutils.host import get_host_html
+from scantde.htmlutils.manifest import ImageManifest
+from scantde.paths import SHAP_VALUES_NAME
 
 CLASSIFIERS = ["host", "infant", "week"] + [f"thermal_{x:.0f}" if x is not None else "thermal_all" for x in THERMAL_WINDOWS] + ["full"]
 
@@ -19,6 +21,7 @@ def make_html_single(
     count_line: str = "",
     classifiers: list[str] | None = None,
     include_cutout: bool = False,
+    manifest: ImageManifest | None = None,
 ) -> str:
     """
     Function to generate HTML for a single source
@@ -30,8 +33,15 @@ def make_html_single(
     :param base_output_dir: Path Output directory
     :param classifiers: list[str] Classifiers to use
     :param include_cutout: bool Whether to include cutout images
+    :param manifest: ImageManifest Images of the night of the source,
+        or None to check the filesystem for each image
     :return: str HTML
     """
+    def has_image(image_path: str) -> bool:
+        if manifest is not None:
+            return manifest.has_image(image_path)
+        return (base_output_dir / night_prefix / image_path).exists()
+
     if classifiers is None:
         classifiers = CLASSIFIERS
 
@@ -40,8 +50,7 @@ def make_html_single(
     name = row["name"]
 
     lightcurve_ext = f"{night_prefix}lightcurves/{name}.png"
-    lightcurve_path = base_output_dir / lightcurve_ext
-    if lightcurve_path.exists():
+    if has_image(f"lightcurves/{name}.png"):
         lightcurve_line = f'<img src="{lightcurve_ext}" height="240">'
     else:
         lightcurve_line = ""
@@ -58,9 +67,15 @@ def make_html_single(
         sub_dir = "thermal_None"
 
     shap_ext = f"{night_prefix}{selection}/shap/{sub_dir}/{name}.png"
-    shap_path = base_output_dir / shap_ext
-    if shap_path.exists():
+    if has_image(f"{selection}/shap/{sub_dir}/{name}.png"):
         shap_line = f'<img src="{shap_ext}" height="220">'
+    elif has_image(f"{selection}/shap/{sub_dir}/{SHAP_VALUES_NAME}"):
+        # Only the raw SHAP values were saved, so render the plot on request
+        shap_url = (
+            f"shap_plot?datestr={row['datestr']}&selection={selection}"
+            f"&classifier={sub_dir}&name={name}"
+        )
+        shap_line = f'<img src="{shap_url}" height="220">'
     else:
         shap_line = ""
 
@@ -113,11 +128,10 @@ def make_html_single(
     host_html = get_host_html(row)
 
     gp_ext = f"{night_prefix}gp/None/{name}.png"
-    gp_path = base_output_dir / gp_ext
 
     gp_line = ""
 
-    if gp_path.exists() & (row["tdescore_best"] == "full"):
+    if (row["tdescore_best"] == "full") and has_image(f"gp/None/{name}.png"):
         gp_line = f'<img src="{gp_ext}" height="250">'
     elif "thermal" in str(row["tdescore_best"]):
         window = row["thermal_window"]
@@ -1,20 +1,138 @@
 from pathlib import Path
+import json
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import logging
 from scantde.paths import get_night_output_dir, base_html_dir
 
 logger = logging.getLogger(__name__)
 
+CACHE_SUFFIX = ".parquet"
+LEGACY_CACHE_SUFFIX = ".json"
+PARQUET_COMPRESSION = "zstd"
 
-def candidates_cache_filename(datestr: str, selection: str) -> Path:
+# Parquet metadata key listing columns stored as JSON strings
+JSON_COLUMNS_KEY = b"scantde_json_columns"
+
+# Results are sorted by name in small row groups, so one source can be read
+# without loading the whole night
+RESULTS_SORT_KEY = "name"
+RESULTS_ROW_GROUP_SIZE = 64
+
+
+def _encode_json(value):
+    """
+    Encode a single value as a JSON string, keeping missing values as None
+    """
+    if value is None or (isinstance(value, float) and pd.isnull(value)):
+        return None
+    return json.dumps(value, default=str)
+
+
+def _decode_json_columns(df: pd.DataFrame, schema: pa.Schema) -> pd.DataFrame:
+    """
+    Decode the columns which save_frame stored as JSON strings
+
+    :param df: DataFrame read from a Parquet file
+    :param schema: Schema of the Parquet file
+    :return: DataFrame with decoded columns
+    """
+    json_columns = json.loads((schema.metadata or {}).get(JSON_COLUMNS_KEY, b"[]"))
+    for col in json_columns:
+        if col in df.columns:
+            df[col] = df[col].astype(object).map(
+                lambda x: json.loads(x) if isinstance(x, str) else None
+            )
+    return df
+
+
+def save_frame(
+    df: pd.DataFrame,
+    path: Path,
+    row_group_size: int | None = None,
+) -> None:
+    """
+    Save a DataFrame to a compressed Parquet file.
+
+    Object columns which cannot be stored as flat Parquet columns (e.g. lists,
+    dicts, or a mix of strings and numbers) are stored as JSON strings, and
+    decoded again by load_frame.
+
+    :param df: DataFrame to save
+    :param path: Output path
+    :param row_group_size: Maximum number of rows per row group,
+        or None for the pyarrow default
+    :return: None
+    """
+    df = df.copy()
+    df.columns = [str(x) for x in df.columns]
+
+    json_columns = []
+    for col in df.columns[df.dtypes == object]:
+        try:
+            native = not pa.types.is_nested(pa.array(df[col], from_pandas=True).type)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+            native = False
+        if not native:
+            df[col] = df[col].map(_encode_json)
+            json_columns.append(col)
+
+    table = pa.Table.from_pandas(df)
+    metadata = {**(table.schema.metadata or {}), JSON_COLUMNS_KEY: json.dumps(json_columns).encode()}
+    table = table.replace_schema_metadata(metadata)
+
+    tmp_path = path.with_suffix(".tmp")
+    pq.write_table(
+        table, tmp_path, compression=PARQUET_COMPRESSION, row_group_size=row_group_size
+    )
+    tmp_path.replace(path)
+
+
+def load_frame(
+    path: Path,
+    legacy_path: Path | None = None,
+    columns: list[str] | None = None,
+) -> pd.DataFrame:
+    """
+    Load a DataFrame saved with save_frame, falling back to a legacy JSON file
+
+    :param path: Path of the Parquet file
+    :param legacy_path: Path of the legacy JSON file
+    :param columns: Columns to load, or None for all columns.
+        Columns which are not in the file are ignored.
+    :return: DataFrame
+    """
+    if path.exists():
+        schema = pq.read_schema(path)
+        if columns is not None:
+            columns = [x for x in columns if x in schema.names]
+        df = pd.read_parquet(path, columns=columns)
+        return _decode_json_columns(df, schema)
+
+    if (legacy_path is not None) and legacy_path.exists():
+        df = pd.read_json(legacy_path)
+        if columns is not None:
+            df = df[[x for x in columns if x in df.columns]]
+        return df
+
+    err = f"No cache file found at {path}"
+    logger.error(err)
+    raise FileNotFoundError(err)
+
+
+def candidates_cache_filename(
+    datestr: str, selection: str, suffix: str = CACHE_SUFFIX
+) -> Path:
     """
     Get the cache filename for a given date
 
     :param datestr: Date to get the cache filename for
     :param selection: Selection type (e.g., 'tdescore')
+    :param suffix: File suffix, '.parquet' or the legacy '.json'
     :return: Path Cache filename
     """
-    return get_night_output_dir(datestr) / f"scantde_{selection}_candidates.json"
+    return get_night_output_dir(datestr) / f"scantde_{selection}_candidates{suffix}"
 
 
 def save_candidates(datestr: str, selection: str, candidates: pd.DataFrame) -> None:
@@ -27,43 +145,64 @@ def save_candidates(datestr: str, selection: str, candidates: pd.DataFrame) -> N
     :return: None
     """
     cache_filename = candidates_cache_filename(datestr, selection)
-    candidates.to_json(cache_filename)
+    save_frame(candidates, cache_filename)
     logger.info(f"Saved candidates to {cache_filename}")
 
 
-def load_candidates(datestr: str, selection: str) -> pd.DataFrame:
+def load_candidates(
+    datestr: str, selection: str, columns: list[str] | None = None
+) -> pd.DataFrame:
     """
-    Load the candidates from a cache file
+    Load the candidates from a cache file, or the legacy JSON file
 
     :param datestr: Date to load the candidates for
     :param selection: Selection type (e.g., 'tdescore')
+    :param columns: Columns to load, or None for all columns
     :return: pd.DataFrame Candidates
     """
     cache_filename = candidates_cache_filename(datestr, selection)
-    if not cache_filename.exists():
-        err = f"No cache file found at {cache_filename}"
-        logger.error(err)
-        raise FileNotFoundError(err)
-    candidates = pd.read_json(cache_filename)
+    candidates = load_frame(
+        cache_filename,
+        legacy_path=candidates_cache_filename(datestr, selection, LEGACY_CACHE_SUFFIX),
+        columns=columns,
+    )
     logger.info(f"Loaded candidates from {cache_filename}")
     return candidates
 
 
-def results_cache_filename(datestr: str, selection: str) -> Path:
+def results_cache_filename(
+    datestr: str, selection: str, suffix: str = CACHE_SUFFIX
+) -> Path:
     """
     Get the cache filename for the results of TDEScore for a given date
 
     :param datestr: Date to get the cache filename for
     :param selection: Selection type (e.g., 'tdescore')
+    :param suffix: File suffix, '.parquet' or the legacy '.json'
     :return: Path Cache filename
     """
     output_dir = candidates_cache_filename(datestr, selection).parent
-    return output_dir / f"scantde_{selection}_results.json"
+    return output_dir / f"scantde_{selection}_results{suffix}"
+
+
+def results_index_filename(datestr: str, selection: str) -> Path:
+    """
+    Get the filename of the row index of the results for a given date
+
+    :param datestr: Date to get the index filename for
+    :param selection: Selection type (e.g., 'tdescore')
+    :return: Path Index filename
+    """
+    output_dir = results_cache_filename(datestr, selection).parent
+    return output_dir / f"scantde_{selection}_results_index.json"
 
 
 def save_results(datestr: str, selection: str, result_df: pd.DataFrame) -> None:
     """
-    Save the results of TDEScore to a cache file
+    Save the results of TDEScore to a cache file.
+
+    The results are sorted by name and written in small row groups,
+    alongside an index mapping each name to its row group.
 
     :param datestr: Date to save the results for
     :param selection: Selection type (e.g., 'tdescore')
@@ -72,25 +211,79 @@ def save_results(datestr: str, selection: str, result_df: pd.DataFrame) -> None:
     """
     cache_filename = results_cache_filename(datestr, selection)
     cache_filename.parent.mkdir(parents=True, exist_ok=True)
-    result_df.to_json(cache_filename)
+
+    index_filename = results_index_filename(datestr, selection)
+    index_filename.unlink(missing_ok=True)
+
+    if RESULTS_SORT_KEY not in result_df.columns:
+        save_frame(result_df, cache_filename)
+        logger.info(f"Saved scantde results to {cache_filename}")
+        return
+
+    result_df = result_df.sort_values(RESULTS_SORT_KEY, kind="stable")
+    save_frame(result_df, cache_filename, row_group_size=RESULTS_ROW_GROUP_SIZE)
+
+    names = result_df[RESULTS_SORT_KEY].tolist()
+    index = {}
+    for i, name in enumerate(names):
+        index.setdefault(str(name), i // RESULTS_ROW_GROUP_SIZE)
+
+    tmp_path = index_filename.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(index, f)
+    tmp_path.replace(index_filename)
+
     logger.info(f"Saved scantde results to {cache_filename}")
 
 
-def load_results(datestr: str, selection: str) -> pd.DataFrame:
+def load_results(
+    datestr: str, selection: str, columns: list[str] | None = None
+) -> pd.DataFrame:
     """
-    Load the results of TDEScore from a cache file
+    Load the results of TDEScore from a cache file, or the legacy JSON file
 
     :param datestr: Date to load the results for
     :param selection: Selection type (e.g., 'tdescore')
+    :param columns: Columns to load, or None for all columns
     :return: pd.DataFrame Results
     """
     cache_filename = results_cache_filename(datestr, selection)
-    if not cache_filename.exists():
-        err = f"No cache file found at {cache_filename}"
-        logger.error(err)
-        raise FileNotFoundError(err)
-    result_df = pd.read_json(cache_filename)
+    result_df = load_frame(
+        cache_filename,
+        legacy_path=results_cache_filename(datestr, selection, LEGACY_CACHE_SUFFIX),
+        columns=columns,
+    )
     logger.info(f"Loaded scantde results from {cache_filename}")
     return result_df
 
 
+
+
+def load_result_row(datestr: str, selection: str, name: str) -> pd.Series | None:
+    """
+    Load the results of TDEScore for a single source.
+
+    Only the row group containing the source is read, using the row index
+    of the night. Nights without an index are loaded in full.
+
+    :param datestr: Date to load the results for
+    :param selection: Selection type (e.g., 'tdescore')
+    :param name: Name of the source
+    :return: pd.Series Results of the source, or None if not found
+    """
+    cache_filename = results_cache_filename(datestr, selection)
+    index_filename = results_index_filename(datestr, selection)
+
+    if cache_filename.exists() and index_filename.exists():
+        with open(index_filename, "r") as f:
+            index = json.load(f)
+        if name not in index:
+            return None
+        pf = pq.ParquetFile(cache_filename)
+        df = pf.read_row_group(index[name]).to_pandas()
+        df = _decode_json_columns(df, pf.schema_arrow)
+    else:
+        df = load_results(datestr, selection=selection)
+
+    match = df[df[RESULTS_SORT_KEY] == name]
+    return match.iloc[0] if not match.empty else None
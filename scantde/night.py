@@ -0,0 +1,125 @@
+"""
+Run the TDEScore integration for a single night
+"""
+
+import logging
+from typing import Callable
+
+from scantde.utils import get_current_datestr
+
+from scantde.candidates import get_ztf_candidates, ztf_alerts_path
+from scantde.utils import get_known_tdes
+from scantde.selections.run import run_selections, SELECTIONS
+from scantde.selections.utils.registry import model_registry
+from scantde.selections.utils.features import feature_store
+from scantde.selections.utils.shared import prepare_candidate_pool
+from scantde.paths import base_html_dir
+from scantde.htmlutils.manifest import build_image_manifest, save_image_manifest
+from scantde.htmlutils.page_cache import page_cache
+from scantde.utils.slack import get_slack_page_params
+from scantde.utils.skyportal import clear_export_plans, export_night
+
+logger = logging.getLogger(__name__)
+
+
+def run_night(
+    datestr: str | None,
+    skip_lightcurve: bool = False,
+    debug: bool = False,
+    n_workers: int = 1,
+    selections: list[str] | None = None,
+    refresh_candidates: bool = True,
+    on_complete: Callable[[str, float], None] | None = None,
+) -> dict[str, float]:
+    """
+    Run the TDEScore integration for a single date
+
+    :param datestr: Date string in the format YYYYMMDD, or None for today
+    :param skip_lightcurve: Whether to skip the lightcurve analysis
+    :param debug: Whether to run in debug mode, on a subset of sources
+    :param n_workers: Number of processes to run the selections in
+    :param selections: Names of the selections to run, or None for all
+    :param refresh_candidates: Whether to re-download the initial candidates
+    :param on_complete: Function called with the name and duration of each
+        selection as soon as it has finished
+    :return: Duration of each selection [s]
+    """
+    if datestr is None:
+        datestr = get_current_datestr()
+
+    if (not debug) & (not skip_lightcurve) & refresh_candidates:
+        # Remove the nightly file to force a re-download
+        ztf_cache = ztf_alerts_path(datestr)
+        if ztf_cache.is_file():
+            logger.info(f"Re-downloading initial candidates for {datestr}")
+            ztf_cache.unlink(missing_ok=True)
+        else:
+            logger.info(f"Downloading initial candidates for {datestr}")
+
+    df = get_ztf_candidates(datestr)
+
+    # Combined features are only valid for a single night
+    feature_store.clear()
+
+    df["tdescore_lc"] = skip_lightcurve
+
+    # Cached locally, so this only queries SkyPortal once the cache is stale
+    all_known_tdes = get_known_tdes()
+    logger.info(f"Have {len(all_known_tdes)} known TDEs")
+
+    df["latest_datestr"] = datestr
+    df["source_name"] = df["name"]
+    df.set_index("source_name", inplace=True)
+    df["is_tde"] = df["name"].isin(all_known_tdes)
+
+    df["age_estimate"] = None
+
+    df["tdescore"] = None
+    df["tdescore_best"] = None
+    df["tdescore_high_noise"] = False
+    df["tdescore_lc_score"] = None
+
+    df = df.sort_values(by=["is_tde", "name"], ascending=[False, False])
+    df.reset_index(drop=True, inplace=True)
+
+    if debug:
+        df = df[:2000]
+
+    nightly_output_dir = base_html_dir / datestr
+    nightly_output_dir.mkdir(parents=True, exist_ok=True)
+
+    logger.info(f"Running TDEScore integration for {datestr}")
+
+    # Run the crossmatch, download and lightcurve stages once for all selections
+    pool = prepare_candidate_pool(df.copy(), base_output_dir=nightly_output_dir)
+
+    # Each selection plans its exports, which are run together below
+    if selections is None:
+        selections = list(SELECTIONS)
+    clear_export_plans(datestr, selections)
+
+    # The selections are independent once the pool is prepared
+    durations = run_selections(
+        df, base_output_dir=nightly_output_dir, pool=pool,
+        selections=selections, n_workers=n_workers, on_complete=on_complete,
+    )
+
+    # Post each source to SkyPortal once, with the groups of all selections
+    export_night(datestr, list(durations))
+
+    # List the images once, so the pages do not check each image on disk
+    save_image_manifest(build_image_manifest(datestr))
+
+    # Pre-render the page linked from slack, so the first visit is fast
+    if "tdescore" in durations:
+        try:
+            page_cache.warm_page(get_slack_page_params(datestr))
+        except Exception as e:
+            logger.warning(f"Failed to pre-render the slack page for {datestr}: {e}")
+
+    logger.info(f"Model registry statistics:\n{model_registry.get_stats()}")
+    logger.info(
+        f"Feature store combined {feature_store.n_combined} sources "
+        f"and reused {feature_store.n_reused}"
+    )
+    return durations
@@ -41,15 +41,38 @@ for image in images:
 ml_dir = code_dir / 'ml_models'
 ml_dir.mkdir(exist_ok=True)
 
+explainer_cache_dir = base_output_dir / 'explainer_cache'
+explainer_cache_dir.mkdir(parents=True, exist_ok=True)
+
+# File of raw SHAP values, written next to the waterfall plots of a classifier
+SHAP_VALUES_NAME = 'shap_values.parquet'
+
 cutout_dir = base_html_dir / 'cutouts'
 cutout_dir.mkdir(exist_ok=True)
 
 input_cache_dir = base_output_dir / 'input_cache'
 input_cache_dir.mkdir(parents=True, exist_ok=True)
 
+extinction_cache_dir = input_cache_dir / 'extinction_ebv'
+extinction_cache_dir.mkdir(parents=True, exist_ok=True)
+
+skyportal_ledger_path = input_cache_dir / 'skyportal_export_ledger.json'
+
+known_tdes_cache_path = input_cache_dir / 'known_tdes.json'
+
+cutout_failure_cache_path = input_cache_dir / 'cutout_failures.json'
+
+lightcurve_fit_cache_path = input_cache_dir / 'lightcurve_fits.json'
+
+lightcurve_cache_dir = base_output_dir / 'lightcurve_cache'
+lightcurve_cache_dir.mkdir(parents=True, exist_ok=True)
+
 db_dir = base_output_dir / 'db'
 db_dir.mkdir(parents=True, exist_ok=True)
 
+backfill_dir = base_output_dir / 'backfill'
+backfill_dir.mkdir(parents=True, exist_ok=True)
+
 
 def get_db_path(selection: str) -> Path:
     """
@@ -106,3 +129,46 @@ def get_log_path(datestr: str, selection: str) -> Path:
     :return: Path to the log file for the given selection
     """
     return get_night_output_dir(datestr) / f'scantde_{selection}_log.json'
+
+
+def get_export_plan_path(datestr: str, selection: str) -> Path:
+    """
+    Get the path of the SkyPortal exports planned by a selection for a given date.
+
+    :param datestr: Date string in the format 'YYYYMMDD'
+    :param selection: Selection type (e.g., 'tdescore')
+    :return: Path to the export plan
+    """
+    return get_night_output_dir(datestr) / f'skyportal_plan_{selection}.json'
+
+
+def get_image_manifest_path(datestr: str) -> Path:
+    """
+    Get the path of the manifest of images made for a given date.
+
+    :param datestr: Date string in the format 'YYYYMMDD'
+    :return: Path to the image manifest for the given date
+    """
+    return base_html_dir / datestr / 'image_manifest.json'
+
+
+def get_page_cache_dir(datestr: str) -> Path:
+    """
+    Get the directory of rendered date pages for a given date.
+    The directory is not created, as pages are looked up for any date requested.
+
+    :param datestr: Date string in the format 'YYYYMMDD'
+    :return: Path to the page cache directory for the given date
+    """
+    return base_output_dir / "results" / datestr / 'page_cache'
+
+
+def get_backfill_checkpoint_path(nights: list[str]) -> Path:
+    """
+    Get the checkpoint file path for a backfill over a list of nights.
+
+    :param nights: Date strings in the format 'YYYYMMDD'
+    :return: Path to the checkpoint file
+    """
+    nights = sorted(nights)
+    return backfill_dir / f'backfill_{nights[0]}_{nights[-1]}.json'
@@ -17,7 +17,8 @@ from scantde.selections.utils.export import export_results
 from scantde.selections.utils.algorithmic_cuts import apply_algorithmic_cuts
 from scantde.selections.utils.download import download_data
 from scantde.selections.utils.apply_lightcurve import apply_lightcurve
-from scantde.utils.skyportal import export_to_skyportal
+from scantde.selections.utils.pool import CandidatePool
+from scantde.utils.skyportal import plan_export
 from scantde.utils.slack import send_to_slack
 
 
@@ -30,12 +31,14 @@ NOHOST_SELECTION = "tdescore_nohostinfo"
 def apply_tdescore_nohostinfo(
     df: pd.DataFrame,
     base_output_dir: Path,
+    pool: CandidatePool | None = None,
 ):
     """
     Function to apply the TDEScore to a table of sources
 
     :param df: Table of sources
     :param base_output_dir: Directory to save output
+    :param pool: Shared candidate pool for the night
     """
 
     datestr = base_output_dir.name
@@ -51,15 +54,16 @@ def apply_tdescore_nohostinfo(
 
         df, _, proc_log = apply_algorithmic_cuts(
             df, selection=NOHOST_SELECTION, proc_log=proc_log,
-            require_nuclear=True, require_multidet=False
+            require_nuclear=True, require_multidet=False, pool=pool
         )
 
         df, full_df, proc_log = download_data(
-            df, datestr=datestr, selection=NOHOST_SELECTION, proc_log=proc_log
+            df, datestr=datestr, selection=NOHOST_SELECTION, proc_log=proc_log,
+            pool=pool,
         )
 
         apply_lightcurve(
-            df, base_output_dir=base_output_dir,
+            df, base_output_dir=base_output_dir, pool=pool,
         )
 
         df = apply_thermal(
@@ -79,8 +83,10 @@ def apply_tdescore_nohostinfo(
         full_df = export_results(df, datestr=datestr, selection=NOHOST_SELECTION)
 
 
-        # Export sources to SkyPortal
-        export_to_skyportal(full_df[~full_df["is_junk"]])
+        # Plan the SkyPortal exports, which are run once all selections are done
+        plan_export(
+            full_df[~full_df["is_junk"]], datestr=datestr, selection=NOHOST_SELECTION,
+        )
 
         logger.info(df)
 
@@ -0,0 +1,198 @@
+"""
+Module for running the selections for a night, either one after another or
+concurrently in separate processes.
+
+Once the shared candidate pool has been prepared, the selections are
+independent: each one only writes to its own database (see get_db_path),
+processing log and output directory. In concurrent mode, log records from
+the worker processes are forwarded to the handlers of the main process
+through a queue, tagged with the name of the selection.
+"""
+
+import logging
+import logging.handlers
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+
+from scantde.paths import get_db_path
+from scantde.selections.nohostinfo.apply import (
+    NOHOST_SELECTION,
+    apply_tdescore_nohostinfo,
+)
+from scantde.selections.offnuclear.apply import (
+    OFFNUCLEAR_SELECTION,
+    apply_tdescore_offnuclear,
+)
+from scantde.selections.tdescore.apply import TDESCORE_SELECTION, apply_tdescore
+from scantde.selections.utils.pool import CandidatePool
+from scantde.utils.locks import get_tdescore_lock, set_tdescore_lock
+
+logger = logging.getLogger(__name__)
+
+SELECTIONS = {
+    TDESCORE_SELECTION: apply_tdescore,
+    NOHOST_SELECTION: apply_tdescore_nohostinfo,
+    OFFNUCLEAR_SELECTION: apply_tdescore_offnuclear,
+}
+
+_selection_name = None
+
+
+class SelectionFilter(logging.Filter):
+    """
+    Logging filter which prefixes records with the current selection name
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if _selection_name is not None:
+            record.msg = f"[{_selection_name}] {record.msg}"
+        return True
+
+
+def _init_worker(log_queue: multiprocessing.Queue, level: int, lock=None):
+    """
+    Send all log records of a worker process to the main process, and share
+    the lock for writes to shared tdescore data
+
+    :param log_queue: Queue read by the main process
+    :param level: Logging level of the root logger
+    :param lock: Lock for writes to shared tdescore data, or None for no lock
+    :return: None
+    """
+    set_tdescore_lock(lock)
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    handler = logging.handlers.QueueHandler(log_queue)
+    handler.addFilter(SelectionFilter())
+    root.addHandler(handler)
+    root.setLevel(level)
+
+
+def _run_selection(
+    selection: str,
+    df: pd.DataFrame,
+    base_output_dir: Path,
+    pool: CandidatePool | None,
+) -> tuple[str, float]:
+    """
+    Run a single selection, possibly in a worker process
+
+    :param selection: Name of the selection
+    :param df: Table of sources
+    :param base_output_dir: Nightly output directory
+    :param pool: Shared candidate pool
+    :return: Name of the selection, and its duration [s]
+    """
+    global _selection_name
+    _selection_name = selection
+    t_start = time.perf_counter()
+    try:
+        SELECTIONS[selection](df, base_output_dir=base_output_dir, pool=pool)
+    finally:
+        _selection_name = None
+    return selection, time.perf_counter() - t_start
+
+
+def run_selections(
+    df: pd.DataFrame,
+    base_output_dir: Path,
+    pool: CandidatePool | None = None,
+    selections: list[str] | None = None,
+    n_workers: int = 1,
+    on_complete: Callable[[str, float], None] | None = None,
+) -> dict[str, float]:
+    """
+    Run the selections on a table of sources
+
+    :param df: Table of sources
+    :param base_output_dir: Nightly output directory
+    :param pool: Shared candidate pool for the night
+    :param selections: Names of the selections to run, or None for all
+    :param n_workers: Number of worker processes (1 to run serially)
+    :param on_complete: Function called with the name and duration of each
+        selection as soon as it has finished
+    :return: Duration of each selection [s]
+    """
+    durations = {}
+
+    def record(result: tuple[str, float]):
+        selection, duration = result
+        logger.info(f"Finished selection {selection} in {duration:.1f}s")
+        durations[selection] = duration
+        if on_complete is not None:
+            on_complete(selection, duration)
+
+    if selections is None:
+        selections = list(SELECTIONS)
+
+    for selection in selections:
+        if selection not in SELECTIONS:
+            raise ValueError(
+                f"Unknown selection '{selection}', "
+                f"must be one of {list(SELECTIONS)}"
+            )
+
+    n_workers = min(n_workers, len(selections))
+
+    if n_workers < 2:
+        for selection in selections:
+            record(_run_selection(selection, df.copy(), base_output_dir, pool))
+        return durations
+
+    # Each selection must have its own database, as SQLite cannot be safely
+    # written to from several processes
+    db_paths = [get_db_path(x) for x in selections]
+    if len(set(db_paths)) != len(db_paths):
+        raise ValueError(
+            f"Selections {selections} share a database, so cannot be run "
+            f"concurrently"
+        )
+
+    logger.info(f"Running {len(selections)} selections with {n_workers} workers")
+
+    # Selections write to the data files tdescore shares between sources, so
+    # those writes are serialised, with the lock of a backfill if there is one
+    lock = get_tdescore_lock()
+    if lock is None:
+        lock = multiprocessing.Lock()
+
+    log_queue = multiprocessing.Queue()
+    listener = logging.handlers.QueueListener(
+        log_queue, *logging.getLogger().handlers, respect_handler_level=True
+    )
+    listener.start()
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=n_workers,
+            initializer=_init_worker,
+            initargs=(log_queue, logging.getLogger().level, lock),
+        ) as executor:
+            futures = {
+                executor.submit(
+                    _run_selection, selection, df.copy(), base_output_dir, pool
+                ): selection
+                for selection in selections
+            }
+            # Record each selection as soon as it finishes, so one failure
+            # does not hide the others, and raise the first error at the end
+            error = None
+            for future in as_completed(futures):
+                try:
+                    record(future.result())
+                except Exception as e:
+                    logger.error(f"Selection {futures[future]} failed: {e}")
+                    if error is None:
+                        error = e
+            if error is not None:
+                raise error
+    finally:
+        listener.stop()
+
+    return durations
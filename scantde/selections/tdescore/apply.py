@@ -23,7 +23,7 @@ from tdescore.lightcurve.thermal import (
 
 from scantde.selections.utils.algorithmic_cuts import apply_algorithmic_cuts
 from scantde.selections.utils.classifiers import apply_classifier
-from scantde.utils.skyportal import export_to_skyportal
+from scantde.utils.skyportal import plan_export
 from scantde.log import export_processing_log
 
 from scantde.log import update_source_list
@@ -32,6 +32,7 @@ from scantde.selections.utils.apply_thermal import apply_thermal
 from scantde.selections.utils.download import download_data
 from scantde.selections.utils.export import export_results
 from scantde.selections.utils.apply_lightcurve import apply_lightcurve
+from scantde.selections.utils.pool import CandidatePool
 from scantde.selections.utils.apply_infant import apply_infant
 from scantde.selections.utils.apply_full import apply_full
 from scantde.utils.slack import send_to_slack
@@ -46,12 +47,14 @@ TDESCORE_SELECTION = "tdescore"
 def apply_tdescore(
     df: pd.DataFrame,
     base_output_dir: Path,
+    pool: CandidatePool | None = None,
 ):
     """
     Function to apply the TDEScore to a table of sources
 
     :param df: Table of sources
     :param base_output_dir: Directory to save output
+    :param pool: Shared candidate pool for the night
     """
 
     datestr = base_output_dir.name
@@ -66,7 +69,7 @@ def apply_tdescore(
 
         df, full_df, proc_log = apply_algorithmic_cuts(
             df, selection=TDESCORE_SELECTION, proc_log=proc_log,
-            require_nuclear=True, require_multidet=False
+            require_nuclear=True, require_multidet=False, pool=pool
         )
 
         # Apply the host classifier, which includes WISE data
@@ -86,11 +89,12 @@ def apply_tdescore(
 
         # Now we have the host classifier applied, we can download the data
         df, full_df, proc_log = download_data(
-            df, datestr=datestr, selection=TDESCORE_SELECTION, proc_log=proc_log
+            df, datestr=datestr, selection=TDESCORE_SELECTION, proc_log=proc_log,
+            pool=pool,
         )
 
         apply_lightcurve(
-            df, base_output_dir=base_output_dir,
+            df, base_output_dir=base_output_dir, pool=pool,
         )
 
         df = apply_full(
@@ -108,8 +112,10 @@ def apply_tdescore(
 
         full_df = export_results(df, datestr=datestr, selection=TDESCORE_SELECTION)
 
-        # Export sources to SkyPortal
-        export_to_skyportal(full_df[~full_df["is_junk"]])
+        # Plan the SkyPortal exports, which are run once all selections are done
+        plan_export(
+            full_df[~full_df["is_junk"]], datestr=datestr, selection=TDESCORE_SELECTION,
+        )
         logger.info(df)
 
     except NoSourcesError:
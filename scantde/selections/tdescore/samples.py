@@ -2,7 +2,7 @@
 Selection functions for samples derived from tdescore
 """
 import pandas as pd
-from scantde.utils.skyportal import export_to_skyportal
+from scantde.utils.skyportal import ExportPlanner, export_to_skyportal
 
 
 def selection_thermal(df: pd.DataFrame, window: float) -> pd.DataFrame:
@@ -31,13 +31,21 @@ def selection_thermal(df: pd.DataFrame, window: float) -> pd.DataFrame:
     return df[mask]
 
 
-def export_thermal_selection(df: pd.DataFrame, window: float, group_id: int):
+def export_thermal_selection(
+    df: pd.DataFrame, window: float, group_id: int,
+    planner: ExportPlanner | None = None,
+):
     """
     Function to manage the 30 day selection
+
+    If a planner is given, the export is added to it rather than run directly
     """
     df_cut = selection_thermal(df, window=window)
     print(f"Exporting {len(df_cut)} sources to SkyPortal with group_id {group_id} and window {window} days")
-    export_to_skyportal(df_cut, group_id=group_id)
+    if planner is not None:
+        planner.add(df_cut, group_id=group_id)
+    else:
+        export_to_skyportal(df_cut, group_id=group_id)
 
 
 def selection_cut(df: pd.DataFrame, key: str, min_age: float | None = None, max_age: float | None = None) -> pd.DataFrame:
@@ -61,9 +69,14 @@ def selection_cut(df: pd.DataFrame, key: str, min_age: float | None = None, max_
     return df[mask]
 
 
-def export_cut_selection(df: pd.DataFrame, key: str, group_id: int, min_age: float | None = None, max_age: float | None = None):
+def export_cut_selection(
+    df: pd.DataFrame, key: str, group_id: int, min_age: float | None = None,
+    max_age: float | None = None, planner: ExportPlanner | None = None,
+):
     """
     Function to manage the TDEScore threshold selection
+
+    If a planner is given, the export is added to it rather than run directly
     """
     df_cut = selection_cut(df, key=key, min_age=min_age, max_age=max_age)
     if len(df_cut) > 0:
@@ -71,7 +84,10 @@ def export_cut_selection(df: pd.DataFrame, key: str, group_id: int, min_age: flo
               f"SkyPortal with group_id {group_id} and key {key}")
 
         print(df_cut[["ztf_name", "age"]])
-        export_to_skyportal(df_cut, group_id=group_id)
+        if planner is not None:
+            planner.add(df_cut, group_id=group_id)
+        else:
+            export_to_skyportal(df_cut, group_id=group_id)
 
 
 thermal_export_map = {
@@ -91,12 +107,20 @@ cut_export_map = {
 
 def export_selections(df: pd.DataFrame):
     """
-    Export the selections to a CSV file
+    Export the selections to SkyPortal, with each source posted once to all
+    of its groups
     """
+    planner = ExportPlanner()
+
     for window, group_id in thermal_export_map.items():
-        export_thermal_selection(df, window=float(window), group_id=int(group_id))
+        export_thermal_selection(
+            df, window=float(window), group_id=int(group_id), planner=planner
+        )
 
     for key, (group_id, min_age, max_age) in cut_export_map.items():
         export_cut_selection(
-            df, key=key, group_id=int(group_id), min_age=min_age, max_age=max_age
+            df, key=key, group_id=int(group_id), min_age=min_age, max_age=max_age,
+            planner=planner,
         )
+
+    planner.execute()
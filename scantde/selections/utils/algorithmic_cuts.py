@@ -1,16 +1,21 @@
 import pandas as pd
 from scantde.log import update_processing_log, update_source_list
 from scantde.errors import NoSourcesError
-from tqdm import tqdm
 from astropy.coordinates import SkyCoord
-from scantde.selections.utils.crossmatch import download_crossmatch_fast
+from scantde.selections.utils.crossmatch import (
+    download_crossmatch_all,
+    download_crossmatch_fast,
+)
+from scantde.selections.utils.deduplicate import deduplicate_sources
 
 from scantde.log.model import ProcStage
 
 
-from tdescore.combine.parse import combine_all_sources
+from scantde.selections.utils.features import combine_sources, invalidate_sources
+from scantde.selections.utils.pool import (
+    CandidatePool, CROSSMATCH_FAST, CROSSMATCH_WISE, run_pending
+)
 from tdescore.download.all import (
-    download_all,
     download_fritz_data,
     download_gaia_data,
     download_panstarrs_data,
@@ -31,6 +36,70 @@ MAX_DIST_ARCSEC = 0.9  # Max distance from nucleus in arcsec for nuclear candida
 
 CROSSMATCH_RADIUS = 3.0  # Distance in arcsec for PS1 crossmatch candidates
 MAX_SGSCORE = 0.51 # Maximum sgscore1 value for stellar candidates
+MIN_GAL_B = 10.  # Minimum absolute Galactic latitude in degrees
+
+
+def sgscore_mask(df: pd.DataFrame) -> pd.Series:
+    """
+    Mask of sources which are not stars according to PS1 sgscore
+    """
+    return (df["sgscore1"] < MAX_SGSCORE) | (df["sgscore1"] == -999.0) | (
+                df["distpsnr1"] > CROSSMATCH_RADIUS)
+
+
+def add_galactic_latitude(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add the Galactic latitude 'gal_b' of each source
+    """
+    c = SkyCoord(ra=df["ra"].values, dec=df["dec"].values, unit="deg")
+    df["gal_b"] = c.galactic.b.deg
+    return df
+
+
+def galactic_latitude_mask(df: pd.DataFrame) -> pd.Series:
+    """
+    Mask of sources away from the Galactic plane
+    """
+    return (df["gal_b"] < -MIN_GAL_B) | (df["gal_b"] > MIN_GAL_B)
+
+
+def nuclear_mask(df: pd.DataFrame) -> pd.Series:
+    """
+    Mask of sources close to the nucleus of their PS1 host
+    """
+    return df["distpsnr1"] < MAX_DIST_ARCSEC
+
+
+def bright_host_mask(df: pd.DataFrame) -> np.ndarray:
+    """
+    Mask of sources without a really bright (stellar) PS1 host
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for column in ["sgmag1", "srmag1", "simag1", "szmag1"]:
+        mask &= (df[column] > 12.) | (df[column] == -999.)
+    return mask
+
+
+def neargaiabright_mask(df: pd.DataFrame) -> pd.Series:
+    """
+    Mask of sources without a nearby bright Gaia star
+    """
+    return (df["neargaiabright"] > 5.) | (df["neargaiabright"] < -0.0)
+
+
+def crossmatch_fast_mask(full_df: pd.DataFrame) -> pd.Series:
+    """
+    Mask of sources without significant Gaia parallax or a Milliquas match
+    """
+    return (full_df["gaia_aplx"] < 5.0) & ~full_df["has_milliquas"]
+
+
+def wise_agn_mask(full_df: pd.DataFrame) -> pd.Series:
+    """
+    Mask of sources with AGN-like WISE colours
+    """
+    return full_df["catwise_w1_m_w2"] > 0.7
+
 
 def apply_algorithmic_cuts(
     df: pd.DataFrame,
@@ -39,6 +108,7 @@ def apply_algorithmic_cuts(
     require_nuclear: bool = True,
     require_multidet: bool = True,
     cut_wise: bool = True,
+    pool: CandidatePool | None = None,
 ) -> tuple[pd.DataFrame, pd.DataFrame, list[ProcStage]]:
     """
     Apply algorithmic cuts to the DataFrame of candidates.
@@ -49,6 +119,8 @@ def apply_algorithmic_cuts(
     :param require_nuclear: whether to require nuclear candidates
     :param require_multidet: whether to require multiple detections
     :param cut_wise: whether to apply WISE cuts
+    :param pool: shared candidate pool, to skip crossmatch downloads already
+        done for this night
     :return: DataFrame with algorithmic cuts applied
     """
 
@@ -59,8 +131,7 @@ def apply_algorithmic_cuts(
     proc_log = update_processing_log(proc_log, "Initial", df)
 
     # Remove stars
-    mask = (df["sgscore1"] < MAX_SGSCORE) | (df["sgscore1"] == -999.0) | (
-                df["distpsnr1"] > CROSSMATCH_RADIUS)
+    mask = sgscore_mask(df)
     df = df[mask].copy()
     logger.info(
         f"Applying sgscore cut, leaving {len(df)} sources including {sum(df['is_tde'])} TDEs")
@@ -84,14 +155,7 @@ def apply_algorithmic_cuts(
     # Deduplicate
     logger.info("Deduplicating sources")
 
-    new = []
-
-    for name in tqdm(set(df["ztf_name"])):
-        mask = df["ztf_name"] == name
-        df_cut = df[mask].sort_values(by="jd")
-        new.append(df_cut.iloc[0])
-
-    df = pd.DataFrame(new)
+    df = deduplicate_sources(df)
     df = df.sort_values(by=["is_tde", "ztf_name"], ascending=[False, False])
     df.reset_index(drop=True, inplace=True)
 
@@ -100,25 +164,22 @@ def apply_algorithmic_cuts(
     proc_log = update_processing_log(proc_log, "De-duplicated", df)
 
     # Remove galactic sources
-    c = SkyCoord(ra=df["ra"].values, dec=df["dec"].values, unit="deg")
-    df["gal_b"] = c.galactic.b.deg
+    df = add_galactic_latitude(df)
 
-    min_gal_b = 10
-
-    mask = (df["gal_b"] < -min_gal_b) | (df["gal_b"] > min_gal_b)
+    mask = galactic_latitude_mask(df)
     df, proc_log = update_source_list(
         df, proc_log, mask, selection=selection,
         stage="Algorithmic cuts - Galactic latitude", export_db=False
     )
 
     logger.info(
-        f"Applying Galactic latitude cut (|b| > {min_gal_b}), "
+        f"Applying Galactic latitude cut (|b| > {MIN_GAL_B}), "
         f"leaving {len(df)} sources"
     )
 
     if require_nuclear:
         # Remove sources which are not nuclear
-        mask = df["distpsnr1"] < MAX_DIST_ARCSEC
+        mask = nuclear_mask(df)
 
         df, proc_log = update_source_list(
             df, proc_log, mask, selection=selection,
@@ -127,11 +188,8 @@ def apply_algorithmic_cuts(
 
         logger.info(f"Applying nuclear distance cut, leaving {len(df)} sources")
 
-    mask = np.ones(len(df), dtype=bool)
-
     # Remove really bright hosts (stellar)
-    for column in ["sgmag1", "srmag1", "simag1", "szmag1"]:
-        mask &= (df[column] > 12.) | (df[column] == -999.)
+    mask = bright_host_mask(df)
 
     df, proc_log = update_source_list(
         df, proc_log, mask, selection=selection,
@@ -143,7 +201,7 @@ def apply_algorithmic_cuts(
     )
 
     # Remove bright hosts (galactic)
-    mask = (df["neargaiabright"] > 5.) | (df["neargaiabright"] < -0.0)
+    mask = neargaiabright_mask(df)
 
     df, proc_log = update_source_list(
         df, proc_log, mask, selection=selection,
@@ -156,12 +214,13 @@ def apply_algorithmic_cuts(
 
     # Download fast crossmatch data (no WISE)
     logger.info("Downloading fast crossmatch data")
-    download_crossmatch_fast(df.copy())
+    new = run_pending(df, CROSSMATCH_FAST, download_crossmatch_fast, pool=pool)
+    invalidate_sources(new["ztf_name"])
     logger.info("Combining fast crossmatch sources")
-    full_df = combine_all_sources(df.copy(), save=False)
+    full_df = combine_sources(df)
 
     # Remove sources with gaia parallax > 3 sigma, or with a milliquas match
-    mask = (full_df["gaia_aplx"] < 5.0) & ~full_df["has_milliquas"]
+    mask = crossmatch_fast_mask(full_df)
 
     df, proc_log = update_source_list(
         df, proc_log, mask, selection=selection,
@@ -170,19 +229,22 @@ def apply_algorithmic_cuts(
 
     # Apply cuts which includes WISE data
     logger.info("Downloading WISE data")
-    download_all(df.copy(), include_optional=False)
+    new = run_pending(
+        df, CROSSMATCH_WISE, download_crossmatch_all, pool=pool
+    )
+    invalidate_sources(new["ztf_name"])
 
     logger.info("Combining all crossmatch data")
-    full_df = combine_all_sources(df.copy(), save=False)
+    full_df = combine_sources(df)
 
     if cut_wise and "catwise_w1_m_w2" in full_df.columns:
         # Remove sources with WISE data that is AGN-ish
-        mask = (full_df["catwise_w1_m_w2"] > 0.7)
+        mask = wise_agn_mask(full_df)
 
         df, proc_log = update_source_list(
             df, proc_log, ~mask, selection=selection,
             stage="CatWISE cuts"
         )
-        full_df = combine_all_sources(df.copy(), save=False)
+        full_df = combine_sources(df)
     
     return df, full_df, proc_log
\ No newline at end of file
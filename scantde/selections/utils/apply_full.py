@@ -1,7 +1,7 @@
 import pandas as pd
 import numpy as np
 
-from tdescore.combine.parse import combine_all_sources
+from scantde.selections.utils.features import combine_sources
 from scantde.selections.utils.classifiers import apply_classifier
 from scantde.log import update_processing_log, update_source_list
 from scantde.log.model import ProcStage
@@ -21,7 +21,7 @@ def apply_full(
     """
     shap_base_dir = base_output_dir / f"{selection}/shap"
 
-    full_df = combine_all_sources(df, save=False)
+    full_df = combine_sources(df)
     scores, nan_mask = apply_classifier(
         full_df, "full", selection=selection, explain=True,
         shap_base_dir=shap_base_dir
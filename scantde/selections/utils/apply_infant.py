@@ -3,7 +3,7 @@ import numpy as np
 
 from pathlib import Path
 
-from tdescore.combine.parse import combine_all_sources
+from scantde.selections.utils.features import combine_sources
 from scantde.selections.utils.classifiers import apply_classifier
 from scantde.log import update_source_list
 from scantde.log.model import ProcStage
@@ -18,7 +18,7 @@ def apply_infant(
     proc_log: list[ProcStage],
     base_output_dir: Path
 ) -> tuple[pd.DataFrame, list[ProcStage]]:
-    full_df = combine_all_sources(df, save=False)
+    full_df = combine_sources(df)
 
     shap_base_dir = base_output_dir / f"{selection}/shap"
 
@@ -42,7 +42,7 @@ def apply_infant(
     logger.info(f"Assigning scores to {len(scores)} sources with later data")
 
     # From here we assign scores if data is available but don't cut on them
-    full_df = combine_all_sources(df.copy(), save=False)
+    full_df = combine_sources(df)
     scores, nan_mask = apply_classifier(
         full_df, "week", selection=selection, explain=True,
         shap_base_dir=shap_base_dir
@@ -4,7 +4,9 @@ from pathlib import Path
 from scantde.utils.plot import create_lightcurve_plots
 from tdescore.sncosmo.run_sncosmo import batch_sncosmo
 from tdescore.lightcurve.analyse import batch_analyse
-from tdescore.combine.parse import combine_all_sources
+from scantde.selections.utils.features import combine_sources, invalidate_sources
+from scantde.selections.utils.fit_cache import get_detection_hashes, run_cached_fit
+from scantde.selections.utils.pool import CandidatePool, LIGHTCURVE
 
 import logging
 
@@ -15,28 +17,61 @@ logger = logging.getLogger(__name__)
 def apply_lightcurve(
     df: pd.DataFrame,
     base_output_dir: Path,
+    pool: CandidatePool | None = None,
+    detection_hashes: dict[str, str | None] | None = None,
 ):
-    logger.info("Making lightcurve plots")
-    full_df = combine_all_sources(df)
-    create_lightcurve_plots(full_df, base_output_dir)
+    """
+    Make lightcurve plots, and run the GP / SNcosmo analysis for sources
+    without previous lightcurve analysis. Fits and plots are reused for
+    sources without new detections since they were last made.
+
+    :param df: Table of sources
+    :param base_output_dir: Nightly output directory
+    :param pool: Shared candidate pool, whose sources are already plotted
+    :param detection_hashes: Precomputed hashes of the detections, or None
+    :return: None
+    """
+    names = df["ztf_name"][~df["tdescore_lc"]]
+    if detection_hashes is None:
+        detection_hashes = get_detection_hashes(names, datestr=base_output_dir.name)
+
+    plot_df = df if pool is None else df[~pool.is_done(LIGHTCURVE, df)]
+
+    if len(plot_df) > 0:
+        logger.info("Making lightcurve plots")
+        full_df = combine_sources(plot_df)
+        create_lightcurve_plots(
+            full_df, base_output_dir, detection_hashes=detection_hashes
+        )
 
     logger.info("Running GP / SNcosmo analysis on full lightcurve data")
 
     gp_output_dir = base_output_dir / "gp"
     gp_output_dir.mkdir(parents=True, exist_ok=True)
-    batch_analyse(
-        df["ztf_name"][~df["tdescore_lc"]],
-        overwrite=True,
-        include_text=False,
-        base_output_dir=gp_output_dir,
-        thermal_windows=[],
+
+    run_cached_fit(
+        names, "gp", None, base_output_dir=base_output_dir,
+        fit=lambda x: batch_analyse(
+            x,
+            overwrite=True,
+            include_text=False,
+            base_output_dir=gp_output_dir,
+            thermal_windows=[],
+        ),
+        detection_hashes=detection_hashes,
+        image_dir="gp/None",
     )
     # Only run on the full lightcurve data
-    batch_sncosmo(
-        df["ztf_name"][~df["tdescore_lc"]],
-        overwrite=True,
-        windows=[None],
+    run_cached_fit(
+        names, "sncosmo", None, base_output_dir=base_output_dir,
+        fit=lambda x: batch_sncosmo(
+            x,
+            overwrite=True,
+            windows=[None],
+        ),
+        detection_hashes=detection_hashes,
     )
+    invalidate_sources(names)
 
     # df.loc[~nan_mask, ["tdescore"]] = scores
     # df.loc[~nan_mask, ["tdescore_best"]] = "full"
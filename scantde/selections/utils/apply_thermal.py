@@ -4,7 +4,8 @@ from pathlib import Path
 
 import pandas as pd
 
-from tdescore.combine.parse import combine_all_sources
+from scantde.selections.utils.features import combine_sources, invalidate_sources
+from scantde.selections.utils.fit_cache import get_detection_hashes, run_cached_fit
 from tdescore.lightcurve.analyse import batch_analyse, batch_analyse_thermal
 from tdescore.sncosmo.run_sncosmo import batch_sncosmo
 from tdescore.lightcurve.thermal import THERMAL_WINDOWS
@@ -14,29 +15,15 @@ from scantde.selections.utils.relabel import relabel_fields
 
 logger = logging.getLogger(__name__)
 
-def apply_thermal(
-    df: pd.DataFrame,
-    selection: str,
-    base_output_dir: Path,
-) -> pd.DataFrame:
+
+def assign_thermal_windows(df: pd.DataFrame) -> pd.DataFrame:
     """
-    Apply the thermal classifier to a given source table.
-    Selects the best thermal window for each source based on its age, and only applies the LC fitting for that window.
+    Select the best thermal window for each source based on its age
 
     :param df: DataFrame containing source data
-    :param selection: Selection name to use for the classifier (e.g. 'tdescore')
-    :param base_output_dir: Base output directory for results
-    :return: DataFrame with classification results
+    :return: DataFrame with a 'thermal_window' column
     """
-    logger.info("Applying thermal lightcurve classifier")
-
-    gp_output_dir = base_output_dir / f"gp"
-    gp_output_dir.mkdir(parents=True, exist_ok=True)
-
-    shap_base_dir = base_output_dir / f"{selection}/shap"
-
-    df.reset_index(drop=True, inplace=True)
-    full_df = combine_all_sources(df, save=False)
+    full_df = combine_sources(df)
 
     best_windows = []
 
@@ -48,9 +35,34 @@ def apply_thermal(
         best_windows.append(window)
 
     df["thermal_window"] = best_windows
+    return df
+
+
+def fit_thermal(
+    df: pd.DataFrame,
+    base_output_dir: Path,
+    detection_hashes: dict[str, str | None] | None = None,
+) -> list[float | None]:
+    """
+    Run the thermal GP and SNcosmo fits for each source in its thermal window,
+    skipping sources with previous lightcurve analysis, and reusing fits for
+    sources without new detections since their last fit
+
+    :param df: DataFrame containing source data, with a 'thermal_window' column
+    :param base_output_dir: Base output directory for results
+    :param detection_hashes: Precomputed hashes of the detections, or None
+    :return: List of thermal windows containing at least one source
+    """
+    gp_output_dir = base_output_dir / f"gp"
+    gp_output_dir.mkdir(parents=True, exist_ok=True)
 
     windows = []
 
+    if detection_hashes is None:
+        detection_hashes = get_detection_hashes(
+            df["ztf_name"][~df["tdescore_lc"]], datestr=base_output_dir.name
+        )
+
     for window in THERMAL_WINDOWS:
 
         logger.info(f"Analysing thermal data for window {window}")
@@ -64,22 +76,60 @@ def apply_thermal(
 
         logger.info(f"{sum(mask)} sources have thermal data for window {window}")
 
-        batch_analyse_thermal(
-            df["ztf_name"][mask & ~df["tdescore_lc"]],
-            overwrite=True,
-            base_output_dir=gp_output_dir,
-            thermal_windows=[window],
-            timeout_duration=120.0 # seconds per source
+        names = df["ztf_name"][mask & ~df["tdescore_lc"]]
+
+        run_cached_fit(
+            names, "gp_thermal", window, base_output_dir=base_output_dir,
+            fit=lambda x: batch_analyse_thermal(
+                x,
+                overwrite=True,
+                base_output_dir=gp_output_dir,
+                thermal_windows=[window],
+                timeout_duration=120.0 # seconds per source
+            ),
+            detection_hashes=detection_hashes,
+            image_dir=f"gp_thermal/{float(window) if window is not None else None}",
         )
         # Run sncosmo on the data in the thermal window
-        batch_sncosmo(
-            full_df["ztf_name"][mask & ~df["tdescore_lc"]], overwrite=True,
-            windows=[window],
+        run_cached_fit(
+            names, "sncosmo", window, base_output_dir=base_output_dir,
+            fit=lambda x: batch_sncosmo(
+                x, overwrite=True,
+                windows=[window],
+            ),
+            detection_hashes=detection_hashes,
         )
 
         windows.append(window)
 
-    full_df = combine_all_sources(df, save=False)
+    invalidate_sources(df["ztf_name"][~df["tdescore_lc"]])
+    return windows
+
+
+def apply_thermal(
+    df: pd.DataFrame,
+    selection: str,
+    base_output_dir: Path,
+) -> pd.DataFrame:
+    """
+    Apply the thermal classifier to a given source table.
+    Selects the best thermal window for each source based on its age, and only applies the LC fitting for that window.
+
+    :param df: DataFrame containing source data
+    :param selection: Selection name to use for the classifier (e.g. 'tdescore')
+    :param base_output_dir: Base output directory for results
+    :return: DataFrame with classification results
+    """
+    logger.info("Applying thermal lightcurve classifier")
+
+    shap_base_dir = base_output_dir / f"{selection}/shap"
+
+    df.reset_index(drop=True, inplace=True)
+    df = assign_thermal_windows(df)
+
+    windows = fit_thermal(df, base_output_dir=base_output_dir)
+
+    full_df = combine_sources(df)
 
     for window in windows:
 
@@ -6,11 +6,8 @@ import logging
 from pathlib import Path
 from typing import Optional
 
-import joblib
-import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-import shap
 from tdescore.classifier.collate import convert_to_train_dataset
 from tdescore.classifier.features import (
     fast_host_columns,
@@ -22,9 +19,14 @@ from tdescore.classifier.features import (
     post_peak,
     get_thermal_columns,
 )
-from xgboost import XGBClassifier
 
-from scantde.paths import ml_dir
+from scantde.selections.utils.registry import model_registry
+from scantde.selections.utils.explain import (
+    SHAP_OUTPUTS,
+    get_explainer,
+    render_waterfalls,
+    save_shap_values,
+)
 
 logger = logging.getLogger(__name__)
 
@@ -35,7 +37,25 @@ def apply_classifier(
     selection: str,
     shap_base_dir: Optional[Path] = None,
     explain: bool = True,
+    shap_output: str = "plot",
 ):
+    """
+    Apply a tdescore classifier to a table of sources
+
+    :param source_table: Table of sources, as returned by combine_all_sources
+    :param classifier: Classifier to apply (e.g. 'host', 'infant', 'thermal_30.0')
+    :param selection: Selection name (e.g. 'tdescore')
+    :param shap_base_dir: Base directory for SHAP output, required if explain=True
+    :param explain: Whether to explain the scores with SHAP
+    :param shap_output: SHAP output to write, either 'plot' (waterfall PNGs),
+        'values' (a Parquet file of raw SHAP values) or 'both'
+    :return: Scores, and a mask of sources which could not be scored
+    """
+    if shap_output not in SHAP_OUTPUTS:
+        raise ValueError(
+            f"Unknown shap_output: {shap_output}, must be one of {SHAP_OUTPUTS}"
+        )
+
     chunks = [x for x in selection.split("_") if x != "tdescore"]
     selection_parsed = "_".join(chunks)
 
@@ -75,12 +95,7 @@ def apply_classifier(
     else:
         raise ValueError(f"Unknown classifier: {classifier}")
 
-    tdescore_path = ml_dir.joinpath(f"{classifier_name}.json")
-    clf = XGBClassifier()
-    clf.load_model(str(tdescore_path))
-
-    train_data = ml_dir.joinpath(f"tdescore_train_data.pkl")
-    train_data = joblib.load(train_data)
+    clf = model_registry.get_classifier(classifier_name)
 
     relevant_columns, column_descriptions = parse_columns(columns)
 
@@ -112,27 +127,22 @@ def apply_classifier(
 
         shap_output_dir.mkdir(parents=True, exist_ok=True)
 
-        # Load the training data and use it to explain the classifier
-        train_array = convert_to_train_dataset(train_data, columns=relevant_columns)
-        train_nan_mask = np.array([np.sum(pd.isnull(x)) > 0 for x in train_array])
-        train_array = train_array[~train_nan_mask].astype(float)
-        explainer = shap.Explainer(clf, train_array, feature_names=relevant_columns)
+        explainer = get_explainer(clf, classifier_name, relevant_columns)
 
         # Apply explainer to the new data
         shap_values = explainer(data_to_use)
 
-        for i, shap_value in enumerate(shap_values):
-
-            source_name = source_table[~nan_mask]["ztf_name"].to_list()[i]
+        source_names = source_table[~nan_mask]["ztf_name"].to_list()
 
-            save_path = shap_output_dir.joinpath(f"{source_name}.png")
-
-            fig = plt.figure()
-
-            shap.plots.waterfall(shap_value, max_display=5, show=False)
+        if shap_output in ["plot", "both"]:
+            render_waterfalls(
+                shap_values, source_names, scores,
+                classifier_name=classifier_name, output_dir=shap_output_dir
+            )
 
-            plt.title(f"{source_name} (tdescore_{classifier_name}={scores[i]:.4f})")
-            plt.savefig(save_path, bbox_inches="tight")
-            plt.close(fig)
+        if shap_output in ["values", "both"]:
+            save_shap_values(
+                shap_values, source_names, scores, output_dir=shap_output_dir
+            )
 
     return scores, nan_mask
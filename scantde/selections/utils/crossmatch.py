@@ -1,19 +1,32 @@
 import logging
 
 import pandas as pd
+from tdescore.download.all import download_all
 from tdescore.download.gaia import download_gaia_data
 from tdescore.download.mast import download_panstarrs_data
 from tdescore.download.kowalski import download_ps1strm_data
 
+from scantde.utils.locks import tdescore_writes
+
 logger = logging.getLogger(__name__)
 
 def download_crossmatch_fast(source_table: pd.DataFrame):
     """
     Function to download crossmatch data from external catalogues
     """
-    logger.info("Downloading PS1STRM data")
-    download_ps1strm_data(source_table)
-    logger.info("Downloading Gaia data")
-    download_gaia_data(source_table)
-    logger.info("Downloading PanSTARRS data")
-    download_panstarrs_data(source_table)
\ No newline at end of file
+    with tdescore_writes():
+        logger.info("Downloading PS1STRM data")
+        download_ps1strm_data(source_table)
+        logger.info("Downloading Gaia data")
+        download_gaia_data(source_table)
+        logger.info("Downloading PanSTARRS data")
+        download_panstarrs_data(source_table)
+
+
+def download_crossmatch_all(source_table: pd.DataFrame):
+    """
+    Function to download the remaining (non-optional) crossmatch data,
+    including WISE
+    """
+    with tdescore_writes():
+        download_all(source_table, include_optional=False)
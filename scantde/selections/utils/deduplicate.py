@@ -0,0 +1,20 @@
+"""
+Columnar de-duplication of alert tables
+"""
+import pandas as pd
+
+
+def deduplicate_sources(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reduce a table of alerts to one row per source, keeping the earliest alert
+    (lowest jd) for each ztf_name.
+
+    The table is sorted once by (ztf_name, jd) with a stable sort, so ties in jd
+    keep their original order, and the first row of each group is taken.
+    Column dtypes are preserved.
+
+    :param df: DataFrame of alerts, with 'ztf_name' and 'jd' columns
+    :return: DataFrame with one row per source
+    """
+    df = df.sort_values(by=["ztf_name", "jd"], kind="mergesort")
+    return df.drop_duplicates(subset="ztf_name", keep="first")
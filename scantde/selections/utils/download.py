@@ -16,58 +16,166 @@ from tdescore.lightcurve.thermal import (
 )
 
 from scantde.utils.skyportal import get_skyportal_data
+from scantde.utils.skyportal.download import SKYPORTAL_DF_COLUMNS
 
 from scantde.log import update_source_list
 
 from scantde.log.model import ProcStage
 
-from tdescore.combine.parse import combine_all_sources
+from scantde.selections.utils.features import combine_sources, invalidate_sources
 from tdescore.download.all import download_legacy_survey_data
 
-from scantde.selections.utils.extinction import append_extinction_to_df
+from scantde.selections.utils.extinction import append_extinction_to_df, ext_keys
+from scantde.selections.utils.pool import (
+    CandidatePool, ALERTS, HAS_ALERTS, INPUTS, LIGHTCURVE
+)
+from scantde.utils.locks import tdescore_writes
 
 from astropy.time import Time
 
 logger = logging.getLogger(__name__)
 
+# Columns added by download_inputs, which can be shared between selections
+INPUT_COLUMNS = [x for x in SKYPORTAL_DF_COLUMNS if x != "ztf_name"] + ext_keys
+
+
+def get_t_max_jd(datestr: str) -> float:
+    """
+    Get the latest JD of data to use for a given night
+
+    :param datestr: Date string in the format YYYYMMDD
+    :return: JD
+    """
+    return Time(
+        f"{datestr[:4]}-{datestr[4:6]}-{datestr[6:]}T15:00:00.0", format='isot'
+    ).jd
+
+
+def download_alerts(
+    df: pd.DataFrame,
+    datestr: str,
+    pool: CandidatePool | None = None,
+) -> pd.Series:
+    """
+    Download all the alert data up to the specific night, for sources without
+    lightcurve analysis. Sources already downloaded in the pool are skipped.
+
+    :param df: Table of sources
+    :param datestr: Date string in the format YYYYMMDD
+    :param pool: Shared candidate pool
+    :return: Mask of sources which have lightcurve data
+    """
+    pending = ~df["tdescore_lc"]
+    has_alerts = df["tdescore_lc"].copy()
+
+    if pool is not None:
+        has_alerts |= pool.is_done(HAS_ALERTS, df)
+        pending &= ~pool.is_done(ALERTS, df)
+
+    names = df["ztf_name"][pending]
+
+    if len(names) > 0:
+        logger.info(f"Downloading full lightcurve data using backend {ZTF_BACKEND}")
+        passed_names = download_alert_data(
+            names, overwrite=True, t_max_jd=get_t_max_jd(datestr)
+        )
+        has_alerts |= df["ztf_name"].isin(passed_names)
+
+        if pool is not None:
+            pool.mark(ALERTS, names)
+            pool.mark(HAS_ALERTS, passed_names)
+
+    return has_alerts
+
+
+def download_inputs(
+    df: pd.DataFrame,
+    datestr: str,
+    pool: CandidatePool | None = None,
+) -> pd.DataFrame:
+    """
+    Add SkyPortal and extinction information to a table of sources, and
+    download Legacy Survey data. Sources already in the pool reuse its inputs.
+
+    :param df: Table of sources
+    :param datestr: Date string in the format YYYYMMDD
+    :param pool: Shared candidate pool
+    :return: Table of sources with the input columns added
+    """
+    if pool is None:
+        pool = CandidatePool(datestr)
+
+    in_pool = pool.is_done(INPUTS, df)
+
+    if (~in_pool).any():
+        new = df[~in_pool]
+
+        # Download skyportal data (redshift, tns_name, classifications)
+        new = get_skyportal_data(new, datestr=datestr)
+
+        # Download legacy survey data (redshift - either specz or photz)
+        with tdescore_writes():
+            download_legacy_survey_data(new.copy())
+
+        # Add extinction information to the DataFrame
+        new = append_extinction_to_df(new.copy())
+
+        pool.add_inputs(new, INPUT_COLUMNS)
+
+    # Join the inputs on ztf_name, so the order and index of df are kept
+    return pool.get_inputs(df)
+
+
+def load_raw_lightcurves(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Load the full lightcurve data, including the info from alerts
+
+    :param df: Table of sources
+    :return: Table of sources with the raw lightcurve columns added
+    """
+    with tdescore_writes():
+        combine_raw_source_data(df[["ztf_name"]][~df["tdescore_lc"]])
+        new_df = load_raw_sources()
+    for col in new_df.columns:
+        if col not in df.columns:
+            df[col] = new_df[col]
+    return df
+
+
 def download_data(
     df: pd.DataFrame,
     datestr: str,
     selection: str,
     proc_log: list[ProcStage],
+    pool: CandidatePool | None = None,
 ):
+    """
+    Download the lightcurve and auxiliary data for a table of sources, and
+    remove sources without lightcurve data
 
-    t_max_jd = Time(
-        f"{datestr[:4]}-{datestr[4:6]}-{datestr[6:]}T15:00:00.0", format='isot'
-    ).jd
+    :param df: Table of sources
+    :param datestr: Date string in the format YYYYMMDD
+    :param selection: Selection name
+    :param proc_log: Processing log to update
+    :param pool: Shared candidate pool, whose downloads and lightcurve
+        analysis are reused
+    :return: Table of sources, combined table, and processing log
+    """
 
-    # Download all the alert data up to the specific night
-    logger.info(f"Downloading full lightcurve data using backend {ZTF_BACKEND}")
-    passed_names = download_alert_data(
-        df["ztf_name"][~df["tdescore_lc"]], overwrite=True, t_max_jd=t_max_jd
-    )
-
-    mask = df["ztf_name"].isin(passed_names) | df["tdescore_lc"]
+    mask = download_alerts(df, datestr=datestr, pool=pool)
 
     df, proc_log = update_source_list(
         df, proc_log, mask, selection=selection,
         stage="Has lightcurve data"
     )
 
-    # Download skyportal data (redshift, tns_name, classifications)
-    df = get_skyportal_data(df, datestr=datestr)
-
-    # Download legacy survey data (redshift - either specz or photz)
-    download_legacy_survey_data(df.copy())
+    if pool is not None:
+        # Do not repeat lightcurve analysis for sources processed in the pool
+        df["tdescore_lc"] = df["tdescore_lc"] | pool.is_done(LIGHTCURVE, df)
 
-    # Add extinction information to the DataFrame
-    df = append_extinction_to_df(df.copy())
+    df = download_inputs(df, datestr=datestr, pool=pool)
 
-    # Now load the full lightcurve data, including the info from alerts
-    combine_raw_source_data(df[["ztf_name"]][~df["tdescore_lc"]])
-    new_df = load_raw_sources()
-    for col in new_df.columns:
-        if col not in df.columns:
-            df[col] = new_df[col]
-    full_df = combine_all_sources(df, save=False)
-    return df, full_df, proc_log
\ No newline at end of file
+    df = load_raw_lightcurves(df)
+    invalidate_sources(df["ztf_name"])
+    full_df = combine_sources(df)
+    return df, full_df, proc_log
@@ -0,0 +1,295 @@
+"""
+Module for explaining classifier scores with SHAP.
+
+Explainers are built once per classifier and cached on disk, keyed by a hash
+of the model, training data and feature columns. Waterfall plots are rendered
+in a process pool using the Agg backend.
+"""
+
+import hashlib
+import io
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+import shap
+from tdescore.classifier.collate import convert_to_train_dataset
+from xgboost import XGBClassifier
+
+from scantde.paths import explainer_cache_dir, SHAP_VALUES_NAME
+from scantde.selections.utils.registry import model_registry, TRAIN_DATA_NAME
+from scantde.utils.plot_pool import get_plot_pool
+
+logger = logging.getLogger(__name__)
+
+SHAP_OUTPUTS = ["plot", "values", "both"]
+
+MAX_PLOT_WORKERS = min(4, os.cpu_count() or 1)
+MIN_SOURCES_PER_WORKER = 10  # Below this, a process pool is not worth starting
+
+_explainers: dict[str, shap.Explainer] = {}
+
+_render_lock = threading.Lock()
+
+
+def get_explainer_key(classifier_name: str, columns: list[str]) -> str:
+    """
+    Get the cache key for an explainer, which changes whenever the model,
+    the training data or the feature columns change
+
+    :param classifier_name: Name of the classifier (e.g. 'infant_nohostinfo')
+    :param columns: Feature columns used by the classifier
+    :return: Hex key
+    """
+    digest = hashlib.sha256()
+    digest.update(model_registry.get_file_hash(f"{classifier_name}.json").encode())
+    digest.update(model_registry.get_file_hash(TRAIN_DATA_NAME).encode())
+    digest.update(",".join(columns).encode())
+    return digest.hexdigest()[:16]
+
+
+def get_explainer(
+    clf: XGBClassifier,
+    classifier_name: str,
+    columns: list[str],
+) -> shap.Explainer:
+    """
+    Get a SHAP explainer for a classifier, using the in-memory cache, then the
+    on-disk cache, and only building it from the training data if needed.
+
+    :param clf: Trained classifier
+    :param classifier_name: Name of the classifier
+    :param columns: Feature columns used by the classifier
+    :return: SHAP explainer
+    """
+    key = get_explainer_key(classifier_name, columns)
+
+    if key in _explainers:
+        return _explainers[key]
+
+    cache_path = explainer_cache_dir.joinpath(f"{classifier_name}_{key}.pkl")
+
+    explainer = None
+
+    if cache_path.exists():
+        try:
+            explainer = joblib.load(cache_path)
+            logger.debug(f"Loaded SHAP explainer from {cache_path}")
+        except Exception as e:
+            logger.warning(f"Failed to load SHAP explainer from {cache_path}: {e}")
+
+    if explainer is None:
+        logger.info(f"Building SHAP explainer for {classifier_name}")
+        train_data = model_registry.get_train_data()
+        train_array = convert_to_train_dataset(train_data, columns=columns)
+        train_nan_mask = np.array([np.sum(pd.isnull(x)) > 0 for x in train_array])
+        train_array = train_array[~train_nan_mask].astype(float)
+        explainer = shap.Explainer(clf, train_array, feature_names=columns)
+
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        joblib.dump(explainer, tmp_path)
+        tmp_path.replace(cache_path)
+        prune_explainer_cache(classifier_name, key)
+
+    _explainers[key] = explainer
+    return explainer
+
+
+def prune_explainer_cache(classifier_name: str, key: str) -> int:
+    """
+    Delete the cached explainers of a classifier, except the newest key
+
+    :param classifier_name: Name of the classifier
+    :param key: Key of the explainer to keep
+    :return: Number of explainers deleted
+    """
+    pattern = re.compile(rf"{re.escape(classifier_name)}_[0-9a-f]{{16}}\.pkl")
+    n_deleted = 0
+    for path in explainer_cache_dir.glob(f"{classifier_name}_*.pkl"):
+        if pattern.fullmatch(path.name) and (path.name != f"{classifier_name}_{key}.pkl"):
+            path.unlink(missing_ok=True)
+            n_deleted += 1
+    if n_deleted > 0:
+        logger.debug(f"Deleted {n_deleted} old SHAP explainers of {classifier_name}")
+    return n_deleted
+
+
+def _plot_waterfall(
+    values: np.ndarray,
+    base_value: float,
+    data: np.ndarray,
+    feature_names: list[str],
+    title: str,
+    save_path: Path | io.BytesIO,
+):
+    """
+    Plot a single SHAP waterfall and save it to file
+
+    :param values: SHAP values of the source
+    :param base_value: Expected value of the explainer
+    :param data: Feature values of the source
+    :param feature_names: Names of the features
+    :param title: Plot title
+    :param save_path: Output path, or a file-like object
+    :return: None
+    """
+    import matplotlib.pyplot as plt
+
+    shap_value = shap.Explanation(
+        values=values,
+        base_values=base_value,
+        data=data,
+        feature_names=feature_names,
+    )
+
+    fig = plt.figure()
+    shap.plots.waterfall(shap_value, max_display=5, show=False)
+    plt.title(title)
+    plt.savefig(save_path, bbox_inches="tight")
+    plt.close(fig)
+
+
+def render_waterfalls(
+    shap_values: shap.Explanation,
+    source_names: list[str],
+    scores: np.ndarray,
+    classifier_name: str,
+    output_dir: Path,
+    n_workers: int = MAX_PLOT_WORKERS,
+):
+    """
+    Render one waterfall plot per source, spread over a process pool
+
+    :param shap_values: SHAP values for all sources
+    :param source_names: Names of the sources, in the same order
+    :param scores: Classifier scores, in the same order
+    :param classifier_name: Name of the classifier, used in the plot titles
+    :param output_dir: Output directory for the plots
+    :param n_workers: Maximum number of plotting processes
+    :return: None
+    """
+    jobs = [
+        (
+            shap_values.values[i],
+            float(np.ravel(shap_values.base_values)[i]),
+            shap_values.data[i],
+            shap_values.feature_names,
+            f"{name} (tdescore_{classifier_name}={scores[i]:.4f})",
+            output_dir.joinpath(f"{name}.png"),
+        )
+        for i, name in enumerate(source_names)
+    ]
+
+    n_workers = min(n_workers, len(jobs) // MIN_SOURCES_PER_WORKER)
+
+    if n_workers < 2:
+        for job in jobs:
+            _plot_waterfall(*job)
+        return
+
+    with get_plot_pool(n_workers) as executor:
+        for _ in executor.map(_plot_waterfall, *zip(*jobs), chunksize=8):
+            pass
+
+
+def save_shap_values(
+    shap_values: shap.Explanation,
+    source_names: list[str],
+    scores: np.ndarray,
+    output_dir: Path,
+):
+    """
+    Save raw SHAP values to a Parquet file, so plots can be drawn on demand.
+    Each row is a source, with columns 'shap_{feature}' for the SHAP values
+    and 'data_{feature}' for the feature values.
+
+    :param shap_values: SHAP values for all sources
+    :param source_names: Names of the sources, in the same order
+    :param scores: Classifier scores, in the same order
+    :param output_dir: Output directory
+    :return: None
+    """
+    feature_names = list(shap_values.feature_names)
+
+    df = pd.DataFrame({
+        "ztf_name": source_names,
+        "score": scores,
+        "base_value": np.ravel(shap_values.base_values),
+    })
+    values = pd.DataFrame(
+        shap_values.values, columns=[f"shap_{x}" for x in feature_names]
+    )
+    data = pd.DataFrame(
+        np.asarray(shap_values.data, dtype=float),
+        columns=[f"data_{x}" for x in feature_names]
+    )
+    df = pd.concat([df, values, data], axis=1)
+
+    output_path = output_dir.joinpath(SHAP_VALUES_NAME)
+    df.to_parquet(output_path, index=False)
+    logger.debug(f"Saved SHAP values to {output_path}")
+
+
+def load_shap_values(
+    output_dir: Path, name: str
+) -> tuple[shap.Explanation, float] | None:
+    """
+    Load the SHAP values of a single source, as saved by save_shap_values
+
+    :param output_dir: Directory containing the SHAP values file
+    :param name: Name of the source
+    :return: SHAP explanation and classifier score of the source,
+        or None if not found
+    """
+    path = output_dir.joinpath(SHAP_VALUES_NAME)
+    if not path.exists():
+        return None
+
+    df = pd.read_parquet(path, filters=[("ztf_name", "==", name)])
+    if df.empty:
+        return None
+
+    row = df.iloc[0]
+    feature_names = [x[5:] for x in df.columns if x.startswith("shap_")]
+    explanation = shap.Explanation(
+        values=row[[f"shap_{x}" for x in feature_names]].to_numpy(dtype=float),
+        base_values=float(row["base_value"]),
+        data=row[[f"data_{x}" for x in feature_names]].to_numpy(dtype=float),
+        feature_names=feature_names,
+    )
+    return explanation, float(row["score"])
+
+
+def render_waterfall_png(output_dir: Path, name: str) -> bytes | None:
+    """
+    Render the waterfall plot of a single source from its saved SHAP values,
+    for sources whose plot was not written when the classifier was applied
+
+    :param output_dir: Directory containing the SHAP values file, named
+        after the classifier (e.g. '.../shap/thermal_30.0')
+    :param name: Name of the source
+    :return: PNG image, or None if the source has no saved SHAP values
+    """
+    res = load_shap_values(output_dir, name)
+    if res is None:
+        return None
+
+    explanation, score = res
+
+    buf = io.BytesIO()
+    # pyplot is not thread-safe, and the server may render in several threads
+    with _render_lock:
+        _plot_waterfall(
+            explanation.values,
+            float(explanation.base_values),
+            explanation.data,
+            explanation.feature_names,
+            f"{name} (tdescore_{output_dir.name}={score:.4f})",
+            buf,
+        )
+    return buf.getvalue()
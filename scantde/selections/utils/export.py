@@ -2,7 +2,7 @@ from unittest.mock import inplace
 
 import pandas as pd
 
-from tdescore.combine.parse import combine_all_sources
+from scantde.selections.utils.features import combine_sources
 
 from scantde.io import save_candidates, save_results
 
@@ -25,7 +25,7 @@ def export_results(df: pd.DataFrame, datestr: str, selection: str) -> pd.DataFra
     :return: Final DataFrame with junk tags applied
     """
 
-    full_df = combine_all_sources(df, save=False)
+    full_df = combine_sources(df)
 
     thermal_df = relabel_fields(full_df)
     df = df.join(thermal_df, how="left", on="ztf_name")
@@ -44,6 +44,8 @@ def export_results(df: pd.DataFrame, datestr: str, selection: str) -> pd.DataFra
     full_df = full_df.loc[:, ~full_df.columns.duplicated()]
 
     # Export the results to the database, and caches
+    # Clear any failure stage left from a previous night
+    df["fail_step"] = None
     export_to_db(df, selection=selection)
     save_results(datestr=datestr, selection=selection, result_df=full_df)
     save_candidates(datestr=datestr, selection=selection, candidates=df)
@@ -1,11 +1,39 @@
+import logging
+import os
+import time
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
 import pandas as pd
+from astropy import units as u
+from astropy_healpix import HEALPix
+from sfdmap import SFDMap
 from tdescore.lightcurve.extinction import get_extinction_correction, ztf_wavelengths, extra_wavelengths
+from tdescore.paths import sfd_path
+
+from scantde.paths import extinction_cache_dir
+
+logger = logging.getLogger(__name__)
 
 all_wavelengths = ztf_wavelengths.copy()
 all_wavelengths.update(extra_wavelengths)
 
 ext_keys = [f"ext_{name}" for name in all_wavelengths.keys()]
 
+# HEALPix resolution of the E(B-V) cache (~0.05 arcsec pixels). E(B-V) is
+# sampled at the position of the first source cached in each pixel, so other
+# sources in the pixel differ from their own position by less than this,
+# which is negligible against the ~2.4 arcmin pixels of the SFD map itself
+EXTINCTION_NSIDE = 2 ** 22
+
+# Number of files the cache is appended to before they are merged into one
+MAX_CACHE_PARTS = 32
+
+# Positions used to derive the extinction per unit E(B-V) at each wavelength
+CALIBRATION_POSITIONS = [(83.82, -5.39), (10.68, 41.27)]
+
+
 def get_extinction_dict(
     row: pd.Series
 ) -> dict[str, float]:
@@ -22,19 +50,205 @@ def get_extinction_dict(
         new[f"ext_{f_name}"] = extinction[0]
     return new
 
+
+@lru_cache(maxsize=1)
+def get_sfd_map() -> SFDMap:
+    """
+    Get the SFD dust map, which is only loaded once per process
+
+    :return: SFDMap
+    """
+    return SFDMap(sfd_path)
+
+
+@lru_cache(maxsize=1)
+def get_extinction_coefficients() -> np.ndarray | None:
+    """
+    Get the extinction per unit E(B-V) at each wavelength, by calibrating
+    against get_extinction_correction at reference positions.
+
+    :return: Array of coefficients in the order of all_wavelengths,
+        or None if the extinction is not linear in E(B-V)
+    """
+    coefficients = []
+    for ra, dec in CALIBRATION_POSITIONS:
+        ebv = float(get_sfd_map().ebv(ra, dec))
+        ext = np.array([
+            get_extinction_correction(ra, dec, [wl])[0]
+            for wl in all_wavelengths.values()
+        ])
+        coefficients.append(ext / ebv)
+
+    if not np.allclose(coefficients[0], coefficients[1], rtol=1e-4):
+        logger.warning(
+            "Extinction is not linear in E(B-V), "
+            "falling back to per-source extinction corrections"
+        )
+        return None
+
+    return coefficients[0]
+
+
+class ExtinctionCache:
+    """
+    Persistent cache of SFD E(B-V) values, keyed by HEALPix pixel
+
+    The cache is a directory of parquet files. The values sampled in each
+    call are appended as a new file, and the files are merged into one once
+    there are more than MAX_CACHE_PARTS of them.
+    """
+
+    def __init__(self, cache_dir: Path = extinction_cache_dir, nside: int = EXTINCTION_NSIDE):
+        self.cache_dir = Path(cache_dir)
+        self.healpix = HEALPix(nside=nside, order="nested")
+        self._ebv: pd.Series | None = None
+
+    def _read_parts(self, paths: list[Path]) -> pd.Series:
+        """
+        Read cache files, skipping any which cannot be read
+
+        :param paths: Paths of the cache files
+        :return: Series of E(B-V), indexed by pixel
+        """
+        parts = []
+        for path in paths:
+            try:
+                parts.append(pd.read_parquet(path)["ebv"])
+            except Exception as e:
+                logger.warning(f"Failed to load extinction cache {path}: {e}")
+        if len(parts) == 0:
+            return pd.Series(dtype=float)
+        ebv = pd.concat(parts)
+        return ebv[~ebv.index.duplicated(keep="first")]
+
+    def _load(self) -> pd.Series:
+        """
+        Load the cache from disk, if it has not been loaded yet
+
+        :return: Series of E(B-V), indexed by pixel
+        """
+        if self._ebv is None:
+            self._ebv = self._read_parts(sorted(self.cache_dir.glob("*.parquet")))
+        return self._ebv
+
+    def _write_part(self, ebv: pd.Series, prefix: str = "part"):
+        """
+        Write values to a new cache file, atomically
+
+        :param ebv: Series of E(B-V), indexed by pixel
+        :param prefix: Prefix of the file name
+        :return: None
+        """
+        path = self.cache_dir / f"{prefix}_{time.time_ns()}_{os.getpid()}.parquet"
+        tmp_path = path.with_suffix(".tmp")
+        ebv.rename("ebv").to_frame().to_parquet(tmp_path)
+        tmp_path.replace(path)
+
+    def _append(self, new: pd.Series):
+        """
+        Append new values to the cache on disk, merging the cache files if
+        there are too many
+
+        :param new: Series of E(B-V), indexed by pixel
+        :return: None
+        """
+        self._write_part(new)
+
+        paths = sorted(self.cache_dir.glob("part_*.parquet"))
+        if len(paths) <= MAX_CACHE_PARTS:
+            return
+
+        # Merge the files on disk rather than the values in memory, which
+        # lack any written by other processes since they were loaded
+        old_merged = sorted(self.cache_dir.glob("merged_*.parquet"))
+        self._write_part(self._read_parts(old_merged + paths), prefix="merged")
+        for path in old_merged + paths:
+            path.unlink(missing_ok=True)
+        logger.debug(f"Merged {len(paths)} extinction cache files in {self.cache_dir}")
+
+    def get_ebv(self, ra: np.ndarray, dec: np.ndarray) -> np.ndarray:
+        """
+        Get E(B-V) for arrays of coordinates, sampling the SFD map at the
+        source positions only for pixels which are not yet in the cache
+
+        :param ra: Right ascension [deg]
+        :param dec: Declination [deg]
+        :return: Array of E(B-V)
+        """
+        cache = self._load()
+
+        ra = np.asarray(ra, dtype=float)
+        dec = np.asarray(dec, dtype=float)
+        pixels = self.healpix.lonlat_to_healpix(ra * u.deg, dec * u.deg)
+        ebv = cache.reindex(pixels).to_numpy(dtype=float)
+
+        missing = np.isnan(ebv)
+        if missing.any():
+            # Sample each new pixel once, at the first source position in it
+            new_pixels, first = np.unique(pixels[missing], return_index=True)
+            new = pd.Series(
+                np.asarray(
+                    get_sfd_map().ebv(ra[missing][first], dec[missing][first]),
+                    dtype=float,
+                ),
+                index=new_pixels,
+            )
+            logger.debug(f"Sampled SFD map for {len(new)} new HEALPix pixels")
+
+            self._ebv = pd.concat([cache, new])
+            self._append(new)
+
+            ebv[missing] = new.reindex(pixels[missing]).to_numpy()
+
+        return ebv
+
+
+extinction_cache = ExtinctionCache()
+
+
+def get_extinction_array(ra: np.ndarray, dec: np.ndarray) -> np.ndarray | None:
+    """
+    Get extinction corrections for arrays of coordinates at all wavelengths
+
+    :param ra: Right ascension [deg]
+    :param dec: Declination [deg]
+    :return: Array of shape (N, W) in the order of all_wavelengths,
+        or None if the batched calculation is not possible
+    """
+    coefficients = get_extinction_coefficients()
+    if coefficients is None:
+        return None
+
+    ebv = extinction_cache.get_ebv(ra, dec)
+    return ebv[:, np.newaxis] * coefficients[np.newaxis, :]
+
+
 def append_extinction_to_df(
     df: pd.DataFrame
 ) -> pd.DataFrame:
     """
     Append extinction corrections to a DataFrame.
 
+    E(B-V) is sampled once per source position from a HEALPix-pixel cache of
+    the SFD map, and broadcast across all wavelengths.
+
     :param df: DataFrame with 'ra' and 'dec' columns.
     :return: DataFrame with additional columns for extinction corrections.
     """
     if "ra" not in df.columns or "dec" not in df.columns:
         raise ValueError("DataFrame must contain 'ra' and 'dec' columns.")
 
-    ext_dicts = df.apply(get_extinction_dict, axis=1)
-    ext_df = pd.DataFrame(list(ext_dicts))
-    ext_df.set_index("ztf_name", inplace=True)
-    return df.join(ext_df, on="ztf_name", how="left")
\ No newline at end of file
+    if len(df) == 0:
+        return df.assign(**{key: pd.Series(dtype=float) for key in ext_keys})
+
+    ext = get_extinction_array(df["ra"].to_numpy(), df["dec"].to_numpy())
+
+    if ext is None:
+        ext_dicts = df.apply(get_extinction_dict, axis=1)
+        ext_df = pd.DataFrame(list(ext_dicts))
+        ext_df.set_index("ztf_name", inplace=True)
+        return df.join(ext_df, on="ztf_name", how="left")
+
+    df = df.copy()
+    df[ext_keys] = ext
+    return df
@@ -0,0 +1,370 @@
+"""
+Incremental store of combined source features.
+
+Each stage of a selection calls combine_all_sources on nearly the same table
+of sources. The feature store keeps the combined table keyed by ztf_name, and
+only recombines sources which are new, whose input row has changed, or whose
+on-disk data has changed. On-disk changes are found from the modification
+times of the per-source files under the tdescore data directory, as listed
+when their directory last changed, so any writer creating or replacing those
+files makes the store recombine the source. Sources are also invalidated
+explicitly after the pipeline writes their data (e.g. after a download or a
+lightcurve fit), which covers files rewritten in place.
+"""
+
+import logging
+import os
+import re
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from tdescore.combine.parse import combine_all_sources
+from tdescore.lightcurve.thermal import THERMAL_WINDOWS
+from tdescore.paths import data_dir
+
+logger = logging.getLogger(__name__)
+
+# Columns written by scantde itself, which are passed through by
+# combine_all_sources but do not change the combined features
+PASSTHROUGH_COLUMNS = frozenset([
+    "tdescore", "tdescore_best", "tdescore_lc", "tdescore_lc_score",
+    "tdescore_high_noise", "tdescore_host", "tdescore_infant", "tdescore_week",
+    "tdescore_full", "age_estimate", "thermal_window", "n_predets",
+    "host_r", "host_Mr", "dist_mpc", "best_redshift", "is_dwarf", "is_junk",
+] + [
+    f"tdescore_thermal_{x:.0f}" if x is not None else "tdescore_thermal_all"
+    for x in THERMAL_WINDOWS
+])
+
+# Files named after a source, e.g. ZTF18abcdefg.json or ZTF18abcdefg_gp.png
+SOURCE_FILE_PATTERN = re.compile(r"ZTF\d{2}[a-z]{7}")
+
+
+def hash_rows(df: pd.DataFrame) -> pd.Series:
+    """
+    Hash each row of a DataFrame, ignoring the index
+
+    :param df: DataFrame to hash
+    :return: Series of uint64 hashes, with the same index as df
+    """
+    hashes = np.zeros(len(df), dtype=np.uint64)
+    for col in df.columns:
+        try:
+            col_hash = pd.util.hash_pandas_object(df[col], index=False)
+        except TypeError:
+            # Unhashable entries, e.g. lists
+            col_hash = pd.util.hash_pandas_object(df[col].astype(str), index=False)
+        hashes = hashes * np.uint64(31) + col_hash.to_numpy(dtype=np.uint64)
+    return pd.Series(hashes, index=df.index)
+
+
+def concat_tables(tables: list[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenate tables whose columns can differ, keeping the dtype of each
+    column rather than the object dtype pd.concat falls back to when a column
+    is missing from some tables. Where values are missing, boolean columns
+    become nullable booleans and integer columns become floats.
+
+    :param tables: Tables to concatenate
+    :return: Concatenated table
+    """
+    tables = [x for x in tables if len(x.columns) > 0]
+    if len(tables) == 0:
+        return pd.DataFrame()
+
+    dtypes = {}
+    for table in tables:
+        for col, dtype in table.dtypes.items():
+            if col not in dtypes:
+                dtypes[col] = dtype
+            elif dtypes[col] != dtype:
+                try:
+                    dtypes[col] = np.result_type(dtypes[col], dtype)
+                except TypeError:
+                    dtypes[col] = np.dtype(object)
+
+    columns = pd.Index(list(dtypes))
+    full_df = pd.concat([x.reindex(columns=columns) for x in tables])
+
+    for col, dtype in dtypes.items():
+        if full_df[col].dtype == dtype:
+            continue
+        if full_df[col].isna().any():
+            if pd.api.types.is_bool_dtype(dtype):
+                dtype = "boolean"
+            elif pd.api.types.is_integer_dtype(dtype):
+                dtype = np.float64
+        try:
+            full_df[col] = full_df[col].astype(dtype)
+        except (TypeError, ValueError):
+            continue
+    return full_df
+
+
+class SourceFileIndex:
+    """
+    Index of the per-source files under a data directory, by source name
+
+    The whole tree is only walked on the first update after a clear, to find
+    the directories which hold per-source files. After that, only those
+    directories are checked, and each is listed again only when its
+    modification time changes, i.e. when files are created, renamed or
+    deleted in it. File modification times are read when their directory is
+    listed, so files rewritten in place are only seen when read fresh (see
+    get_mtimes), or when their sources are invalidated explicitly.
+    """
+
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        self._dirs: dict[str, tuple[int, dict[str, dict[str, int]]]] | None = None
+        self._index: dict[str, dict[str, int]] | None = None
+
+    @staticmethod
+    def _scan_dir(dir_path: str) -> tuple[list[str], dict[str, dict[str, int]]]:
+        """
+        List the subdirectories and per-source files of a directory
+
+        :param dir_path: Directory path
+        :return: Subdirectories, and modification times of file paths by source name
+        """
+        sub_dirs, files = [], {}
+        with os.scandir(dir_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    sub_dirs.append(entry.path)
+                    continue
+                match = SOURCE_FILE_PATTERN.match(entry.name)
+                if match is None:
+                    continue
+                try:
+                    mtime = entry.stat().st_mtime_ns
+                except FileNotFoundError:
+                    continue
+                files.setdefault(match.group(0), {})[entry.path] = mtime
+        return sub_dirs, files
+
+    def _walk(self):
+        """
+        Walk the whole tree, keeping only the directories with per-source files
+
+        :return: None
+        """
+        dirs = {}
+        stack = [str(self.root)]
+        while len(stack) > 0:
+            dir_path = stack.pop()
+            try:
+                mtime = os.stat(dir_path).st_mtime_ns
+                sub_dirs, files = self._scan_dir(dir_path)
+            except FileNotFoundError:
+                continue
+            if len(files) > 0:
+                dirs[dir_path] = (mtime, files)
+            stack.extend(sub_dirs)
+        logger.debug(f"Found {len(dirs)} directories with per-source files in {self.root}")
+        self._dirs = dirs
+        self._index = None
+
+    def clear(self):
+        """
+        Forget the indexed directories, so the whole tree is walked again on
+        the next update, e.g. to find directories created since
+
+        :return: None
+        """
+        self._dirs = None
+        self._index = None
+
+    def update(self) -> dict[str, dict[str, int]]:
+        """
+        Update the index, relisting only directories which have changed
+
+        :return: Modification times of file paths by source name
+        """
+        if self._dirs is None:
+            self._walk()
+
+        for dir_path, (mtime, _) in list(self._dirs.items()):
+            try:
+                new_mtime = os.stat(dir_path).st_mtime_ns
+                if new_mtime != mtime:
+                    _, files = self._scan_dir(dir_path)
+                    self._dirs[dir_path] = (new_mtime, files)
+                    self._index = None
+            except FileNotFoundError:
+                del self._dirs[dir_path]
+                self._index = None
+
+        if self._index is None:
+            index = {}
+            for _, files in self._dirs.values():
+                for name, paths in files.items():
+                    index.setdefault(name, {}).update(paths)
+            self._index = index
+        return self._index
+
+    def get_mtimes(self, names: np.ndarray, fresh: bool = False) -> pd.Series:
+        """
+        Get the latest modification time of the files of each source
+
+        :param names: Source names
+        :param fresh: Read the modification times from disk, e.g. just after
+            the files were written, rather than from when their directory
+            was last listed
+        :return: Series of modification times [ns], 0 if a source has no files
+        """
+        index = self.update()
+        mtimes = []
+        for name in names:
+            files = index.get(name, {})
+            if not fresh:
+                mtimes.append(max(files.values(), default=0))
+                continue
+            latest = 0
+            for path in files:
+                try:
+                    latest = max(latest, os.stat(path).st_mtime_ns)
+                except FileNotFoundError:
+                    continue
+            mtimes.append(latest)
+        return pd.Series(np.array(mtimes, dtype=np.uint64), index=names)
+
+
+class FeatureStore:
+    """
+    Cache of combine_all_sources output, keyed by ztf_name
+    """
+
+    def __init__(self, source_files: SourceFileIndex | None = None):
+        self.source_files = source_files
+        self._table = pd.DataFrame()
+        self._fingerprints = pd.Series(dtype=np.uint64)
+        self.n_combined = 0
+        self.n_reused = 0
+        if self.source_files is not None:
+            self.source_files.clear()
+
+    def _fingerprint(self, df: pd.DataFrame) -> pd.Series:
+        """
+        Fingerprint each source from the columns which feed combine_all_sources,
+        and the modification times of its files on disk
+
+        :param df: Table of sources
+        :return: Series of fingerprints, indexed by ztf_name
+        """
+        cols = sorted(x for x in df.columns if x not in PASSTHROUGH_COLUMNS)
+        hashes = hash_rows(df[cols])
+        hashes.index = df["ztf_name"].to_numpy()
+        if self.source_files is not None:
+            mtimes = self.source_files.get_mtimes(hashes.index.to_numpy())
+            hashes = hashes * np.uint64(31) + mtimes
+        return hashes
+
+    def combine(
+        self,
+        df: pd.DataFrame,
+        columns: list[str] | None = None,
+    ) -> pd.DataFrame:
+        """
+        Get the combined features for a table of sources, recombining only
+        sources which are new or have changed since the last call
+
+        :param df: Table of sources
+        :param columns: Columns to return, or None for all columns
+        :return: Combined table, with the same index as df
+        """
+        if df.empty or df["ztf_name"].duplicated().any():
+            full_df = combine_all_sources(df.copy(), save=False)
+            return full_df if columns is None else full_df[columns]
+
+        fingerprints = self._fingerprint(df)
+        # Unknown sources get a fingerprint of 0, so they are always stale
+        known = self._fingerprints.reindex(fingerprints.index, fill_value=np.uint64(0))
+        stale = (known != fingerprints).to_numpy()
+
+        if stale.any():
+            combined = combine_all_sources(df[stale].copy(), save=False)
+            combined.index = combined["ztf_name"].to_numpy()
+            combined = combined.loc[:, ~combined.columns.duplicated()]
+
+            keep = ~self._table.index.isin(combined.index)
+            self._table = concat_tables([self._table[keep], combined])
+            self._fingerprints = pd.concat([
+                self._fingerprints[~self._fingerprints.index.isin(combined.index)],
+                fingerprints[stale],
+            ])
+
+        n_stale = int(stale.sum())
+        self.n_combined += n_stale
+        self.n_reused += len(df) - n_stale
+        logger.debug(
+            f"Feature store: combined {n_stale} sources, "
+            f"reused {len(df) - n_stale} sources"
+        )
+
+        full_df = self._table.reindex(index=df["ztf_name"].to_numpy(), columns=columns)
+        full_df.index = df.index
+
+        # Scantde columns can change without a recombination, so take them
+        # from the current table
+        for col in df.columns:
+            if (col in PASSTHROUGH_COLUMNS) and ((columns is None) or (col in columns)):
+                full_df[col] = df[col]
+
+        return full_df
+
+    def invalidate(self, names: list[str] | pd.Series | None = None):
+        """
+        Mark sources as changed, e.g. after new data has been downloaded for
+        them, so they are recombined on the next call
+
+        :param names: Names of the sources to invalidate, or None for all
+        :return: None
+        """
+        if names is None:
+            self._fingerprints = pd.Series(dtype=np.uint64)
+        else:
+            mask = self._fingerprints.index.isin(list(names))
+            self._fingerprints = self._fingerprints[~mask]
+
+    def clear(self):
+        """
+        Remove all cached features
+
+        :return: None
+        """
+        self._table = pd.DataFrame()
+        self._fingerprints = pd.Series(dtype=np.uint64)
+        self.n_combined = 0
+        self.n_reused = 0
+        if self.source_files is not None:
+            self.source_files.clear()
+
+
+source_files = SourceFileIndex(data_dir)
+feature_store = FeatureStore(source_files=source_files)
+
+
+def combine_sources(
+    df: pd.DataFrame,
+    columns: list[str] | None = None,
+) -> pd.DataFrame:
+    """
+    Get the combined features for a table of sources, via the feature store
+
+    :param df: Table of sources
+    :param columns: Columns to return, or None for all columns
+    :return: Combined table, with the same index as df
+    """
+    return feature_store.combine(df, columns=columns)
+
+
+def invalidate_sources(names: list[str] | pd.Series | None = None):
+    """
+    Mark sources in the feature store as changed
+
+    :param names: Names of the sources to invalidate, or None for all
+    :return: None
+    """
+    feature_store.invalidate(names)
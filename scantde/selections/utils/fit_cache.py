@@ -0,0 +1,265 @@
+"""
+Cache of the lightcurve fits (GP and SNcosmo) run for each source.
+
+A fit is keyed by the source, the fit window, a hash of the detections up to
+the t_max_jd of the night, and the model version. The fit outputs of
+tdescore are stored per source, so if a source has the same key as its last
+fit, those outputs are still valid and the fit is skipped. The plots made by
+the last fit are linked into the output directory of the current night.
+
+A fit is only recorded for the sources whose per-source outputs tdescore
+wrote during the fit, so sources which failed or timed out are fit again.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import time
+from importlib.metadata import version, PackageNotFoundError
+from pathlib import Path
+from typing import Callable
+
+import pandas as pd
+from pydantic import BaseModel, Field
+from tdescore.alerts import load_source_raw
+
+from scantde.paths import lightcurve_fit_cache_path
+from scantde.selections.utils.download import get_t_max_jd
+from scantde.selections.utils.features import source_files
+
+logger = logging.getLogger(__name__)
+
+FIT_VERSION = "1"  # Increment to refit all sources
+
+# Columns of the detections which are used in the fits
+DETECTION_COLUMNS = ["jd", "fid", "magpsf", "sigmapsf", "isdiffpos"]
+
+# Margin for coarse file modification times, when checking fit outputs [ns]
+MTIME_MARGIN_NS = 2 * 10 ** 9
+
+
+def get_model_version() -> str:
+    """
+    Get the version of the fitting models, which invalidates the cache
+    whenever tdescore or FIT_VERSION changes
+
+    :return: Version string
+    """
+    try:
+        tdescore_version = version("tdescore")
+    except PackageNotFoundError:
+        tdescore_version = "unknown"
+    return f"{tdescore_version}-{FIT_VERSION}"
+
+
+def hash_detections(source_name: str, t_max_jd: float) -> str | None:
+    """
+    Hash the detections of a source up to a given time
+
+    :param source_name: Name of the source
+    :param t_max_jd: Latest JD of the detections
+    :return: Hex hash, or None if the lightcurve cannot be loaded
+    """
+    try:
+        raw_df = load_source_raw(source_name)
+    except (FileNotFoundError, KeyError, ValueError) as e:
+        logger.debug(f"Cannot hash detections of {source_name}: {e}")
+        return None
+
+    raw_df = raw_df[raw_df["jd"] <= t_max_jd]
+    columns = [x for x in DETECTION_COLUMNS if x in raw_df.columns]
+    raw_df = raw_df[columns].sort_values(by="jd").astype(str)
+
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(raw_df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()[:24]
+
+
+def get_fit_key(detection_hash: str, window: float | None, model_version: str) -> str:
+    """
+    Get the cache key of a fit
+
+    :param detection_hash: Hash of the detections of the source
+    :param window: Fit window [days], or None for the full lightcurve
+    :param model_version: Version of the fitting models
+    :return: Hex key
+    """
+    digest = hashlib.sha256()
+    digest.update(f"{detection_hash}|{window}|{model_version}".encode())
+    return digest.hexdigest()[:24]
+
+
+class FitEntry(BaseModel):
+    """
+    A pydantic model for the last fit of a source
+    """
+    key: str = Field(description="Cache key of the fit")
+    datestr: str = Field(description="Night the fit was run for (YYYYMMDD)")
+
+
+class FitCache(BaseModel):
+    """
+    A pydantic model for the last fit of each kind for each source
+    """
+    fits: dict[str, dict[str, FitEntry]] = Field(
+        default_factory=dict,
+        description="Last fit of each source, by fit name (e.g. 'gp_None')",
+    )
+
+    @classmethod
+    def load(cls) -> "FitCache":
+        """
+        Load the cache from file, or an empty cache if there is none
+
+        :return: Fit cache
+        """
+        if lightcurve_fit_cache_path.exists():
+            try:
+                return cls.model_validate_json(lightcurve_fit_cache_path.read_text())
+            except ValueError as e:
+                logger.warning(f"Ignoring unreadable lightcurve fit cache: {e}")
+        return cls()
+
+    def save(self):
+        """
+        Save the cache, merged with any fits written to file since it was
+        loaded, replacing it atomically
+
+        :return: None
+        """
+        merged = self.load()
+        for name, entries in self.fits.items():
+            merged.fits.setdefault(name, {}).update(entries)
+        tmp_path = lightcurve_fit_cache_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(merged.model_dump_json())
+        tmp_path.replace(lightcurve_fit_cache_path)
+
+
+def link_fit_images(
+    names_by_night: dict[str, set[str]], night_dir: Path, image_dir: str,
+) -> int:
+    """
+    Link the fit plots of sources from the nights they were last fit for
+    into the output directory of the current night
+
+    :param names_by_night: Names of the sources, by the night of their last fit
+    :param night_dir: Output directory of the current night
+    :param image_dir: Directory of the fit plots, relative to the output
+        directory of a night (e.g. 'gp/None')
+    :return: Number of plots linked
+    """
+    n_linked = 0
+    for datestr, names in names_by_night.items():
+        old_dir = night_dir.parent / datestr
+        if old_dir == night_dir:
+            continue
+        for dir_path, _, file_names in os.walk(old_dir / image_dir):
+            for file_name in file_names:
+                if Path(file_name).stem not in names:
+                    continue
+                old_path = Path(dir_path) / file_name
+                new_path = night_dir / old_path.relative_to(old_dir)
+                if new_path.exists():
+                    continue
+                new_path.parent.mkdir(parents=True, exist_ok=True)
+                try:
+                    os.link(old_path, new_path)
+                except OSError:
+                    shutil.copyfile(old_path, new_path)
+                n_linked += 1
+    return n_linked
+
+
+def get_detection_hashes(names: pd.Series, datestr: str) -> dict[str, str | None]:
+    """
+    Hash the detections of sources up to the t_max_jd of a night
+
+    :param names: Names of the sources
+    :param datestr: Night (YYYYMMDD)
+    :return: Hash of each source
+    """
+    t_max_jd = get_t_max_jd(datestr)
+    return {name: hash_detections(name, t_max_jd) for name in set(names)}
+
+
+def run_cached_fit(
+    names: pd.Series,
+    fit_name: str,
+    window: float | None,
+    base_output_dir: Path,
+    fit: Callable[[pd.Series], object],
+    detection_hashes: dict[str, str | None] | None = None,
+    image_dir: str | None = None,
+) -> pd.Series:
+    """
+    Run a fit only for the sources whose detections or models have changed
+    since their last fit, and reuse the last fit for the others
+
+    :param names: Names of the sources
+    :param fit_name: Name of the fit (e.g. 'gp' or 'sncosmo')
+    :param window: Fit window [days], or None for the full lightcurve
+    :param base_output_dir: Output directory of the night
+    :param fit: Function running the fit for a series of source names
+    :param detection_hashes: Precomputed hashes of the detections, or None
+    :param image_dir: Directory of the fit plots, relative to the output
+        directory of a night, or None if the fit makes no plots
+    :return: Names of the sources which were fit
+    """
+    datestr = base_output_dir.name
+    cache_name = f"{fit_name}_{window}"
+
+    if detection_hashes is None:
+        detection_hashes = get_detection_hashes(names, datestr)
+
+    model_version = get_model_version()
+    cache = FitCache.load()
+
+    keys = {}
+    reused_by_night = {}
+
+    for name in names:
+        detection_hash = detection_hashes.get(name)
+        if detection_hash is None:
+            continue
+        key = get_fit_key(detection_hash, window, model_version)
+        entry = cache.fits.get(name, {}).get(cache_name)
+        if (entry is not None) and (entry.key == key):
+            reused_by_night.setdefault(entry.datestr, set()).add(name)
+        else:
+            keys[name] = key
+
+    n_reused = sum(len(x) for x in reused_by_night.values())
+    pending = names[~names.isin([x for y in reused_by_night.values() for x in y])]
+
+    logger.info(
+        f"Running {fit_name} fits for window {window} on {len(pending)} sources, "
+        f"reusing fits for {n_reused} sources without new detections"
+    )
+
+    if len(pending) > 0:
+        t_start = time.time_ns() - MTIME_MARGIN_NS
+        fit(pending)
+
+        # Only record the sources whose outputs were written by this fit
+        mtimes = source_files.get_mtimes(
+            pd.Series(list(keys), dtype=object).to_numpy(), fresh=True
+        )
+        written = set(mtimes.index[mtimes >= t_start])
+        if len(written) < len(keys):
+            logger.warning(
+                f"No {fit_name} outputs were written for window {window} for "
+                f"{len(keys) - len(written)} sources, which will be fit again"
+            )
+
+        new = FitCache()
+        for name, key in keys.items():
+            if name in written:
+                new.fits[name] = {cache_name: FitEntry(key=key, datestr=datestr)}
+        new.save()
+
+    if (n_reused > 0) and (image_dir is not None):
+        n_linked = link_fit_images(reused_by_night, base_output_dir, image_dir)
+        logger.debug(f"Linked {n_linked} {fit_name} plots from previous nights")
+
+    return pending
@@ -0,0 +1,113 @@
+"""
+Per-night pool of candidates, shared between selections.
+
+The pool records which sources have already had each shared stage
+(crossmatch downloads, alert/SkyPortal/extinction inputs, lightcurve analysis)
+run for a night, so each selection only has to process the remainder.
+"""
+
+import logging
+from typing import Callable
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+CROSSMATCH_FAST = "crossmatch_fast"
+CROSSMATCH_WISE = "crossmatch_wise"
+ALERTS = "alerts"  # Alert download attempted
+HAS_ALERTS = "has_alerts"  # Alert download succeeded
+INPUTS = "inputs"
+LIGHTCURVE = "lightcurve"
+
+POOL_STAGES = [
+    CROSSMATCH_FAST, CROSSMATCH_WISE, ALERTS, HAS_ALERTS, INPUTS, LIGHTCURVE
+]
+
+
+class CandidatePool:
+    """
+    Record of the shared work done for each source on a given night
+    """
+
+    def __init__(self, datestr: str):
+        self.datestr = datestr
+        self.done: dict[str, set[str]] = {stage: set() for stage in POOL_STAGES}
+        # Columns added to the source table by the shared input downloads
+        self.inputs = pd.DataFrame()
+
+    def __len__(self):
+        return len(self.done[CROSSMATCH_FAST])
+
+    def is_done(self, stage: str, df: pd.DataFrame) -> pd.Series:
+        """
+        Get a mask of sources which have already completed a stage
+
+        :param stage: Name of the stage
+        :param df: Table of sources, with a 'ztf_name' column
+        :return: Boolean mask, with the same index as df
+        """
+        return df["ztf_name"].isin(self.done[stage])
+
+    def mark(self, stage: str, names: list[str] | pd.Series):
+        """
+        Record that a stage has been completed for some sources
+
+        :param stage: Name of the stage
+        :param names: Names of the sources
+        :return: None
+        """
+        self.done[stage].update(names)
+
+    def add_inputs(self, df: pd.DataFrame, columns: list[str]):
+        """
+        Store the shared input columns for some sources
+
+        :param df: Table of sources, with a 'ztf_name' column
+        :param columns: Columns to store
+        :return: None
+        """
+        new = df.drop_duplicates(subset="ztf_name").set_index("ztf_name")[columns]
+        if len(self.inputs) > 0:
+            new = pd.concat([self.inputs[~self.inputs.index.isin(new.index)], new])
+        self.inputs = new
+        self.mark(INPUTS, new.index)
+
+    def get_inputs(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Add the stored shared input columns to a table of sources.
+        Only columns which are not already present are added.
+
+        :param df: Table of sources, with a 'ztf_name' column
+        :return: Table with the shared input columns joined
+        """
+        columns = [x for x in self.inputs.columns if x not in df.columns]
+        return df.join(self.inputs[columns], on="ztf_name", how="left")
+
+
+def run_pending(
+    df: pd.DataFrame,
+    stage: str,
+    func: Callable[[pd.DataFrame], object],
+    pool: CandidatePool | None = None,
+) -> pd.DataFrame:
+    """
+    Run a stage only for the sources which have not yet completed it in the
+    pool, and record them as done
+
+    :param df: Table of sources
+    :param stage: Name of the stage
+    :param func: Function to run on the table of pending sources
+    :param pool: Candidate pool, or None to run on all sources
+    :return: Table of the sources the stage was run for
+    """
+    new = df if pool is None else df[~pool.is_done(stage, df)]
+
+    if len(new) > 0:
+        func(new.copy())
+        if pool is not None:
+            pool.mark(stage, new["ztf_name"])
+    else:
+        logger.info(f"All sources have already completed stage '{stage}'")
+
+    return new
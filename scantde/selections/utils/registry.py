@@ -0,0 +1,150 @@
+"""
+Process-level registry of the trained tdescore models, so each model file
+is loaded at most once per process rather than once per classifier call.
+"""
+
+import hashlib
+import logging
+import time
+from pathlib import Path
+
+import joblib
+import pandas as pd
+from pydantic import BaseModel, Field
+from xgboost import XGBClassifier
+
+from scantde.paths import ml_dir
+
+logger = logging.getLogger(__name__)
+
+TRAIN_DATA_NAME = "tdescore_train_data.pkl"
+
+
+class RegistryStats(BaseModel):
+    """
+    A pydantic model for the cache statistics of one registry entry
+    """
+    hits: int = Field(default=0, ge=0, description="Number of cache hits")
+    misses: int = Field(default=0, ge=0, description="Number of loads from disk")
+    load_time: float = Field(
+        default=0., ge=0., description="Total time spent loading from disk [s]"
+    )
+    hit_time: float = Field(
+        default=0., ge=0., description="Total time spent serving cache hits [s]"
+    )
+
+
+class ModelRegistry:
+    """
+    Cache of XGBoost classifiers and the tdescore training set.
+
+    Entries are keyed by file name, and reloaded if the modification time
+    of the underlying file changes.
+    """
+
+    def __init__(self, model_dir: Path = ml_dir):
+        self.model_dir = Path(model_dir)
+        self._cache: dict[str, tuple[int, object]] = {}
+        self._hashes: dict[str, tuple[int, str]] = {}
+        self.stats: dict[str, RegistryStats] = {}
+
+    def _get(self, file_name: str, loader) -> object:
+        """
+        Get an entry from the cache, loading it from disk if it is missing
+        or the file has been modified since it was loaded.
+
+        :param file_name: Name of the file in the model directory
+        :param loader: Function to load the file, given its path
+        :return: Loaded object
+        """
+        t_start = time.perf_counter()
+        path = self.model_dir.joinpath(file_name)
+        mtime = path.stat().st_mtime_ns
+
+        stats = self.stats.setdefault(file_name, RegistryStats())
+
+        cached = self._cache.get(file_name)
+        if (cached is not None) and (cached[0] == mtime):
+            stats.hits += 1
+            stats.hit_time += time.perf_counter() - t_start
+            return cached[1]
+
+        if cached is not None:
+            logger.info(f"{path} has been modified, reloading")
+
+        obj = loader(path)
+        self._cache[file_name] = (mtime, obj)
+        stats.misses += 1
+        stats.load_time += time.perf_counter() - t_start
+        logger.debug(f"Loaded {path} in {time.perf_counter() - t_start:.2f}s")
+        return obj
+
+    def get_classifier(self, classifier_name: str) -> XGBClassifier:
+        """
+        Get a trained classifier by name (e.g. 'infant_nohostinfo')
+
+        :param classifier_name: Name of the classifier
+        :return: XGBClassifier
+        """
+
+        def load(path: Path) -> XGBClassifier:
+            clf = XGBClassifier()
+            clf.load_model(str(path))
+            return clf
+
+        return self._get(f"{classifier_name}.json", load)
+
+    def get_train_data(self) -> pd.DataFrame:
+        """
+        Get the tdescore training data, which is only needed to explain
+        classifiers with SHAP
+
+        :return: DataFrame of training data
+        """
+        return self._get(TRAIN_DATA_NAME, joblib.load)
+
+    def get_file_hash(self, file_name: str) -> str:
+        """
+        Get the sha256 hash of a file in the model directory, which is only
+        recomputed if the file has been modified
+
+        :param file_name: Name of the file in the model directory
+        :return: Hex digest of the file contents
+        """
+        path = self.model_dir.joinpath(file_name)
+        mtime = path.stat().st_mtime_ns
+
+        cached = self._hashes.get(file_name)
+        if (cached is not None) and (cached[0] == mtime):
+            return cached[1]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+
+        self._hashes[file_name] = (mtime, digest.hexdigest())
+        return digest.hexdigest()
+
+    def clear(self):
+        """
+        Clear all cached models and statistics
+
+        :return: None
+        """
+        self._cache.clear()
+        self._hashes.clear()
+        self.stats.clear()
+
+    def get_stats(self) -> pd.DataFrame:
+        """
+        Get the cache statistics of the registry
+
+        :return: DataFrame with one row per model file
+        """
+        return pd.DataFrame(
+            [{"file": k, **v.model_dump()} for k, v in self.stats.items()]
+        )
+
+
+model_registry = ModelRegistry()
@@ -0,0 +1,144 @@
+"""
+Shared pre-processing of a night's candidates, run once before the selections.
+
+Every selection applies a subset of the same algorithmic cuts, and then
+downloads crossmatch data, alert histories, SkyPortal and extinction
+information, and runs the lightcurve analysis for the surviving sources.
+This stage does that work once for the union of sources which can survive
+the algorithmic cuts of any selection, and records it in a CandidatePool.
+"""
+
+import logging
+from pathlib import Path
+
+import pandas as pd
+
+from scantde.selections.utils.algorithmic_cuts import (
+    add_galactic_latitude,
+    bright_host_mask,
+    crossmatch_fast_mask,
+    galactic_latitude_mask,
+    neargaiabright_mask,
+    nuclear_mask,
+    sgscore_mask,
+    wise_agn_mask,
+)
+from scantde.selections.utils.apply_lightcurve import apply_lightcurve
+from scantde.selections.utils.apply_thermal import assign_thermal_windows, fit_thermal
+from scantde.selections.utils.crossmatch import (
+    download_crossmatch_all,
+    download_crossmatch_fast,
+)
+from scantde.selections.utils.deduplicate import deduplicate_sources
+from scantde.selections.utils.download import (
+    download_alerts,
+    download_inputs,
+    load_raw_lightcurves,
+)
+from scantde.selections.utils.features import combine_sources, invalidate_sources
+from scantde.selections.utils.fit_cache import get_detection_hashes
+from scantde.selections.utils.pool import (
+    CandidatePool,
+    CROSSMATCH_FAST,
+    CROSSMATCH_WISE,
+    LIGHTCURVE,
+    run_pending,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def select_pool_candidates(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Apply the algorithmic cuts shared by all selections, keeping sources which
+    are either nuclear or have multiple detections.
+    Nothing is logged or exported to the database.
+
+    :param df: Table of alerts
+    :return: Table of unique sources
+    """
+    df = df[sgscore_mask(df)]
+
+    nuclear = deduplicate_sources(df)
+    nuclear = nuclear[nuclear_mask(nuclear)]
+    multidet = deduplicate_sources(df[df["ndethist"] > 1])
+
+    df = deduplicate_sources(pd.concat([nuclear, multidet]))
+    df = df.sort_values(by=["is_tde", "ztf_name"], ascending=[False, False])
+    df = add_galactic_latitude(df.reset_index(drop=True))
+
+    df = df[galactic_latitude_mask(df)]
+    df = df[bright_host_mask(df)]
+    df = df[neargaiabright_mask(df)]
+    return df.reset_index(drop=True)
+
+
+def prepare_candidate_pool(
+    df: pd.DataFrame,
+    base_output_dir: Path,
+) -> CandidatePool:
+    """
+    Run the shared pre-processing for a night: crossmatch downloads, alert
+    downloads, SkyPortal/extinction information and the lightcurve analysis
+
+    :param df: Table of alerts for the night
+    :param base_output_dir: Nightly output directory
+    :return: Candidate pool recording the work done
+    """
+    datestr = base_output_dir.name
+    pool = CandidatePool(datestr)
+
+    if len(df) == 0:
+        return pool
+
+    df = select_pool_candidates(df)
+    logger.info(f"Preparing shared candidate pool of {len(df)} sources for {datestr}")
+
+    if len(df) == 0:
+        return pool
+
+    logger.info("Downloading fast crossmatch data for candidate pool")
+    new = run_pending(df, CROSSMATCH_FAST, download_crossmatch_fast, pool=pool)
+    invalidate_sources(new["ztf_name"])
+    df = df[crossmatch_fast_mask(combine_sources(df))]
+
+    if len(df) == 0:
+        return pool
+
+    logger.info("Downloading WISE data for candidate pool")
+    new = run_pending(
+        df, CROSSMATCH_WISE, download_crossmatch_all, pool=pool
+    )
+    invalidate_sources(new["ztf_name"])
+    full_df = combine_sources(df)
+    if "catwise_w1_m_w2" in full_df.columns:
+        df = df[~wise_agn_mask(full_df)]
+
+    df = df[download_alerts(df, datestr=datestr, pool=pool)]
+
+    if len(df) == 0:
+        return pool
+
+    df = download_inputs(df, datestr=datestr, pool=pool)
+    df = load_raw_lightcurves(df)
+    invalidate_sources(df["ztf_name"])
+
+    # Load and hash each raw lightcurve once, for both the plots and the fits
+    detection_hashes = get_detection_hashes(df["ztf_name"], datestr=datestr)
+
+    apply_lightcurve(
+        df, base_output_dir=base_output_dir, pool=pool,
+        detection_hashes=detection_hashes,
+    )
+
+    df = assign_thermal_windows(df.reset_index(drop=True))
+    fit_thermal(df, base_output_dir=base_output_dir, detection_hashes=detection_hashes)
+
+    pool.mark(LIGHTCURVE, df["ztf_name"])
+
+    logger.info(
+        f"Candidate pool for {datestr} has {len(df)} sources "
+        f"with lightcurve analysis"
+    )
+
+    return pool
@@ -1,12 +1,12 @@
 import pandas as pd
-from tdescore.combine.parse import combine_all_sources
+from scantde.selections.utils.features import combine_sources
 from tdescore.download.legacy_survey import default_catalog
 from astropy.cosmology import Planck18 as cosmo
 import numpy as np
 
 
 def tag_dwarf(df) -> pd.DataFrame:
-    full_df = combine_all_sources(df, save=False)
+    full_df = combine_sources(df)
 
     r_mag = full_df["rMeanKronMag"].astype(float)
 
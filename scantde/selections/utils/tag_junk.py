@@ -1,8 +1,11 @@
-from tdescore.combine.parse import combine_all_sources
+from scantde.selections.utils.features import combine_sources
 
 
 def tag_junk(df) -> list[bool]:
-    full_df = combine_all_sources(df, save=False)
+    full_df = combine_sources(
+        df,
+        columns=["age", "tdescore", "tdescore_best", "tdescore_high_noise", "thermal_score"]
+    )
 
     infant_class_mask = full_df["tdescore_best"].isin(["infant", "week", "month"])
     old_infant_mask = infant_class_mask & (full_df["age"] > 30.0)
@@ -25,6 +25,11 @@ def create_app():
 
     url_ext = os.getenv("SERVER_EXT")
 
+    from scantde.htmlutils.cache import nightly_cache
+    cache_size = os.getenv("SCANTDE_CACHE_SIZE")
+    if cache_size is not None:
+        nightly_cache.max_entries = int(cache_size)
+
     # if (password is None) or (secret_key is None):
     #
     #     @app.route('/login', methods=['GET', 'POST'])
@@ -59,5 +64,13 @@ def create_app():
     app.register_blueprint(name_bp, url_prefix=url_ext)
     from .by_date import date_bp
     app.register_blueprint(date_bp, url_prefix=url_ext)
+    from .by_position import position_bp
+    app.register_blueprint(position_bp, url_prefix=url_ext)
+    from .sources import sources_bp
+    app.register_blueprint(sources_bp, url_prefix=url_ext)
+    from .diagnostics import diagnostics_bp
+    app.register_blueprint(diagnostics_bp, url_prefix=url_ext)
+    from .explain import explain_bp
+    app.register_blueprint(explain_bp, url_prefix=url_ext)
 
     return app
\ No newline at end of file
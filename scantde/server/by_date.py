@@ -1,41 +1,60 @@
-from flask import Blueprint, request, render_template_string
-from scantde.htmlutils.generate import generate_html_by_date
+from itertools import chain
+
+from flask import Blueprint, request, render_template, Response
+from pydantic import ValidationError
+from scantde.htmlutils.header import HEADER_TEMPLATE
+from scantde.htmlutils.page_cache import page_cache, PageParams, get_etag
 from scantde.server.index import DEFAULT_HTML
+from scantde.server.templates import get_template
 # from scantde.server.login import login_required
 from scantde.errors import MissingCacheError
 
-from datetime import datetime
-
 date_bp = Blueprint('date', __name__)
 
 @date_bp.route('/search_by_date', methods=['GET'])
 # @login_required
-def search_by_date() -> str:
+def search_by_date() -> Response:
     """
     Search for candidates by date and generate HTML output.
 
+    Pages are served from the page cache, and the ETag of the page allows
+    browsers to revalidate with If-None-Match. New pages are streamed, with
+    each source sent as soon as it has been rendered. Pages can be split
+    with the 'offset' and 'page_size' parameters.
+
     :return: HTML output for the specified date.
     """
-    date = request.args.get('date', datetime.today().date().isoformat())
-    datestr = date.replace('-', '')
-    num_days = int(request.args.get('lookback_days', "1").strip())
-    min_score = float(request.args.get('min_score', 0.01).strip())
-    hide_junk = bool(request.args.get('hide_junk'))
-    hide_classified = bool(request.args.get('hide_classified', False))
-    mode = request.args.get('mode', 'all')
-    selection = request.args.get('selection', 'tdescore')
-    show_cutout = bool(request.args.get('show_cutout', False))
-    error = ""
-    html = DEFAULT_HTML
     try:
-        html = generate_html_by_date(
-            datestr, selection=selection, lookback_days=num_days,
-            min_score=min_score,
-            hide_junk=hide_junk,
-            hide_classified=hide_classified,
-            mode=mode, include_cutout=show_cutout
-        )
+        params = PageParams.from_args(request.args)
+    except (ValidationError, ValueError) as e:
+        return Response(f"Invalid query parameters: {e}", status=400, mimetype="text/plain")
+    date = f"{params.datestr[:4]}-{params.datestr[4:6]}-{params.datestr[6:]}"
+
+    etag = get_etag(params)
+    if etag in request.if_none_match:
+        page_cache.stats.not_modified += 1
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    context = dict(
+        today=date, lookback_days=params.lookback_days,
+        min_score=params.min_score, hide_junk=params.hide_junk,
+        hide_classified=params.hide_classified, mode=params.mode,
+        selection=params.selection, show_cutout=params.include_cutout,
+        page_size=params.page_size,
+    )
+
+    try:
+        source_line, body = page_cache.get_page(params, etag=etag)
     except MissingCacheError:
         error = f"No cached results found for {date}. Please try a different date."
+        return Response(render_template(get_template(DEFAULT_HTML), error=error, **context))
 
-    return render_template_string(html, today=date, lookback_days=num_days, min_score=min_score, hide_junk=hide_junk, hide_classified=hide_classified, error=error, mode=mode, selection=selection, show_cutout=show_cutout)
\ No newline at end of file
+    header = render_template(
+        get_template(HEADER_TEMPLATE), source_line=source_line, error="", **context
+    )
+    response = Response(chain([header], body), mimetype="text/html")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "no-cache"
+    return response
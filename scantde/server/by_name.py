@@ -1,13 +1,27 @@
-from flask import Blueprint, request, render_template_string
+from flask import Blueprint, request, render_template
 from scantde.database.search import query_by_name
 from scantde.htmlutils.generate import generate_html_by_name
 from scantde.server.index import DEFAULT_HTML
+from scantde.server.templates import get_template
 # from scantde.server.login import login_required
 
 from datetime import datetime
 
 name_bp = Blueprint('name', __name__)
 
+NAME_HTML = DEFAULT_HTML + '''
+    {{ extra_html|safe }}
+    {% if row is not none %}
+    <h2>Database Results for: {{ row['name'] }}</h2>
+      <table border="1">
+        <tr><th>Field</th><th>Value</th></tr>
+        {% for col in columns %}
+          <tr><td>{{ col }}</td><td>{{ row[col] }}</td></tr>
+        {% endfor %}
+      </table>
+    {% endif %}
+    '''
+
 @name_bp.route('/search_by_name', methods=['GET'])
 # @login_required
 def search_by_name():
@@ -27,19 +41,7 @@ def search_by_name():
             error = f"No result found for {name}"
     else:
         error = "Please enter a name."
-    html = DEFAULT_HTML + '''
-    {{ extra_html|safe }}
-    {% if row is not none %}
-    <h2>Database Results for: {{ row['name'] }}</h2>
-      <table border="1">
-        <tr><th>Field</th><th>Value</th></tr>
-        {% for col in columns %}
-          <tr><td>{{ col }}</td><td>{{ row[col] }}</td></tr>
-        {% endfor %}
-      </table>
-    {% endif %}
-    '''
-    return render_template_string(html, row=row, columns=columns, error=error, extra_html=extra_html, today=datetime.now().strftime('%Y-%m-%d'), name=name, selection=selection)
+    return render_template(get_template(NAME_HTML), row=row, columns=columns, error=error, extra_html=extra_html, today=datetime.now().strftime('%Y-%m-%d'), name=name, selection=selection)
 
 # if __name__ == '__main__':
 #     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,51 @@
+import json
+
+from flask import Blueprint, request, jsonify
+from scantde.database.search import search_by_position
+# from scantde.server.login import login_required
+
+position_bp = Blueprint('position', __name__)
+
+DEFAULT_RADIUS_DEG = 1. / 60.
+MAX_RADIUS_DEG = 30.
+
+
+@position_bp.route('/search_by_position', methods=['GET'])
+# @login_required
+def search_by_position_route():
+    """
+    Cone search of the source database, returned as JSON.
+
+    Query parameters: 'ra' and 'dec' of the centre [deg], 'radius' [deg]
+    and 'selection' (e.g. 'tdescore').
+
+    :return: JSON with the matching sources, sorted by separation [deg]
+    """
+    selection = request.args.get('selection', 'tdescore')
+    from scantde.selections.run import SELECTIONS
+    if selection not in SELECTIONS:
+        return jsonify(
+            error=f"Unknown selection '{selection}', expected one of {list(SELECTIONS)}."
+        ), 400
+
+    try:
+        ra = float(request.args['ra'])
+        dec = float(request.args['dec'])
+        radius = float(request.args.get('radius', DEFAULT_RADIUS_DEG))
+    except (KeyError, ValueError):
+        return jsonify(
+            error="Please provide numeric 'ra' and 'dec', and optionally 'radius', in degrees."
+        ), 400
+
+    if not ((0. <= ra < 360.) and (-90. <= dec <= 90.) and (0. < radius <= MAX_RADIUS_DEG)):
+        return jsonify(
+            error=f"Require 0 <= ra < 360, -90 <= dec <= 90 and 0 < radius <= {MAX_RADIUS_DEG}."
+        ), 400
+
+    df = search_by_position(ra, dec, radius, selection=selection)
+    sources = json.loads(df.to_json(orient="records", date_format="iso"))
+
+    return jsonify(
+        ra=ra, dec=dec, radius=radius, selection=selection,
+        n_matches=len(sources), sources=sources,
+    )
@@ -0,0 +1,20 @@
+from flask import Blueprint, jsonify
+from scantde.htmlutils.cache import nightly_cache
+from scantde.htmlutils.page_cache import page_cache
+# from scantde.server.login import login_required
+
+diagnostics_bp = Blueprint('diagnostics', __name__)
+
+
+@diagnostics_bp.route('/diagnostics', methods=['GET'])
+# @login_required
+def diagnostics():
+    """
+    Statistics of the in-memory caches of the server, as JSON.
+
+    :return: JSON with the size and hit rates of the nightly and page caches
+    """
+    return jsonify(
+        nightly_cache=nightly_cache.get_stats(),
+        page_cache=page_cache.get_stats(),
+    )
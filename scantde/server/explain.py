@@ -0,0 +1,44 @@
+import re
+
+from flask import Blueprint, request, Response
+from scantde.paths import base_html_dir
+# from scantde.server.login import login_required
+
+explain_bp = Blueprint('explain', __name__)
+
+# Allowed characters of the query parameters, which are used in file paths
+SAFE_PARAM = re.compile(r"[A-Za-z0-9_.]+")
+
+
+@explain_bp.route('/shap_plot', methods=['GET'])
+# @login_required
+def shap_plot():
+    """
+    SHAP waterfall plot of a single source, rendered from the saved SHAP
+    values for classifiers which were not run with waterfall plots.
+
+    Query parameters: 'datestr' (YYYYMMDD), 'selection' (e.g. 'tdescore'),
+    'classifier' (e.g. 'thermal_30.0') and 'name' of the source.
+
+    :return: PNG image
+    """
+    params = {
+        key: request.args.get(key, '').strip()
+        for key in ['datestr', 'selection', 'classifier', 'name']
+    }
+    if not all(SAFE_PARAM.fullmatch(x) and (".." not in x) for x in params.values()):
+        return "Please provide 'datestr', 'selection', 'classifier' and 'name'.", 400
+
+    # Imported here, so the server only loads SHAP when a plot is requested
+    from scantde.selections.utils.explain import render_waterfall_png
+
+    output_dir = (
+        base_html_dir / params['datestr'] / params['selection'] / "shap"
+        / params['classifier']
+    )
+    png = render_waterfall_png(output_dir, params['name'])
+
+    if png is None:
+        return f"No SHAP values found for {params['name']}", 404
+
+    return Response(png, mimetype="image/png")
@@ -1,6 +1,7 @@
 import pandas as pd
-from flask import Blueprint, render_template_string
+from flask import Blueprint, render_template
 from scantde.htmlutils.header import base_html_header
+from scantde.server.templates import get_template
 # from scantde.server.login import login_required
 
 from datetime import datetime
@@ -12,8 +13,8 @@ DEFAULT_HTML = base_html_header(pd.DataFrame())
 @index_bp.route('/', methods=['GET', 'POST'])
 # @login_required
 def index():
-    return render_template_string(
-        DEFAULT_HTML,
+    return render_template(
+        get_template(DEFAULT_HTML),
         today=datetime.now().strftime('%Y-%m-%d')
     )
 
@@ -0,0 +1,68 @@
+import json
+
+from flask import Blueprint, request, jsonify
+from pydantic import ValidationError
+from scantde.database.query import SourceQuery, query_sources, get_fail_steps
+# from scantde.server.login import login_required
+
+sources_bp = Blueprint('sources', __name__)
+
+
+@sources_bp.route('/sources', methods=['GET'])
+# @login_required
+def sources_route():
+    """
+    Filtered, paginated query of the source database, returned as JSON.
+
+    Query parameters: 'selection' (e.g. 'tdescore'), and any field of
+    SourceQuery, e.g. 'start_datestr', 'min_score', 'fail_step', 'page'.
+
+    :return: JSON with one page of matching sources, and the total number of matches
+    """
+    selection = request.args.get('selection', 'tdescore')
+    from scantde.selections.run import SELECTIONS
+    if selection not in SELECTIONS:
+        return jsonify(
+            error=f"Unknown selection '{selection}', expected one of {list(SELECTIONS)}."
+        ), 400
+
+    args = {
+        key: value for key, value in request.args.items()
+        if key in SourceQuery.model_fields
+    }
+
+    try:
+        query = SourceQuery(**args)
+        df, n_total = query_sources(query, selection=selection)
+    except ValidationError as e:
+        return jsonify(error=f"Invalid query: {e.errors(include_url=False)}"), 400
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    sources = json.loads(df.to_json(orient="records", date_format="iso"))
+
+    return jsonify(
+        selection=selection, query=query.model_dump(),
+        n_total=n_total, n_matches=len(sources), sources=sources,
+    )
+
+
+@sources_bp.route('/fail_steps', methods=['GET'])
+# @login_required
+def fail_steps_route():
+    """
+    Stages at which sources have been rejected, as JSON. These are the
+    values accepted by the 'fail_step' filter of the /sources route.
+
+    Query parameters: 'selection' (e.g. 'tdescore').
+
+    :return: JSON with the list of stage names
+    """
+    selection = request.args.get('selection', 'tdescore')
+    from scantde.selections.run import SELECTIONS
+    if selection not in SELECTIONS:
+        return jsonify(
+            error=f"Unknown selection '{selection}', expected one of {list(SELECTIONS)}."
+        ), 400
+
+    return jsonify(selection=selection, fail_steps=get_fail_steps(selection))
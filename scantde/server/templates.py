@@ -0,0 +1,31 @@
+"""
+Templates compiled once per app, rather than once per request as with
+render_template_string
+"""
+from functools import lru_cache
+
+from flask import current_app
+from jinja2 import Environment, Template
+
+
+@lru_cache(maxsize=None)
+def _compile_template(env: Environment, source: str) -> Template:
+    """
+    Compile a template in a Jinja environment
+
+    :param env: Jinja environment
+    :param source: Template source
+    :return: Compiled template
+    """
+    return env.from_string(source)
+
+
+def get_template(source: str) -> Template:
+    """
+    Get a compiled template for the current app, which can be passed to
+    render_template or stream_template
+
+    :param source: Template source
+    :return: Compiled template
+    """
+    return _compile_template(current_app.jinja_env, source)
@@ -1,17 +1,34 @@
-import pandas as pd
+"""
+Cutout images of sources from PS1 and the Legacy Survey.
 
-from scantde.paths import cutout_dir
-from ztfquery.utils import stamps
-import matplotlib.pyplot as plt
-import numpy as np
-from requests.exceptions import HTTPError
+Cutouts are fetched concurrently in threads over a single pooled session,
+with timeouts and retries, and written directly with PIL as small labelled
+WebP thumbnails, without going through matplotlib. Cutouts written as PNG by
+earlier versions are converted locally rather than downloaded again. Sources which
+already have both cutouts are skipped before any request is made. Cutouts
+which cannot exist (e.g. outside the PS1 footprint, or an invalid image) are
+recorded in a negative cache, and are not requested again until it expires.
+"""
+import functools
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pandas as pd
 import requests
+from PIL import Image, ImageDraw, ImageFont, UnidentifiedImageError
+from pydantic import BaseModel, Field
+from requests.exceptions import HTTPError, RequestException
 from tqdm import tqdm
+from urllib3.util import Retry
+from ztfquery.utils import stamps
 
-import io
-from PIL import Image, UnidentifiedImageError
-
-import logging
+from scantde.paths import cutout_dir, cutout_failure_cache_path
+from scantde.utils.skyportal.client import TimeoutHTTPAdapter
 
 logger = logging.getLogger(__name__)
 
@@ -22,15 +39,40 @@ ps1_dir.mkdir(parents=True, exist_ok=True)
 legacy_survey_dir = cutout_dir / "legacy_survey"
 legacy_survey_dir.mkdir(parents=True, exist_ok=True)
 
+CUTOUT_TYPES = ["ps1", "legacy_survey"]
+CUTOUT_TITLES = {"ps1": "PS1 (y/g/i)", "legacy_survey": "LegSurv"}
+
+CUTOUT_TIMEOUT = 30  # seconds
+DEFAULT_N_THREADS = int(os.getenv("CUTOUT_N_THREADS", 8))
+FAILURE_EXPIRY = timedelta(days=30)  # Time before a failed cutout is retried
+
+PS1_SIZE = 240  # pixels
+PS1_COLOR = ["y", "g", "i"]
+
+THUMBNAIL_SIZE = 240  # Maximum width and height of the image [pixels]
+LABEL_HEIGHT = 20  # Height of the label above the image [pixels]
+LABEL_FONT_SIZE = 14
+WEBP_QUALITY = 85
+CUTOUT_SUFFIX = ".webp"
+LEGACY_CUTOUT_SUFFIX = ".png"  # Suffix of cutouts written by earlier versions
+
+# Client errors which are transient, so are retried on the next run
+TRANSIENT_STATUS_CODES = {408, 429}  # Request timeout, too many requests
+
+_failure_lock = threading.Lock()
+
+
 def get_cutout_path(
     source_name: str,
     cutout_type: str = "ps1",
+    suffix: str = CUTOUT_SUFFIX,
 ):
     """
     Get the path for a cutout image of a source.
 
     :param source_name: Name of the source
     :param cutout_type: Type of cutout image, either "ps1" or "legacy_survey"
+    :param suffix: File suffix, '.webp' or the legacy '.png'
     :return: Path to the cutout image
     """
     if cutout_type == "ps1":
@@ -40,77 +82,357 @@ def get_cutout_path(
     else:
         logger.error(f"Unknown cutout type: {cutout_type}")
         raise ValueError(f"Unknown cutout type: {cutout_type}")
-    return sub_dir / f"{source_name}.png"
+    return sub_dir / f"{source_name}{suffix}"
 
 
+class CutoutFailure(BaseModel):
+    """
+    A pydantic model for a cutout which could not be made
+    """
+    time: datetime = Field(description="Time of the failure (UTC)")
+    error: str = Field(description="Error raised")
 
-def create_ps1_cutout(
-    source: pd.Series,
+
+class CutoutFailureCache(BaseModel):
+    """
+    A pydantic model for the negative cache of cutouts
+    """
+    failures: dict[str, dict[str, CutoutFailure]] = Field(
+        default_factory=lambda: {x: {} for x in CUTOUT_TYPES},
+        description="Failures of each cutout type, by source name",
+    )
+
+    @classmethod
+    def load(cls) -> "CutoutFailureCache":
+        """
+        Load the cache from file, dropping expired failures
+
+        :return: Negative cache
+        """
+        cache = cls()
+        if cutout_failure_cache_path.exists():
+            try:
+                cache = cls.model_validate_json(cutout_failure_cache_path.read_text())
+            except ValueError as e:
+                logger.warning(f"Ignoring unreadable cutout failure cache: {e}")
+
+        oldest = datetime.now(timezone.utc) - FAILURE_EXPIRY
+        for cutout_type in CUTOUT_TYPES:
+            failures = cache.failures.get(cutout_type, {})
+            cache.failures[cutout_type] = {
+                k: v for k, v in failures.items() if v.time > oldest
+            }
+        return cache
+
+    def save(self):
+        """
+        Save the cache to file, replacing it atomically
+
+        :return: None
+        """
+        tmp_path = cutout_failure_cache_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(self.model_dump_json())
+        tmp_path.replace(cutout_failure_cache_path)
+
+    def add(self, source_name: str, cutout_type: str, error: Exception):
+        """
+        Record a failed cutout
+
+        :param source_name: Name of the source
+        :param cutout_type: Type of cutout image
+        :param error: Error raised
+        :return: None
+        """
+        self.failures[cutout_type][source_name] = CutoutFailure(
+            time=datetime.now(timezone.utc), error=f"{type(error).__name__}: {error}",
+        )
+
+
+def get_cutout_session(pool_size: int = DEFAULT_N_THREADS) -> requests.Session:
+    """
+    Get a session for downloading cutouts, with timeouts, retries of
+    server errors, and a connection pool for each host
+
+    :param pool_size: Number of connections kept open per host
+    :return: Session
+    """
+    session = requests.Session()
+    retries = Retry(
+        total=3,
+        backoff_factor=1,
+        status_forcelist=[500, 502, 503, 504],
+        allowed_methods=["GET"],
+    )
+    adapter = TimeoutHTTPAdapter(
+        timeout=CUTOUT_TIMEOUT,
+        max_retries=retries,
+        pool_connections=len(CUTOUT_TYPES),
+        pool_maxsize=pool_size,
+    )
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def fetch_ps1_image(session: requests.Session, ra: float, dec: float) -> Image.Image:
+    """
+    Download a PS1 colour stamp, as in ztfquery.utils.stamps.get_ps_stamp
+
+    :param session: Session
+    :param ra: Right ascension [deg]
+    :param dec: Declination [deg]
+    :return: Image
+    """
+    response = session.get(stamps.build_panstarrs_link(ra, dec))
+    response.raise_for_status()
+    files = [x.split(" ")[-2] for x in response.content.decode("utf-8").splitlines()[1:]]
+
+    band_files = []
+    for band in PS1_COLOR:
+        matches = [x for x in files if f".{band}." in x]
+        if len(matches) == 0:
+            raise ValueError(f"No PS1 {band}-band stack image at ra={ra}, dec={dec}")
+        band_files.append(matches[0])
+    red, blue, green = band_files
+
+    url = (
+        f"{stamps.PANSTARRS_SOURCE}fitscut.cgi?red={red}&blue={blue}&green={green}"
+        f"&x={ra}&y={dec}&size={PS1_SIZE}&wcs=1&asinh=True&autoscale=99.750000"
+        f"&format=png&download=True"
+    )
+    response = session.get(url)
+    response.raise_for_status()
+    return Image.open(io.BytesIO(response.content))
+
+
+def fetch_ls_image(session: requests.Session, ra: float, dec: float) -> Image.Image:
+    """
+    Download a Legacy Survey cutout
+
+    :param session: Session
+    :param ra: Right ascension [deg]
+    :param dec: Declination [deg]
+    :return: Image
+    """
+    url = (f"https://www.legacysurvey.org/viewer/cutout.jpg"
+           f"?ra={ra}&dec={dec}&zoom=16")
+    response = session.get(url)
+    response.raise_for_status()
+    return Image.open(io.BytesIO(response.content))
+
+
+FETCHERS = {"ps1": fetch_ps1_image, "legacy_survey": fetch_ls_image}
+
+
+def is_permanent_failure(error: Exception) -> bool:
+    """
+    Check whether a cutout failure will recur, rather than being transient
+    (e.g. a timeout, rate limiting or a server error)
+
+    :param error: Error raised while fetching a cutout
+    :return: Whether to add the cutout to the negative cache
+    """
+    if isinstance(error, HTTPError):
+        if error.response is None:
+            return False
+        status_code = error.response.status_code
+        return (status_code < 500) and (status_code not in TRANSIENT_STATUS_CODES)
+    # No stamp in the footprint, or an invalid image
+    return isinstance(error, (ValueError, UnidentifiedImageError))
+
+
+def fetch_cutout(
+    session: requests.Session,
+    source_name: str,
+    cutout_type: str,
+    ra: float,
+    dec: float,
+) -> Image.Image:
+    """
+    Download a cutout image of a source
+
+    :param session: Session
+    :param source_name: Name of the source
+    :param cutout_type: Type of cutout image, either "ps1" or "legacy_survey"
+    :param ra: Right ascension [deg]
+    :param dec: Declination [deg]
+    :return: Image
+    """
+    img = FETCHERS[cutout_type](session, ra, dec)
+    img.load()
+    logger.debug(f"Downloaded {cutout_type} cutout for {source_name}")
+    return img
+
+
+@functools.lru_cache(maxsize=1)
+def get_label_font() -> ImageFont.ImageFont:
+    """
+    Get the font for cutout labels, scaled if the Pillow version allows
+
+    :return: Font
+    """
+    try:
+        return ImageFont.load_default(size=LABEL_FONT_SIZE)
+    except TypeError:
+        return ImageFont.load_default()
+
+
+def render_cutout(img: Image.Image, label: str | None = None) -> Image.Image:
+    """
+    Shrink a cutout image to a thumbnail, with an optional label drawn above it
+
+    :param img: Image
+    :param label: Label, or None for no label
+    :return: Thumbnail
+    """
+    img = img.convert("RGB")
+    img.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+
+    if label is None:
+        return img
+
+    thumbnail = Image.new("RGB", (img.width, img.height + LABEL_HEIGHT), "white")
+    thumbnail.paste(img, (0, LABEL_HEIGHT))
+    draw = ImageDraw.Draw(thumbnail)
+    draw.text(
+        (img.width // 2, LABEL_HEIGHT // 2), label,
+        fill="black", font=get_label_font(), anchor="mm",
+    )
+    return thumbnail
+
+
+def save_cutout(
+    img: Image.Image,
+    cutout_path: Path,
+    label: str | None = None,
 ):
     """
-    Create a PS1 cutout for a given source.
+    Write a cutout thumbnail, in the format given by the path suffix
+    (PNG or WebP). Safe to call from several threads at once.
 
-    :param source: Pandas Series containing source information, including 'name'
+    :param img: Image
+    :param cutout_path: Output path
+    :param label: Label, or None for no label
     :return: None
     """
+    thumbnail = render_cutout(img, label=label)
+    if cutout_path.suffix.lower() == ".webp":
+        thumbnail.save(cutout_path, quality=WEBP_QUALITY)
+    else:
+        thumbnail.save(cutout_path)
 
-    cutout_path = get_cutout_path(source["name"], cutout_type="ps1")
 
-    if cutout_path.exists():
-        logger.debug(f"Cutout already exists: {cutout_path}")
-        return
+def create_cutout_file(
+    session: requests.Session,
+    source_name: str,
+    cutout_type: str,
+    ra: float,
+    dec: float,
+):
+    """
+    Download a cutout of a source and write it with its label
+
+    :param session: Session
+    :param source_name: Name of the source
+    :param cutout_type: Type of cutout image, either "ps1" or "legacy_survey"
+    :param ra: Right ascension [deg]
+    :param dec: Declination [deg]
+    :return: None
+    """
+    cutout_path = get_cutout_path(source_name, cutout_type=cutout_type)
+    img = fetch_cutout(session, source_name, cutout_type, ra, dec)
+    try:
+        save_cutout(img, cutout_path, label=CUTOUT_TITLES[cutout_type])
+    except Exception:
+        cutout_path.unlink(missing_ok=True)
+        raise
 
-    ra, dec = source["ra"], source["dec"]
 
+def convert_legacy_cutout(source_name: str, cutout_type: str) -> bool:
+    """
+    Convert a cutout written as PNG by an earlier version to WebP, so it is
+    not downloaded again. The PNG is deleted once converted.
+
+    :param source_name: Name of the source
+    :param cutout_type: Type of cutout image, either "ps1" or "legacy_survey"
+    :return: Whether the cutout was converted
+    """
+    legacy_path = get_cutout_path(
+        source_name, cutout_type=cutout_type, suffix=LEGACY_CUTOUT_SUFFIX
+    )
+    cutout_path = get_cutout_path(source_name, cutout_type=cutout_type)
     try:
-        img = stamps.get_ps_stamp(ra, dec, size=240, color=["y", "g", "i"])
-        plt.figure(figsize=(2.1, 2.1), dpi=120)
-        plt.imshow(np.asarray(img))
-        plt.title("PS1 (y/g/i)", fontsize=12)
-        plt.axis('off')
-        plt.tight_layout()
-        plt.savefig(cutout_path, bbox_inches="tight")
-        plt.close()
-    except HTTPError:
-        logger.info(f"{source['name']}: HTTPConnection error in PS1 cutouts")
+        with Image.open(legacy_path) as img:
+            img.convert("RGB").save(cutout_path, quality=WEBP_QUALITY)
+    except FileNotFoundError:
+        return False
+    except (OSError, UnidentifiedImageError) as e:
+        logger.debug(f"Could not convert {legacy_path}: {e}")
+        cutout_path.unlink(missing_ok=True)
+        return False
+    legacy_path.unlink(missing_ok=True)
+    return True
 
 
-def create_ls_cutout(
+def create_single_cutout(
     source: pd.Series,
+    cutout_type: str,
+    session: requests.Session | None = None,
 ):
     """
-    Create a legacy survey cutout for a given source.
+    Create a cutout of a given type for a given source.
 
     :param source: Pandas Series containing source information, including 'name'
+    :param cutout_type: Type of cutout image, either "ps1" or "legacy_survey"
+    :param session: Session, or None to create one
     :return: None
     """
+    cutout_path = get_cutout_path(source["name"], cutout_type=cutout_type)
 
-    cutout_path = get_cutout_path(source["name"], cutout_type="legacy_survey")
-
-    if cutout_path.exists():
+    if cutout_path.exists() or convert_legacy_cutout(source["name"], cutout_type):
         logger.debug(f"Cutout already exists: {cutout_path}")
         return
 
-    ra, dec = source["ra"], source["dec"]
+    if session is None:
+        session = get_cutout_session(pool_size=1)
 
     try:
-        url = (f"https://www.legacysurvey.org/viewer/cutout.jpg"
-               f"?ra={ra}&dec={dec}&zoom=16")
-        r = requests.get(url)
-        plt.figure(figsize=(2.1, 2.1), dpi=120)
-        plt.imshow(Image.open(io.BytesIO(r.content)))
-        plt.title("LegSurv", fontsize=12)
-        plt.axis('off')
-        plt.tight_layout()
-        plt.savefig(cutout_path, bbox_inches="tight")
-        plt.close()
-    except HTTPError:
-        logger.info(f"{source['name']}: HTTPConnection error in LS cutouts")
-    except UnidentifiedImageError:
-        logger.warning(f"{source['name']}: UnidentifiedImageError in LS cutouts")
+        create_cutout_file(
+            session, source["name"], cutout_type, source["ra"], source["dec"]
+        )
+    except (RequestException, ValueError, UnidentifiedImageError) as e:
+        logger.info(f"{source['name']}: {type(e).__name__} in {cutout_type} cutouts")
         cutout_path.unlink(missing_ok=True)
 
 
+def create_ps1_cutout(
+    source: pd.Series,
+    session: requests.Session | None = None,
+):
+    """
+    Create a PS1 cutout for a given source.
+
+    :param source: Pandas Series containing source information, including 'name'
+    :param session: Session, or None to create one
+    :return: None
+    """
+    create_single_cutout(source, cutout_type="ps1", session=session)
+
+
+def create_ls_cutout(
+    source: pd.Series,
+    session: requests.Session | None = None,
+):
+    """
+    Create a legacy survey cutout for a given source.
+
+    :param source: Pandas Series containing source information, including 'name'
+    :param session: Session, or None to create one
+    :return: None
+    """
+    create_single_cutout(source, cutout_type="legacy_survey", session=session)
+
+
 def create_cutout(
     source: pd.Series,
 ):
@@ -120,19 +442,106 @@ def create_cutout(
     :param source: Source row
     :return: None
     """
-    create_ps1_cutout(source)
-    create_ls_cutout(source)
+    session = get_cutout_session(pool_size=1)
+    create_ps1_cutout(source, session=session)
+    create_ls_cutout(source, session=session)
+
+
+def get_missing_cutouts(
+    df: pd.DataFrame,
+    failures: CutoutFailureCache,
+) -> list[tuple[str, str, float, float]]:
+    """
+    Get the cutouts which do not exist yet and have not recently failed,
+    listing each cutout directory once rather than checking each file.
+    Cutouts of the sources which only exist as legacy PNGs are converted.
+
+    :param df: DataFrame containing source information
+    :param failures: Negative cache
+    :return: List of (source name, cutout type, ra, dec)
+    """
+    sources = df[["name", "ra", "dec"]].drop_duplicates(subset="name")
+
+    missing = []
+    for cutout_type in CUTOUT_TYPES:
+        sub_dir = get_cutout_path("", cutout_type=cutout_type).parent
+        files = os.listdir(sub_dir)
+        existing = {x[:-len(CUTOUT_SUFFIX)] for x in files if x.endswith(CUTOUT_SUFFIX)}
+        legacy = {
+            x[:-len(LEGACY_CUTOUT_SUFFIX)] for x in files if x.endswith(LEGACY_CUTOUT_SUFFIX)
+        }
+        for name in sources["name"][sources["name"].isin(legacy - existing)]:
+            if convert_legacy_cutout(name, cutout_type):
+                existing.add(name)
+        skip = existing | set(failures.failures[cutout_type])
+        mask = ~sources["name"].isin(skip)
+        missing += [
+            (name, cutout_type, ra, dec)
+            for name, ra, dec in sources[mask].itertuples(index=False)
+        ]
+    return missing
 
 
 def batch_create_cutouts(
     df: pd.DataFrame,
+    n_threads: int = DEFAULT_N_THREADS,
 ):
     """
-    Batch create cutouts for a DataFrame of sources.
+    Batch create cutouts for a DataFrame of sources, downloading and
+    writing them concurrently
 
     :param df: DataFrame containing source information
+    :param n_threads: Number of concurrent downloads
     :return: None
     """
-    for _, source in tqdm(df.iterrows(), total=len(df)):
-        create_cutout(source)
-        logger.debug(f"Cutouts created for {source['name']}")
+    if len(df) == 0:
+        return
+
+    with _failure_lock:
+        failures = CutoutFailureCache.load()
+
+    missing = get_missing_cutouts(df, failures)
+
+    logger.info(
+        f"Creating {len(missing)} cutouts for {len(df)} sources "
+        f"with {n_threads} threads"
+    )
+
+    if len(missing) == 0:
+        return
+
+    session = get_cutout_session(pool_size=n_threads)
+
+    n_failed = 0
+    new_failures = []
+
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        futures = {
+            executor.submit(create_cutout_file, session, *task): task
+            for task in missing
+        }
+        for future in tqdm(as_completed(futures), total=len(futures)):
+            name, cutout_type, _, _ = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                n_failed += 1
+                if is_permanent_failure(e):
+                    new_failures.append((name, cutout_type, e))
+                    logger.debug(f"{name}: {type(e).__name__} in {cutout_type} cutouts")
+                else:
+                    logger.info(f"{name}: {type(e).__name__} in {cutout_type} cutouts")
+
+    session.close()
+
+    logger.info(
+        f"Failed to create {n_failed} cutouts, "
+        f"of which {len(new_failures)} will not be retried"
+    )
+
+    if len(new_failures) > 0:
+        with _failure_lock:
+            failures = CutoutFailureCache.load()
+            for name, cutout_type, e in new_failures:
+                failures.add(name, cutout_type, e)
+            failures.save()
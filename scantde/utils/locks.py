@@ -0,0 +1,47 @@
+"""
+Lock serialising writes to the data files which tdescore shares between
+sources, e.g. the catalogue crossmatch caches and the combined raw source
+table.
+
+By default there is no lock. When several nights are processed concurrently
+(see scantde.backfill), each worker process is given the same
+multiprocessing lock, so only one process at a time writes to these files.
+"""
+
+from contextlib import contextmanager
+
+_lock = None
+
+
+def set_tdescore_lock(lock):
+    """
+    Set the lock used for writes to shared tdescore data, in this process
+
+    :param lock: Lock shared between processes, or None for no lock
+    :return: None
+    """
+    global _lock
+    _lock = lock
+
+
+def get_tdescore_lock():
+    """
+    Get the lock used for writes to shared tdescore data, in this process,
+    e.g. to pass it on to child processes
+
+    :return: Lock, or None if there is no lock
+    """
+    return _lock
+
+
+@contextmanager
+def tdescore_writes():
+    """
+    Context manager holding the shared tdescore lock, if there is one
+    """
+    if _lock is None:
+        yield
+        return
+
+    with _lock:
+        yield
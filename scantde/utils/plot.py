@@ -1,12 +1,23 @@
 """
 Module for plotting lightcurves
+
+Plots are drawn in a process pool using the Agg backend. Each plot is also
+kept in a cache, keyed by a hash of the raw lightcurve, the redshift and the
+plot version, so a source whose lightcurve has not changed since it was last
+plotted (e.g. on a previous night, or for another selection) is linked from
+the cache rather than drawn again. If the detections of a source have
+already been hashed (see scantde.selections.utils.fit_cache), that hash is
+used instead, so cached plots are linked without loading the lightcurve.
 """
 
+import hashlib
+import logging
+import os
+import shutil
+import time
 from pathlib import Path
 
-import matplotlib.pyplot as plt
 import pandas as pd
-import seaborn as sns
 from tdescore.alerts import load_source_raw
 from tdescore.lightcurve.plot import FIG_HEIGHT, FIG_WIDTH
 from tdescore.lightcurve.extinction import apply_extinction_correction
@@ -15,95 +26,282 @@ from astropy.cosmology import Planck18 as cosmo
 import numpy as np
 
 from tqdm import tqdm
-from astropy.table import Table
 
+from scantde.paths import lightcurve_cache_dir
+from scantde.utils.plot_pool import get_plot_pool
+
+logger = logging.getLogger(__name__)
+
+PLOT_VERSION = "1"  # Increment to redraw all cached plots
+
+MAX_PLOT_WORKERS = min(4, os.cpu_count() or 1)
+MIN_SOURCES_PER_WORKER = 10  # Below this, a process pool is not worth starting
+CACHE_MAX_AGE_DAYS = 30  # Cached plots not used for this long are deleted
 
+COLORS = {
+    1: "green",
+    2: "red",
+    3: "orange",
+}
 
-def create_lightcurve_plots(source_table: pd.DataFrame, base_output_dir: Path):
+
+def get_redshift(row: pd.Series) -> tuple[float, str]:
     """
-    Create lightcurve plots for a table of sources
+    Get the best redshift of a source to plot absolute magnitudes
 
-    :param source_table: Table of sources
-    :param base_output_dir: Output directory
+    :param row: Combined source row
+    :return: Redshift (-99. if none), and a label for its origin
     """
+    try:
+        redshift = row[f"{default_catalog}_z_spec"] if row[f"{default_catalog}_z_spec"] > 0 \
+            else row[f"{default_catalog}_z_phot_median"]
+        label = "spec" if row[f"{default_catalog}_z_spec"] > 0 else "phot"
+    except KeyError:
+        redshift = -99.
+        label = "none"
 
-    fig_dir = base_output_dir / "lightcurves"
-    fig_dir.mkdir(parents=True, exist_ok=True)
+    if label == "phot":
+        if pd.notnull(row["skyportal_redshift"]):
+            if row["skyportal_redshift"] > 0:
+                # Use skyportal redshift if available
+                redshift = row["skyportal_redshift"]
+                label = "fritz_"
 
-    for i, row in tqdm(source_table.iterrows(), total=len(source_table)):
-        source_name = row["ztf_name"]
+    return float(redshift), label
 
-        fig = plt.figure(figsize=(FIG_WIDTH, FIG_HEIGHT))
-        ax = plt.subplot(111)
-        output_path = fig_dir / f"{source_name}.png"
 
-        raw_df = load_source_raw(source_name)
+def get_plot_key(
+    redshift: float,
+    label: str,
+    raw_df: pd.DataFrame | None = None,
+    detection_hash: str | None = None,
+) -> str:
+    """
+    Get the cache key of a lightcurve plot, from either the raw lightcurve
+    or a precomputed hash of its detections
+
+    :param redshift: Redshift used for absolute magnitudes
+    :param label: Origin of the redshift
+    :param raw_df: Raw lightcurve of the source
+    :param detection_hash: Hash of the detections of the source
+    :return: Hex key
+    """
+    digest = hashlib.sha256()
+    if detection_hash is not None:
+        digest.update(f"detections|{detection_hash}".encode())
+    else:
+        digest.update(pd.util.hash_pandas_object(raw_df, index=False).to_numpy().tobytes())
+    digest.update(f"{redshift:.6f}|{label}|{PLOT_VERSION}".encode())
+    return digest.hexdigest()[:24]
+
+
+def draw_lightcurve(raw_df: pd.DataFrame, redshift: float, label: str, output_path: Path):
+    """
+    Draw the lightcurve of a single source and save it to file
+
+    :param raw_df: Raw lightcurve of the source
+    :param redshift: Redshift used for absolute magnitudes, or <= 0 for none
+    :param label: Origin of the redshift
+    :param output_path: Output path
+    :return: None
+    """
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    fig = plt.figure(figsize=(FIG_WIDTH, FIG_HEIGHT))
+    ax = plt.subplot(111)
 
-        raw_df["days"] = raw_df["jd"] - raw_df["jd"].max()
+    raw_df["days"] = raw_df["jd"] - raw_df["jd"].max()
 
-        raw_df = raw_df[raw_df["isdiffpos"].astype(str).isin(["t", "1", "true", "True"])]
+    raw_df = raw_df[raw_df["isdiffpos"].astype(str).isin(["t", "1", "true", "True"])]
 
-        colors = {
-            1: "green",
-            2: "red",
-            3: "orange",
-        }
-        raw_df = apply_extinction_correction(raw_df)
+    raw_df = apply_extinction_correction(raw_df)
 
+    for fid in set(raw_df["fid"]):
+        mask = raw_df["fid"] == fid
+        lc = raw_df[mask]
+        ax.errorbar(
+            lc["days"],
+            lc["magpsf"],
+            yerr=lc["sigmapsf"],
+            color=COLORS[int(fid)],
+            fmt="o",
+            markersize=2,
+        )
+
+    if redshift > 0:
+        # Calculate the luminosity distance in parsecs
+        luminosity_distance = cosmo.luminosity_distance(redshift).to('pc').value
+        # Calculate the absolute magnitude using the distance modulus formula
+        dm = 5 * (np.log10(luminosity_distance) - 1)
+
+        # Plot the absolute magnitude
+        ax2 = ax.twinx()
+        ax2.invert_yaxis()
         for fid in set(raw_df["fid"]):
             mask = raw_df["fid"] == fid
             lc = raw_df[mask]
-            ax.errorbar(
+            ax2.errorbar(
                 lc["days"],
-                lc["magpsf"],
+                lc["magpsf"] - dm,
                 yerr=lc["sigmapsf"],
-                color=colors[int(fid)],
+                color=COLORS[int(fid)],
                 fmt="o",
                 markersize=2,
             )
+        ax2.set_ylabel(f"Ab Mag [AB] ({label}z={redshift:.2f})")
+
+    ax.set_xlabel("Days Ago")
+    ax.set_ylabel("Mag [AB]")
+    ax.invert_yaxis()
+
+    sns.despine(right=False)
+
+    fig.savefig(output_path, bbox_inches="tight")
+    plt.close(fig)
+
+
+def link_plot(cache_path: Path, output_path: Path):
+    """
+    Link a cached plot to its output path, or copy it if links are not possible
+
+    :param cache_path: Path of the cached plot
+    :param output_path: Output path
+    :return: None
+    """
+    output_path.unlink(missing_ok=True)
+    try:
+        os.link(cache_path, output_path)
+    except OSError:
+        shutil.copyfile(cache_path, output_path)
+    # Mark the cached plot as recently used
+    os.utime(cache_path)
+
+
+def _plot_source(
+    source_name: str,
+    redshift: float,
+    label: str,
+    output_path: Path,
+    detection_hash: str | None = None,
+) -> dict:
+    """
+    Plot the lightcurve of a single source, unless an identical plot is cached
+
+    :param source_name: Name of the source
+    :param redshift: Redshift used for absolute magnitudes
+    :param label: Origin of the redshift
+    :param output_path: Output path
+    :param detection_hash: Hash of the detections of the source, or None
+    :return: Dictionary of timings [s], and whether the plot was reused
+    """
+    t_start = time.perf_counter()
+    raw_df = None
+    if detection_hash is None:
+        raw_df = load_source_raw(source_name)
+    key = get_plot_key(redshift, label, raw_df=raw_df, detection_hash=detection_hash)
+    cache_path = lightcurve_cache_dir / f"{key}.png"
+    t_load = time.perf_counter()
+
+    reused = cache_path.exists()
+    t_plot = t_load
+
+    if not reused:
+        if raw_df is None:
+            raw_df = load_source_raw(source_name)
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp.png")
+        draw_lightcurve(raw_df, redshift, label, tmp_path)
+        t_plot = time.perf_counter()
+        tmp_path.replace(cache_path)
+
+    if not (output_path.exists() and os.path.samefile(cache_path, output_path)):
+        link_plot(cache_path, output_path)
+
+    t_end = time.perf_counter()
+
+    return {
+        "ztf_name": source_name,
+        "reused": reused,
+        "load_time": t_load - t_start,
+        "plot_time": t_plot - t_load,
+        "save_time": t_end - t_plot,
+    }
+
+
+def prune_lightcurve_cache(max_age_days: float = CACHE_MAX_AGE_DAYS) -> int:
+    """
+    Delete cached plots which have not been used recently
+
+    :param max_age_days: Maximum time since a plot was last used [days]
+    :return: Number of plots deleted
+    """
+    oldest = time.time() - max_age_days * 86400.
+    n_deleted = 0
+    for path in lightcurve_cache_dir.glob("*.png"):
+        if path.stat().st_mtime < oldest:
+            path.unlink(missing_ok=True)
+            n_deleted += 1
+    return n_deleted
+
+
+def create_lightcurve_plots(
+    source_table: pd.DataFrame,
+    base_output_dir: Path,
+    n_workers: int = MAX_PLOT_WORKERS,
+    detection_hashes: dict[str, str | None] | None = None,
+) -> pd.DataFrame:
+    """
+    Create lightcurve plots for a table of sources, spread over a process pool
+
+    :param source_table: Table of sources
+    :param base_output_dir: Output directory
+    :param n_workers: Maximum number of plotting processes
+    :param detection_hashes: Precomputed hashes of the detections of each
+        source, or None to hash the raw lightcurves
+    :return: Timings of each source [s]
+    """
+    if detection_hashes is None:
+        detection_hashes = {}
+
+
+    fig_dir = base_output_dir / "lightcurves"
+    fig_dir.mkdir(parents=True, exist_ok=True)
+
+    jobs = []
+    for _, row in source_table.iterrows():
+        source_name = row["ztf_name"]
+        redshift, label = get_redshift(row)
+        jobs.append((
+            source_name, redshift, label, fig_dir / f"{source_name}.png",
+            detection_hashes.get(source_name),
+        ))
+
+    if len(jobs) == 0:
+        return pd.DataFrame()
+
+    n_workers = min(n_workers, len(jobs) // MIN_SOURCES_PER_WORKER)
+
+    if n_workers < 2:
+        timings = [_plot_source(*job) for job in tqdm(jobs)]
+    else:
+        with get_plot_pool(n_workers) as executor:
+            timings = list(tqdm(
+                executor.map(_plot_source, *zip(*jobs), chunksize=4),
+                total=len(jobs),
+            ))
+
+    timings = pd.DataFrame(timings)
+    drawn = timings[~timings["reused"]]
+    logger.info(
+        f"Plotted {len(drawn)} lightcurves and reused {len(timings) - len(drawn)} "
+        f"with {max(n_workers, 1)} processes. Total load time "
+        f"{timings['load_time'].sum():.1f}s, plot time {drawn['plot_time'].sum():.1f}s "
+        f"({drawn['plot_time'].mean() if len(drawn) > 0 else 0.:.2f}s per plot), "
+        f"save time {timings['save_time'].sum():.1f}s"
+    )
+
+    n_deleted = prune_lightcurve_cache()
+    if n_deleted > 0:
+        logger.debug(f"Deleted {n_deleted} unused cached lightcurve plots")
 
-        try:
-            redshift = row[f"{default_catalog}_z_spec"] if row[f"{default_catalog}_z_spec"] > 0 \
-                else row[f"{default_catalog}_z_phot_median"]
-            label = "spec" if row[f"{default_catalog}_z_spec"] > 0 else "phot"
-        except KeyError:
-            redshift = -99.
-            label = "none"
-
-        if label == "phot":
-            if pd.notnull(row["skyportal_redshift"]):
-                if row["skyportal_redshift"] > 0:
-                    # Use skyportal redshift if available
-                    redshift = row["skyportal_redshift"]
-                    label = "fritz_"
-
-        if redshift > 0:
-            # Calculate the luminosity distance in parsecs
-            luminosity_distance = cosmo.luminosity_distance(redshift).to('pc').value
-            # Calculate the absolute magnitude using the distance modulus formula
-            dm = 5 * (np.log10(luminosity_distance) - 1)
-
-            # Plot the absolute magnitude
-            ax2 = ax.twinx()
-            ax2.invert_yaxis()
-            for fid in set(raw_df["fid"]):
-                mask = raw_df["fid"] == fid
-                lc = raw_df[mask]
-                ax2.errorbar(
-                    lc["days"],
-                    lc["magpsf"] - dm,
-                    yerr=lc["sigmapsf"],
-                    color=colors[int(fid)],
-                    fmt="o",
-                    markersize=2,
-                )
-            ax2.set_ylabel(f"Ab Mag [AB] ({label}z={redshift:.2f})")
-
-        ax.set_xlabel("Days Ago")
-        ax.set_ylabel("Mag [AB]")
-        ax.invert_yaxis()
-
-        sns.despine(right=False)
-
-        fig.savefig(output_path, bbox_inches="tight")
-        plt.close(fig)
+    return timings
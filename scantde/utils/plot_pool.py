@@ -0,0 +1,27 @@
+"""
+Process pools for drawing plots with matplotlib.
+
+Each worker process uses the non-interactive Agg backend. The backend is
+only selected inside the workers, so plots drawn in the calling process
+(e.g. for a few sources, or by the server) keep its own backend.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+
+
+def init_plot_worker():
+    """
+    Use a fixed, non-interactive backend in a plotting process
+    """
+    import matplotlib
+    matplotlib.use("Agg", force=True)
+
+
+def get_plot_pool(n_workers: int) -> ProcessPoolExecutor:
+    """
+    Get a process pool for drawing plots
+
+    :param n_workers: Number of processes
+    :return: Process pool
+    """
+    return ProcessPoolExecutor(max_workers=n_workers, initializer=init_plot_worker)
@@ -2,5 +2,7 @@
 Module for interfacing with SkyPortal
 """
 from scantde.utils.skyportal.client import SkyportalClient, NoCredentialsError
-from scantde.utils.skyportal.export import export_to_skyportal
+from scantde.utils.skyportal.export import (
+    export_to_skyportal, ExportPlanner, plan_export, export_night, clear_export_plans,
+)
 from scantde.utils.skyportal.download import download_from_skyportal, get_skyportal_data
\ No newline at end of file
@@ -4,6 +4,8 @@ Basic SkyPortal API client.
 
 import logging
 import os
+import threading
+import time
 from typing import Mapping, Optional
 from urllib.parse import urljoin
 
@@ -14,6 +16,10 @@ from urllib3.util import Retry
 DEFAULT_TIMEOUT = 60  # seconds
 SKYPORTAL_ORIGIN = "tdescore"
 
+DEFAULT_POOL_SIZE = 10  # Connections kept open per host
+RETRY_STATUSES = [405, 429, 500, 502, 503, 504]
+MAX_RATE_LIMIT_RETRIES = 5
+
 logger = logging.getLogger(__name__)
 
 class NoCredentialsError(KeyError):
@@ -52,6 +58,54 @@ class TimeoutHTTPAdapter(HTTPAdapter):
             kwargs["timeout"] = DEFAULT_TIMEOUT
 
 
+class RateLimiter:
+    """
+    Limit on the rate of requests, shared between threads
+    """
+
+    def __init__(self, max_requests_per_second: float):
+        self.interval = 1. / max_requests_per_second
+        self._lock = threading.Lock()
+        self._next_time = time.monotonic()
+
+    def wait(self):
+        """
+        Wait until the next request is allowed
+
+        :return: None
+        """
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_time)
+            self._next_time = start + self.interval
+        time.sleep(start - now)
+
+    def pause(self, seconds: float):
+        """
+        Hold back all requests for a time, e.g. after a 429 response
+
+        :param seconds: Pause duration [s]
+        :return: None
+        """
+        with self._lock:
+            self._next_time = max(self._next_time, time.monotonic() + seconds)
+
+
+def get_retry_delay(response: requests.Response, attempt: int) -> float:
+    """
+    Get the delay before retrying a rate-limited request, from the
+    Retry-After header if present, or else an exponential backoff
+
+    :param response: 429 response
+    :param attempt: Number of previous attempts
+    :return: Delay [s]
+    """
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return 2. ** attempt
+
+
 class SkyportalClient:
     """
     Basic Skyportal client class for executing functions
@@ -60,8 +114,22 @@ class SkyportalClient:
     def __init__(
         self,
         base_url: str = "https://fritz.science/api/",
+        max_requests_per_second: float | None = None,
+        pool_size: int = DEFAULT_POOL_SIZE,
     ):
+        """
+        :param base_url: URL of the SkyPortal API
+        :param max_requests_per_second: Maximum rate of requests, shared by
+            all threads using the client, or None for no limit. If set, 429
+            responses pause all requests rather than being retried per request.
+        :param pool_size: Number of connections kept open, which should be at
+            least the number of threads using the client
+        """
         self.base_url = base_url
+        self.pool_size = pool_size
+        self.rate_limiter = None
+        if max_requests_per_second is not None:
+            self.rate_limiter = RateLimiter(max_requests_per_second)
         self._session = None
         self.session_headers = None
 
@@ -78,13 +146,22 @@ class SkyportalClient:
             "User-Agent": "mirar",
         }
 
+        status_forcelist = RETRY_STATUSES
+        if self.rate_limiter is not None:
+            # Rate limits are handled by the shared rate limiter instead
+            status_forcelist = [x for x in RETRY_STATUSES if x != 429]
+
         retries = Retry(
             total=5,
             backoff_factor=2,
-            status_forcelist=[405, 429, 500, 502, 503, 504],
+            status_forcelist=status_forcelist,
             allowed_methods=["HEAD", "GET", "PUT", "POST", "PATCH"],
         )
-        adapter = TimeoutHTTPAdapter(max_retries=retries)
+        adapter = TimeoutHTTPAdapter(
+            max_retries=retries,
+            pool_connections=self.pool_size,
+            pool_maxsize=self.pool_size,
+        )
         self._session.mount("https://", adapter)
         self._session.mount("http://", adapter)
 
@@ -150,16 +227,20 @@ class SkyportalClient:
         url = urljoin(self.base_url, endpoint)
 
         if method == "get":
-            response = methods[method](
-                url,
-                params=data,
-                headers=self.session_headers,
-            )
+            kwargs = {"params": data}
         else:
-            response = methods[method](
-                url,
-                json=data,
-                headers=self.session_headers,
-            )
+            kwargs = {"json": data}
+
+        if self.rate_limiter is None:
+            return methods[method](url, headers=self.session_headers, **kwargs)
+
+        for attempt in range(MAX_RATE_LIMIT_RETRIES + 1):
+            self.rate_limiter.wait()
+            response = methods[method](url, headers=self.session_headers, **kwargs)
+            if response.status_code != 429:
+                break
+            delay = get_retry_delay(response, attempt)
+            logger.warning(f"Rate limited by SkyPortal, pausing requests for {delay:.1f}s")
+            self.rate_limiter.pause(delay)
 
         return response
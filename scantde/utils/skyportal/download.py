@@ -3,13 +3,15 @@ Export sources to SkyPortal
 """
 
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 
 from sklearn.metrics import classification_report
 from tqdm import tqdm
 import pandas as pd
 from pathlib import Path
 
-from scantde.utils.skyportal.client import SkyportalClient
+from scantde.utils.skyportal.client import SkyportalClient, DEFAULT_POOL_SIZE
 from tdescore.download.legacy_survey import default_catalog
 from scantde.paths import get_input_cache
 
@@ -19,6 +21,9 @@ SKYPORTAL_DF_COLUMNS = [
     "ztf_name", "skyportal_redshift", "skyportal_tns_name", "skyportal_class"
 ]
 
+DEFAULT_N_THREADS = int(os.getenv("SKYPORTAL_N_THREADS", 8))
+DEFAULT_MAX_REQUESTS_PER_SECOND = float(os.getenv("SKYPORTAL_MAX_RPS", 10.))
+
 
 def get_skyportal_path(datestr: str) -> Path:
     """
@@ -31,12 +36,59 @@ def get_skyportal_path(datestr: str) -> Path:
     return input_cache / f"skyportal_cache.json"
 
 
-def download_from_skyportal(names: list[str], datestr: str):
+def fetch_source(client: SkyportalClient, name: str) -> dict:
+    """
+    Get the SkyPortal info for a single source
+
+    :param client: SkyPortal client
+    :param name: Source name
+    :return: Dictionary of SkyPortal info
     """
-    Save sources to a file
+    new = {"ztf_name": name}
+
+    try:
+
+        response = client.api(
+            "get",
+            endpoint=f"sources/{name}",
+        )
+
+        if not response.json()["status"] == "success":
+            logger.debug(
+                f"Failed to save Source {name} "
+                f"on SkyPortal with error: {response.json()}"
+            )
+
+        data = response.json().get("data")
+
+        for key in ["redshift", "tns_name"]:
+            new[f"skyportal_{key}"] = data.get(key)
+
+        classifications = [x.get("classification") for x in data.get("classifications", [])]
+
+        new["skyportal_class"] = "/".join(set(classifications)) if classifications else None
+
+    except ConnectionError:
+        logger.info(f"Failed to load Source {name} on SkyPortal")
+
+    return new
+
+
+def download_from_skyportal(
+    names: list[str],
+    datestr: str,
+    n_threads: int = DEFAULT_N_THREADS,
+    max_requests_per_second: float | None = DEFAULT_MAX_REQUESTS_PER_SECOND,
+    client: SkyportalClient | None = None,
+):
+    """
+    Save sources to a file, downloading them from SkyPortal in parallel threads
 
     :param names: list of source names
     :param datestr: Date string
+    :param n_threads: Number of concurrent requests
+    :param max_requests_per_second: Maximum rate of requests, or None for no limit
+    :param client: SkyPortal client, or None to create one
     :return: None
     """
 
@@ -51,46 +103,22 @@ def download_from_skyportal(names: list[str], datestr: str):
     else:
         old = pd.DataFrame(columns=SKYPORTAL_DF_COLUMNS)
 
-    client = SkyportalClient()
+    if client is None:
+        client = SkyportalClient(
+            max_requests_per_second=max_requests_per_second,
+            pool_size=max(n_threads, DEFAULT_POOL_SIZE),
+        )
     client.set_up_session()
 
-    logger.info("Importing info from SkyPortal")
-
-    sky_dicts = []
-
-    for name in tqdm(names):
-
-        new = {"ztf_name": name}
-
-        try:
-
-            response = client.api(
-                "get",
-                endpoint=f"sources/{name}",
-            )
-
-            if not response.json()["status"] == "success":
-                logger.debug(
-                    f"Failed to save Source {name} "
-                    f"on SkyPortal with error: {response.json()}"
-                )
-
-            data = response.json().get("data")
-
-            for key in ["redshift", "tns_name"]:
-                new[f"skyportal_{key}"] = data.get(key)
-
-            classifications = [x.get("classification") for x in data.get("classifications", [])]
-
-            new["skyportal_class"] = "/".join(set(classifications)) if classifications else None
-
+    logger.info(f"Importing info from SkyPortal with {n_threads} threads")
 
-        except ConnectionError:
-            logger.info(f"Failed to load Source {name} on SkyPortal")
-            continue
+    names = list(names)
 
-        finally:
-            sky_dicts.append(new)
+    with ThreadPoolExecutor(max_workers=n_threads) as executor:
+        sky_dicts = list(tqdm(
+            executor.map(lambda x: fetch_source(client, x), names),
+            total=len(names),
+        ))
 
     sky_df = pd.DataFrame(
         sky_dicts,
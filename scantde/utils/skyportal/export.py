@@ -1,111 +1,442 @@
 """
-Export sources to SkyPortal
+Export sources to SkyPortal.
+
+Exports are planned before any request is made: the planner gathers the
+groups and redshift to save for every source, merging the group IDs of each
+source so it is posted once, however many selections or groups it is in.
+Each selection saves its planned exports to a file of the night, and the
+plans of all selections are run together once the night is complete.
+Sources already saved to a group, or whose redshift has already been set,
+are recorded in a local ledger and skipped on later exports. The ledger is
+locked while it is read and updated, as several processes can export at
+once. The remaining requests are run concurrently in threads, through a
+rate-limited client.
 """
 
+import fcntl
 import logging
-from tqdm import tqdm
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from pathlib import Path
+
 import pandas as pd
+from pydantic import BaseModel, Field
+from tqdm import tqdm
+from requests.exceptions import RetryError
+from urllib3.exceptions import MaxRetryError
 
-from scantde.utils.skyportal.client import SkyportalClient
+from scantde.paths import skyportal_ledger_path, get_export_plan_path
+from scantde.utils.skyportal.client import SkyportalClient, DEFAULT_POOL_SIZE
+from scantde.utils.skyportal.download import (
+    DEFAULT_N_THREADS,
+    DEFAULT_MAX_REQUESTS_PER_SECOND,
+)
 from tdescore.download.legacy_survey import default_catalog
-from urllib3.exceptions import MaxRetryError
-from requests.exceptions import RetryError
 
 logger = logging.getLogger(__name__)
 
-def export_to_skyportal(sources: pd.DataFrame, group_id: int = 1679):
+DEFAULT_GROUP_ID = 1679
+MIN_EXPORT_SCORE = 0.01
+
+_ledger_lock = threading.Lock()
+
+
+@contextmanager
+def lock_ledger():
     """
-    Save sources to a file
+    Context manager holding the export ledger lock, for threads of this
+    process and for other processes
+    """
+    lock_path = skyportal_ledger_path.with_suffix(".lock")
+    with _ledger_lock, open(lock_path, "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
 
-    :param sources: list of source names
-    :group_id: group id
-    :return: None
+
+class LedgerEntry(BaseModel):
+    """
+    A pydantic model for what has been saved to SkyPortal for a source
     """
+    group_ids: set[int] = Field(
+        default_factory=set, description="Groups the source has been saved to"
+    )
+    redshift_set: bool = Field(
+        default=False, description="Whether the source has a redshift on SkyPortal"
+    )
 
-    client = SkyportalClient()
-    client.set_up_session()
 
-    group_ids = [int(group_id)]
+class ExportLedger(BaseModel):
+    """
+    A pydantic model for the ledger of sources exported to SkyPortal
+    """
+    sources: dict[str, LedgerEntry] = Field(default_factory=dict)
+
+    @classmethod
+    def load(cls) -> "ExportLedger":
+        """
+        Load the ledger from file, or an empty ledger if there is none
+
+        :return: Ledger
+        """
+        if skyportal_ledger_path.exists():
+            try:
+                return cls.model_validate_json(skyportal_ledger_path.read_text())
+            except ValueError as e:
+                logger.warning(f"Ignoring unreadable export ledger: {e}")
+        return cls()
 
-    logger.info("Exporting sources to SkyPortal")
+    def update(self, other: "ExportLedger"):
+        """
+        Merge another ledger into this one
 
-    for i, row in tqdm(sources.iterrows(), total=len(sources)):
+        :param other: Ledger to merge
+        :return: None
+        """
+        for name, entry in other.sources.items():
+            own = self.sources.setdefault(name, LedgerEntry())
+            own.group_ids |= entry.group_ids
+            own.redshift_set |= entry.redshift_set
+
+    def save(self):
+        """
+        Save the ledger, merged with any entries written to file since it
+        was loaded (e.g. by another selection), replacing it atomically
+
+        :return: None
+        """
+        merged = self.load()
+        merged.update(self)
+        tmp_path = skyportal_ledger_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(merged.model_dump_json())
+        tmp_path.replace(skyportal_ledger_path)
+
+
+class ExportAction(BaseModel):
+    """
+    A pydantic model for the requests to make for a single source
+    """
+    ztf_name: str
+    group_ids: set[int] = Field(
+        default_factory=set, description="Groups to save the source to"
+    )
+    redshift: float | None = Field(
+        default=None, description="Spectroscopic redshift to set, if missing"
+    )
 
-        if row["tdescore"] < 0.01:
-            logger.debug(
-                f"Skipping Source {row['ztf_name']} with TDEScore {row['tdescore']}"
+
+class ExportPlan(BaseModel):
+    """
+    A pydantic model for the exports planned by a selection
+    """
+    actions: dict[str, ExportAction] = Field(default_factory=dict)
+
+
+class ExportPlanner:
+    """
+    Planner for the SkyPortal exports of a night
+    """
+
+    def __init__(self):
+        self.actions: dict[str, ExportAction] = {}
+
+    def _get_action(self, name: str) -> ExportAction:
+        if name not in self.actions:
+            self.actions[name] = ExportAction(ztf_name=name)
+        return self.actions[name]
+
+    def save_plan(self, path: Path):
+        """
+        Save the planned exports to file, replacing it atomically
+
+        :param path: Path of the plan
+        :return: None
+        """
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(ExportPlan(actions=self.actions).model_dump_json())
+        tmp_path.replace(path)
+
+    def add_plan(self, path: Path):
+        """
+        Add the exports planned in a file, merging the groups of each source
+
+        :param path: Path of the plan
+        :return: None
+        """
+        plan = ExportPlan.model_validate_json(path.read_text())
+        for name, action in plan.actions.items():
+            own = self._get_action(name)
+            own.group_ids |= action.group_ids
+            if action.redshift is not None:
+                own.redshift = action.redshift
+
+    def add(self, sources: pd.DataFrame, group_id: int = DEFAULT_GROUP_ID):
+        """
+        Add sources to save to a group, and any redshifts they have
+
+        :param sources: Table of sources
+        :param group_id: Group ID
+        :return: None
+        """
+        if len(sources) == 0:
+            return
+
+        names = sources["ztf_name"].to_numpy()
+
+        mask = ~(sources["tdescore"].astype(float) < MIN_EXPORT_SCORE).to_numpy()
+        for name in names[~mask]:
+            logger.debug(f"Skipping Source {name} with TDEScore below {MIN_EXPORT_SCORE}")
+
+        for name in names[mask]:
+            self._get_action(name).group_ids.add(int(group_id))
+
+        key = f"{default_catalog}_z_spec"
+
+        if key not in sources.columns:
+            logger.warning(f"Redshift data key '{key}' not found")
+            return
+
+        specz = sources[key].astype(float).to_numpy()
+        for name, z in zip(names, specz):
+            if z > 0:
+                self._get_action(name).redshift = float(z)
+
+    def get_pending(self, ledger: ExportLedger) -> list[ExportAction]:
+        """
+        Get the actions which are not already recorded in the ledger
+
+        :param ledger: Export ledger
+        :return: List of actions
+        """
+        pending = []
+        for name, action in self.actions.items():
+            entry = ledger.sources.get(name, LedgerEntry())
+            new = ExportAction(
+                ztf_name=name,
+                group_ids=action.group_ids - entry.group_ids,
+                redshift=None if entry.redshift_set else action.redshift,
             )
-            continue
+            if (len(new.group_ids) > 0) | (new.redshift is not None):
+                pending.append(new)
+        return pending
 
-        try:
+    def execute(
+        self,
+        n_threads: int = DEFAULT_N_THREADS,
+        max_requests_per_second: float | None = DEFAULT_MAX_REQUESTS_PER_SECOND,
+        client: SkyportalClient | None = None,
+    ) -> ExportLedger:
+        """
+        Run the planned exports concurrently, and record them in the ledger
+
+        :param n_threads: Number of concurrent requests
+        :param max_requests_per_second: Maximum rate of requests, or None for no limit
+        :param client: SkyPortal client, or None to create one
+        :return: Ledger of the exports which succeeded
+        """
+        with lock_ledger():
+            pending = self.get_pending(ExportLedger.load())
+
+        n_skipped = len(self.actions) - len(pending)
+        logger.info(
+            f"Exporting {len(pending)} sources to SkyPortal, "
+            f"skipping {n_skipped} already exported"
+        )
 
-            response = client.api(
-                "post",
-                endpoint=f"alerts/{row['ztf_name']}",
-                data={"group_ids": group_ids}
+        done = ExportLedger()
+
+        if len(pending) == 0:
+            return done
+
+        if client is None:
+            client = SkyportalClient(
+                max_requests_per_second=max_requests_per_second,
+                pool_size=max(n_threads, DEFAULT_POOL_SIZE),
             )
+        client.set_up_session()
 
-            if not response.json()["status"] == "success":
-                logger.info(
-                    f"Failed to save Source {row['ztf_name']} "
-                    f"on SkyPortal with error: {response.json()}"
-                )
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            entries = list(tqdm(
+                executor.map(lambda x: export_source(client, x), pending),
+                total=len(pending),
+            ))
 
-        except (ConnectionError, RetryError, MaxRetryError):
-            logger.info(f"Failed to save Source {row['ztf_name']} on SkyPortal")
-            continue
+        for action, entry in zip(pending, entries):
+            if (len(entry.group_ids) > 0) | entry.redshift_set:
+                done.sources[action.ztf_name] = entry
 
-    logger.info("Exporting redshift data to SkyPortal")
+        with lock_ledger():
+            done.save()
 
-    key = f"{default_catalog}_z_spec"
+        self.actions.clear()
+        return done
 
-    if key not in sources.columns:
-        logger.warning(f"Redshift data key '{key}' not found")
-        return
 
-    for i, row in tqdm(sources.iterrows(), total=len(sources)):
+def save_to_groups(client: SkyportalClient, name: str, group_ids: set[int]) -> bool:
+    """
+    Save a source to SkyPortal groups
 
-        specz = row[f"{default_catalog}_z_spec"]
+    :param client: SkyPortal client
+    :param name: Source name
+    :param group_ids: Group IDs
+    :return: Whether the source was saved
+    """
+    try:
+        response = client.api(
+            "post",
+            endpoint=f"alerts/{name}",
+            data={"group_ids": sorted(group_ids)}
+        )
 
-        if specz > 0:
+        if not response.json()["status"] == "success":
+            logger.info(
+                f"Failed to save Source {name} "
+                f"on SkyPortal with error: {response.json()}"
+            )
+            return False
 
-            try:
-                response = client.api(
-                    "get",
-                    endpoint=f"sources/{row['ztf_name']}",
-                )
-
-                if not response.json()["status"] == "success":
-                    logger.error(
-                        f"Failed to load redshift {row['ztf_name']} "
-                        f"on SkyPortal with error: {response.json()}"
-                    )
-                    continue
-
-                res = response.json()["data"]["redshift"]
-
-                if res is None:
-
-                    # Export redshift data to SkyPortal
-                    response = client.api(
-                        "patch",
-                        endpoint=f"sources/{row['ztf_name']}",
-                        data={
-                            "redshift": specz,
-                            "redshift_origin": f"{default_catalog} (specz)",
-                        },
-                    )
-                    if not response.json()["status"] == "success":
-                        logger.error(
-                            f"Failed to save redshift {row['ztf_name']} "
-                            f"on SkyPortal with error: {response.json()}"
-                        )
-                    else:
-                        logger.info(
-                            f"Saved redshift {row['ztf_name']} "
-                            f"on SkyPortal with value {specz}"
-                        )
-
-            except (ConnectionError, RetryError, MaxRetryError):
-                logger.error(f"Failed to save redshift {row['ztf_name']} on SkyPortal")
-                continue
\ No newline at end of file
+    except (ConnectionError, RetryError, MaxRetryError):
+        logger.info(f"Failed to save Source {name} on SkyPortal")
+        return False
+
+    return True
+
+
+def save_redshift(client: SkyportalClient, name: str, specz: float) -> bool:
+    """
+    Set the redshift of a source on SkyPortal, unless it already has one
+
+    :param client: SkyPortal client
+    :param name: Source name
+    :param specz: Spectroscopic redshift
+    :return: Whether the source now has a redshift on SkyPortal
+    """
+    try:
+        response = client.api(
+            "get",
+            endpoint=f"sources/{name}",
+        )
+
+        if not response.json()["status"] == "success":
+            logger.error(
+                f"Failed to load redshift {name} "
+                f"on SkyPortal with error: {response.json()}"
+            )
+            return False
+
+        if response.json()["data"]["redshift"] is not None:
+            return True
+
+        response = client.api(
+            "patch",
+            endpoint=f"sources/{name}",
+            data={
+                "redshift": specz,
+                "redshift_origin": f"{default_catalog} (specz)",
+            },
+        )
+        if not response.json()["status"] == "success":
+            logger.error(
+                f"Failed to save redshift {name} "
+                f"on SkyPortal with error: {response.json()}"
+            )
+            return False
+
+        logger.info(f"Saved redshift {name} on SkyPortal with value {specz}")
+
+    except (ConnectionError, RetryError, MaxRetryError):
+        logger.error(f"Failed to save redshift {name} on SkyPortal")
+        return False
+
+    return True
+
+
+def export_source(client: SkyportalClient, action: ExportAction) -> LedgerEntry:
+    """
+    Make the requests for a single source. The source is saved to its
+    groups before the redshift is set, as the source must exist first.
+
+    :param client: SkyPortal client
+    :param action: Export action
+    :return: Ledger entry of what was saved
+    """
+    entry = LedgerEntry()
+
+    if len(action.group_ids) > 0:
+        if not save_to_groups(client, action.ztf_name, action.group_ids):
+            return entry
+        entry.group_ids = set(action.group_ids)
+
+    if action.redshift is not None:
+        entry.redshift_set = save_redshift(client, action.ztf_name, action.redshift)
+
+    return entry
+
+
+def plan_export(
+    sources: pd.DataFrame,
+    datestr: str,
+    selection: str,
+    group_id: int = DEFAULT_GROUP_ID,
+):
+    """
+    Plan to save sources to a SkyPortal group, and export their redshifts,
+    once all selections of the night are complete (see export_night)
+
+    :param sources: Table of sources
+    :param datestr: Night (YYYYMMDD)
+    :param selection: Selection name
+    :param group_id: group id
+    :return: None
+    """
+    planner = ExportPlanner()
+    planner.add(sources, group_id=group_id)
+    planner.save_plan(get_export_plan_path(datestr, selection))
+
+
+def clear_export_plans(datestr: str, selections: list[str]):
+    """
+    Delete the export plans of selections for a night, e.g. before they are rerun
+
+    :param datestr: Night (YYYYMMDD)
+    :param selections: Selection names
+    :return: None
+    """
+    for selection in selections:
+        get_export_plan_path(datestr, selection).unlink(missing_ok=True)
+
+
+def export_night(datestr: str, selections: list[str]):
+    """
+    Run the exports planned by the selections of a night together, so each
+    source is posted once with all of its groups
+
+    :param datestr: Night (YYYYMMDD)
+    :param selections: Names of the selections whose plans to run
+    :return: None
+    """
+    planner = ExportPlanner()
+    for selection in selections:
+        path = get_export_plan_path(datestr, selection)
+        if path.exists():
+            planner.add_plan(path)
+
+    planner.execute()
+    clear_export_plans(datestr, selections)
+
+
+def export_to_skyportal(sources: pd.DataFrame, group_id: int = DEFAULT_GROUP_ID):
+    """
+    Save sources to a SkyPortal group, and export their redshifts
+
+    :param sources: Table of sources
+    :param group_id: group id
+    :return: None
+    """
+    planner = ExportPlanner()
+    planner.add(sources, group_id=group_id)
+    planner.execute()
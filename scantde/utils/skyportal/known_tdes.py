@@ -0,0 +1,245 @@
+"""
+Local catalogue of the sources classified as TDEs on SkyPortal.
+
+The catalogue is cached on disk and only refreshed once it is older than a
+time-to-live. A refresh only requests sources modified since the previous
+one, with all pages of the results requested concurrently, and a full
+download is made periodically so that sources which are no longer
+classified as TDEs are dropped. If SkyPortal cannot be reached, the cached
+catalogue is used however old it is.
+"""
+
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+from pydantic import BaseModel, Field
+from requests.exceptions import RequestException
+
+from scantde.paths import known_tdes_cache_path
+from scantde.utils.skyportal.client import (
+    SkyportalClient, NoCredentialsError, DEFAULT_POOL_SIZE,
+)
+from scantde.utils.skyportal.download import (
+    DEFAULT_N_THREADS,
+    DEFAULT_MAX_REQUESTS_PER_SECOND,
+)
+
+logger = logging.getLogger(__name__)
+
+TDE_CLASSIFICATION = "Sitewide Taxonomy: Tidal Disruption Event"
+NUM_PER_PAGE = 500  # Maximum page size of the SkyPortal sources endpoint
+
+KNOWN_TDES_TTL = timedelta(hours=float(os.getenv("KNOWN_TDES_TTL_HOURS", 12.)))
+FULL_REFRESH_INTERVAL = timedelta(days=7)
+MODIFIED_MARGIN = timedelta(minutes=10)  # Overlap between incremental refreshes
+
+_lock = threading.Lock()
+
+
+class KnownTDECatalogue(BaseModel):
+    """
+    A pydantic model for the cached catalogue of known TDEs
+    """
+    names: set[str] = Field(
+        default_factory=set, description="Names of the sources classified as TDEs"
+    )
+    last_refresh: datetime | None = Field(
+        default=None, description="Time of the last refresh (UTC)"
+    )
+    last_full_refresh: datetime | None = Field(
+        default=None, description="Time of the last full download (UTC)"
+    )
+
+    @classmethod
+    def load(cls) -> "KnownTDECatalogue":
+        """
+        Load the catalogue from file, or an empty catalogue if there is none
+
+        :return: Catalogue
+        """
+        if known_tdes_cache_path.exists():
+            try:
+                return cls.model_validate_json(known_tdes_cache_path.read_text())
+            except ValueError as e:
+                logger.warning(f"Ignoring unreadable known TDE cache: {e}")
+        return cls()
+
+    def save(self):
+        """
+        Save the catalogue to file, replacing it atomically
+
+        :return: None
+        """
+        tmp_path = known_tdes_cache_path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_text(self.model_dump_json())
+        tmp_path.replace(known_tdes_cache_path)
+
+    def is_stale(self, now: datetime) -> bool:
+        """
+        Check whether the catalogue is older than its time-to-live
+
+        :param now: Current time (UTC)
+        :return: Whether the catalogue should be refreshed
+        """
+        if self.last_refresh is None:
+            return True
+        return now - self.last_refresh > KNOWN_TDES_TTL
+
+    def needs_full_refresh(self, now: datetime) -> bool:
+        """
+        Check whether the catalogue should be downloaded in full
+
+        :param now: Current time (UTC)
+        :return: Whether to download all known TDEs
+        """
+        if self.last_full_refresh is None:
+            return True
+        return now - self.last_full_refresh > FULL_REFRESH_INTERVAL
+
+
+def fetch_page(
+    client: SkyportalClient, page: int, modified_after: datetime | None = None,
+) -> tuple[list[str], int]:
+    """
+    Get a single page of the sources classified as TDEs
+
+    :param client: SkyPortal client
+    :param page: Page number, starting from 1
+    :param modified_after: Only get sources modified after this time, or None for all
+    :return: Source names, and the total number of matching sources
+    """
+    data = {
+        "classifications": [TDE_CLASSIFICATION],
+        "numPerPage": NUM_PER_PAGE,
+        "pageNumber": page,
+    }
+    if modified_after is not None:
+        data["modifiedAfter"] = modified_after.isoformat()
+
+    response = client.api("get", endpoint="sources", data=data)
+    response.raise_for_status()
+    res = response.json()["data"]
+    return [x["id"] for x in res["sources"]], res["totalMatches"]
+
+
+def download_known_tdes(
+    client: SkyportalClient,
+    modified_after: datetime | None = None,
+    n_threads: int = DEFAULT_N_THREADS,
+) -> set[str]:
+    """
+    Download all pages of the sources classified as TDEs, requesting the
+    pages after the first concurrently
+
+    :param client: SkyPortal client
+    :param modified_after: Only get sources modified after this time, or None for all
+    :param n_threads: Number of concurrent requests
+    :return: Source names
+    """
+    names, n_matches = fetch_page(client, 1, modified_after=modified_after)
+    n_pages = -(-n_matches // NUM_PER_PAGE)
+
+    names = set(names)
+
+    if n_pages > 1:
+        with ThreadPoolExecutor(max_workers=min(n_threads, n_pages - 1)) as executor:
+            pages = executor.map(
+                lambda x: fetch_page(client, x, modified_after=modified_after)[0],
+                range(2, n_pages + 1),
+            )
+            for page in pages:
+                names.update(page)
+
+    logger.debug(f"Found {len(names)} TDEs on SkyPortal, expected {n_matches}")
+
+    if len(names) < n_matches:
+        raise RuntimeError(
+            f"Only found {len(names)} TDEs on SkyPortal, expected {n_matches}"
+        )
+
+    return names
+
+
+def refresh_known_tdes(
+    catalogue: KnownTDECatalogue,
+    full: bool = False,
+    client: SkyportalClient | None = None,
+) -> KnownTDECatalogue:
+    """
+    Update the catalogue from SkyPortal, and save it
+
+    :param catalogue: Cached catalogue
+    :param full: Whether to download all known TDEs, rather than only
+        those modified since the last refresh
+    :param client: SkyPortal client, or None to create one
+    :return: Updated catalogue
+    """
+    now = datetime.now(timezone.utc)
+    full = full or catalogue.needs_full_refresh(now)
+
+    if client is None:
+        client = SkyportalClient(
+            max_requests_per_second=DEFAULT_MAX_REQUESTS_PER_SECOND,
+            pool_size=max(DEFAULT_N_THREADS, DEFAULT_POOL_SIZE),
+        )
+    client.set_up_session()
+
+    if full:
+        logger.info("Downloading all known TDEs from SkyPortal")
+        catalogue = KnownTDECatalogue(
+            names=download_known_tdes(client), last_refresh=now, last_full_refresh=now,
+        )
+    else:
+        modified_after = catalogue.last_refresh - MODIFIED_MARGIN
+        new = download_known_tdes(client, modified_after=modified_after)
+        logger.info(f"Found {len(new - catalogue.names)} new known TDEs on SkyPortal")
+        catalogue.names |= new
+        catalogue.last_refresh = now
+
+    catalogue.save()
+    return catalogue
+
+
+def get_known_tde_catalogue(refresh: bool | None = None) -> KnownTDECatalogue:
+    """
+    Get the catalogue of known TDEs, refreshing it from SkyPortal if stale
+
+    :param refresh: Whether to refresh the catalogue, or None to refresh
+        it only if it is older than its time-to-live
+    :return: Catalogue
+    """
+    with _lock:
+        catalogue = KnownTDECatalogue.load()
+
+        if refresh is None:
+            refresh = catalogue.is_stale(datetime.now(timezone.utc))
+
+        if not refresh:
+            return catalogue
+
+        try:
+            catalogue = refresh_known_tdes(catalogue)
+        except NoCredentialsError:
+            pass
+        except (RequestException, RuntimeError, KeyError, ValueError) as e:
+            logger.warning(
+                f"Failed to refresh known TDEs from SkyPortal ({e}), "
+                f"using {len(catalogue.names)} cached known TDEs"
+            )
+
+    return catalogue
+
+
+def get_known_tdes() -> set[str]:
+    """
+    Get the names of the known TDEs
+
+    :return: Set of source names
+    """
+    names = get_known_tde_catalogue().names
+    if len(names) == 0:
+        logger.warning("No Skyportal TDEs found")
+    return names
@@ -3,7 +3,9 @@ from slack_sdk import WebClient
 from dotenv import load_dotenv
 import os
 from pathlib import Path
+from urllib.parse import parse_qsl
 from scantde.utils import get_current_datestr
+from scantde.htmlutils.page_cache import PageParams
 
 load_dotenv()
 
@@ -14,12 +16,31 @@ BASE_URL = os.getenv('BASE_PUBLIC_URL', "http://127.0.0.1:5000")
 EXT = os.getenv("SERVER_EXT", None)
 PUBLIC_URL = f"{os.path.join(BASE_URL, EXT)}" if EXT else BASE_URL
 
+SLACK_URL_EXT = "lookback_days=1&min_score=0.01&hide_junk=on&mode=all"
+
+
+def get_slack_page_params(
+    datestr: str,
+    selection: str = "tdescore",
+    url_ext: str = SLACK_URL_EXT,
+) -> PageParams:
+    """
+    Get the parameters of the date page linked from slack
+
+    :param datestr: Date string in the format YYYYMMDD
+    :param selection: Selection type (e.g., 'tdescore')
+    :param url_ext: Query arguments of the link
+    :return: PageParams
+    """
+    args = {**dict(parse_qsl(url_ext)), "date": datestr, "selection": selection}
+    return PageParams.from_args(args)
+
 
 def send_to_slack(
     datestr: str,
     selection: str = "tdescore",
     slack_channel: str = "ztf-scantde-o4",
-    url_ext: str = "lookback_days=1&min_score=0.01&hide_junk=on&mode=all",
+    url_ext: str = SLACK_URL_EXT,
 ):
 
     alt_datestr = f"{datestr[:4]}-{datestr[4:6]}-{datestr[6:]}"